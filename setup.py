@@ -46,6 +46,7 @@ setuptools.setup(
     tests_require=[
         "pytest",
         "lxml",
+        "fakeredis",
     ],
     setup_requires=[
         "pytest-runner",
@@ -55,5 +56,7 @@ setuptools.setup(
     [pyramid.scaffold]
     pyramid_epfl_starter=solute.epfl.scaffolds:EPFLStarterTemplate
     pyramid_epfl_tutorial=solute.epfl.scaffolds:EPFLTutorialTemplate
+    [console_scripts]
+    epfl_analyze_transactions=solute.epfl.core.epflanalyzer:main
     """
 )
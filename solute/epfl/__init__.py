@@ -231,6 +231,11 @@ def includeme(config):
     if config.get_settings().get('epfl.active_modules', '').find(',') != -1:
         raise DeprecationWarning('Commas in epfl.active_modules are deprecated - remove them. Use one line per module')
 
+    # Only the redis_hash store merges the changes of concurrent requests, every other store loses all but the last.
+    if asbool(config.get_settings().get('epfl.parallel_requests', False)) \
+            and config.get_settings().get('epfl.transaction.store') != 'redis_hash':
+        raise Exception('epfl.parallel_requests requires epfl.transaction.store = redis_hash')
+
     config.include('pyramid_jinja2')
 
     config.add_renderer('.html', 'pyramid_jinja2.renderer_factory')
@@ -94,6 +94,6 @@ class Checkbox(FormInputBase):
         group = self.group
         if value is True:
             for chbox in group:
-                check_box = getattr(self.page, chbox)
+                check_box = self.page.components[chbox]
                 check_box.handle_change(False)
         self.redraw()
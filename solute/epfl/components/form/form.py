@@ -70,9 +70,10 @@ class Form(epflcomponentbase.ComponentContainerBase):
     def registered_names(self):
         if self._registered_fields is None:
             self._registered_fields = set()
-        return dict([
-            (self.page.components[cid].name, self.page.components[cid]) for cid in self._registered_fields
-            if hasattr(self.page.components[cid], 'name') and self.page.components[cid].name is not None])
+        # Views only instantiate the fields once they are actually used.
+        class_cache = {}
+        fields = [epflcomponentbase.ComponentView(self.page, cid, class_cache) for cid in self._registered_fields]
+        return dict([(field.name, field) for field in fields if getattr(field, 'name', None) is not None])
 
     def set_value(self, key, value):
         for field in self.registered_fields:
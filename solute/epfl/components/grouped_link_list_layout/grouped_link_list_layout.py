@@ -19,6 +19,7 @@ class GroupedLinkListLayout(LinkListLayout):
     use_headings = False  #: Use menu_group strings as headings instead of submenus.
     #: Add the specific list type for the grouped list layout. see :attr:`ListLayout.list_type`
     list_type = LinkListLayout.list_type + ['grouped']
+    structural_updates = False  #: Children are rendered in groups, changes redraw the whole list.
 
     def __init__(self, page, cid,
                  node_list=None,
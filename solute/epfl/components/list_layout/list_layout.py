@@ -14,6 +14,8 @@ class ListLayout(epflcomponentbase.ComponentContainerBase):
     #: inheriting lists should override this attribute. It may be used in parent lists to
     #: identify the actual list type
     list_type = ["list-layout"]
+    #: Every child is rendered in the same row markup, data driven changes are sent as structural operations.
+    structural_updates = True
 
     def __init__(self, page, cid,
                  node_list=None,
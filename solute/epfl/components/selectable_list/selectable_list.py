@@ -190,7 +190,7 @@ class SelectableList(LinkListLayout):
 
     def update_children(self, force=False):
         result = super(SelectableList, self).update_children(force=force)
-        for compo in self.components:
+        for compo in self.components.views():
             if compo.id in self.selected_ids:
                 compo.active = True
         return result
@@ -26,6 +26,9 @@ class TableLayout(PaginatedListLayout):
     compo_js_params = PaginatedListLayout.compo_js_params + ['fixed_header']
     compo_js_extras = ['handle_click']
 
+    # derived attribute overrides
+    structural_updates = False  #: Children are placed in slots, changes redraw the whole table.
+
     # custom compo settings
     ROW_DEFAULT = "row-default"  #: Row color constant
     ROW_PRIMARY = "row-primary"  #: Row color constant
@@ -35,7 +35,7 @@ epfl.TextInput.prototype.after_response = function(data) {
     if (this.params.typeahead) {
         var type_function = function(query, process){
             var get_source = function(epfl_event){
-                epfl.send(epfl_event, function(response){
+                epfl.send_parallel(epfl_event, function(response){
                     if(response && response !== "") {
                         var i = 0, result_set = [];
                         for (i; i < response.length; i++) {
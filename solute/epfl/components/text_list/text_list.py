@@ -20,6 +20,7 @@ class TextList(PaginatedListLayout):
     compo_js_name = 'TextList'
 
     # derived attribute overrides
+    structural_updates = False  #: The rows are rendered by the theme instead of the children.
     default_child_cls = epflcomponentbase.ComponentBase
     data_interface = {'id': None,
                       'text': None}
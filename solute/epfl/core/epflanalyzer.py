@@ -0,0 +1,218 @@
+# coding: utf-8
+
+"""
+Size accounting for stored :class:`~solute.epfl.core.epfltransaction.Transaction` data. A :class:`SizeReport` breaks
+the encoded size of transactions down to component classes and their compo_state attributes. It is used per request by
+:meth:`~solute.epfl.core.epfltransaction.Transaction.log_size` and offline by the epfl_analyze_transactions command,
+which scans the transactions of a redis store:
+
+    epfl_analyze_transactions development.ini --limit 20
+"""
+
+import sys
+import argparse
+from collections import defaultdict
+
+from redis import StrictRedis
+
+from solute.epfl.core.epflcodec import TransactionCodec
+
+
+class ClassSize(object):
+    """Accumulated sizes of all components of one class.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0  #: Number of components.
+        self.bytes = 0  #: Encoded size of their compo_infos.
+        self.state_bytes = 0  #: Encoded size of their compo_state.
+        self.config_bytes = 0  #: Encoded size of their config.
+        self.sleeping_count = 0  #: Number of sleeping components.
+        self.sleeping_bytes = 0  #: Encoded size of the compo_infos of sleeping components.
+        #: Encoded size of the compo_state attributes by name.
+        self.attribute_bytes = defaultdict(int)
+
+
+class SizeReport(object):
+    """Collects the encoded sizes of one or more transactions.
+    """
+
+    def __init__(self, codec=None):
+        """
+        :param codec: (optional) The :class:`~solute.epfl.core.epflcodec.TransactionCodec` used to measure sizes.
+        """
+        self.codec = codec or TransactionCodec()
+        self.classes = {}
+        #: List of (bytes, transaction id, number of components).
+        self.transactions = []
+
+    def measure(self, value):
+        try:
+            return len(self.codec.dumps(value))
+        except Exception:
+            return 0
+
+    def add_transaction(self, tid, data, raw=None):
+        """Add the data of a transaction to the report.
+
+        :param tid: The transaction id.
+        :param data: The transaction data as loaded by :attr:`~solute.epfl.core.epfltransaction.Transaction.data`.
+        :param raw: (optional) dict of already encoded compo_infos by component id, used instead of encoding them again.
+        """
+        raw = raw or {}
+        compo_store = data.get('compo_store', {})
+        sleeping_cids = set()
+        for cid in compo_store.keys():
+            sleeping_cids.update(compo_store[cid].get('sleeping_compo_struct', {}).values())
+
+        total = self.measure(dict((key, value) for key, value in data.items() if key != 'compo_store'))
+        for cid in compo_store.keys():
+            compo_info = compo_store[cid]
+            compo_bytes = len(raw[cid]) if cid in raw else self.measure(compo_info)
+            total += compo_bytes
+
+            class_size = self.get_class_size(compo_info, data.get('__class_table__'))
+            class_size.count += 1
+            class_size.bytes += compo_bytes
+            class_size.config_bytes += self.measure(compo_info.get('config', {}))
+            compo_state = compo_info.get('compo_state', {})
+            class_size.state_bytes += self.measure(compo_state)
+            for name, value in compo_state.items():
+                class_size.attribute_bytes[name] += self.measure(value)
+            if cid in sleeping_cids:
+                class_size.sleeping_count += 1
+                class_size.sleeping_bytes += compo_bytes
+
+        self.transactions.append((total, tid, len(compo_store)))
+        return total
+
+    def get_class_size(self, compo_info, class_table=None):
+        """
+        :param compo_info: info dict of a component.
+        :param class_table: (optional) The class table of the transaction, used for compo_infos referencing it.
+        :returns: The :class:`ClassSize` of the class of the component.
+        """
+        compo_cls = compo_info.get('class', (None, ))
+        if type(compo_cls) is not tuple:
+            compo_cls = (class_table or {}).get(compo_cls, (compo_cls, ))
+        compo_cls = compo_cls[0]
+        name = getattr(compo_cls, '__name__', str(compo_cls))
+        if name not in self.classes:
+            self.classes[name] = ClassSize(name)
+        return self.classes[name]
+
+    def largest_transactions(self, limit=10):
+        return sorted(self.transactions, reverse=True)[:limit]
+
+    def largest_classes(self, limit=10):
+        return sorted(self.classes.values(), key=lambda class_size: class_size.bytes, reverse=True)[:limit]
+
+    def largest_attributes(self, limit=10):
+        """
+        :returns: List of (bytes, class name, attribute name).
+        """
+        attributes = [(attribute_bytes, class_size.name, name)
+                      for class_size in self.classes.values()
+                      for name, attribute_bytes in class_size.attribute_bytes.items()]
+        return sorted(attributes, reverse=True)[:limit]
+
+    def format(self, limit=10):
+        """
+        :returns: The report as text.
+        """
+        lines = ['Largest transactions:', '%12s %10s  %s' % ('bytes', 'components', 'tid')]
+        for total, tid, count in self.largest_transactions(limit):
+            lines.append('%12d %10d  %s' % (total, count, tid))
+
+        lines += ['', 'Largest component classes:',
+                  '%12s %10s %12s %12s %10s %12s  %s' % ('bytes', 'count', 'compo_state', 'config', 'sleeping',
+                                                         'sleep bytes', 'class')]
+        for class_size in self.largest_classes(limit):
+            lines.append('%12d %10d %12d %12d %10d %12d  %s' % (class_size.bytes, class_size.count,
+                                                                class_size.state_bytes, class_size.config_bytes,
+                                                                class_size.sleeping_count, class_size.sleeping_bytes,
+                                                                class_size.name))
+
+        lines += ['', 'Largest compo_state attributes:', '%12s  %s' % ('bytes', 'attribute')]
+        for attribute_bytes, class_name, name in self.largest_attributes(limit):
+            lines.append('%12d  %s.%s' % (attribute_bytes, class_name, name))
+        return '\n'.join(lines)
+
+
+def analyze_redis(client, codec, report=None, pattern='TA_*'):
+    """Add all transactions of a redis, redis_context or redis_hash store to a report. Versions of the redis_hash store
+    are measured by the fields they contain themselves, components shared with their base versions are not counted
+    again.
+
+    :param client: A redis client.
+    :param codec: The :class:`~solute.epfl.core.epflcodec.TransactionCodec` of the store.
+    :param report: (optional) The :class:`SizeReport` to be added to.
+    :returns: The :class:`SizeReport`.
+    """
+    from solute.epfl.core.epfltransaction import Transaction
+
+    report = report or SizeReport(codec)
+    prefix = Transaction.redis_hash_component_prefix
+    for key in client.scan_iter(pattern):
+        if key.endswith('_locked'):
+            continue
+        tid = key[3:]
+        key_type = client.type(key)
+        if key_type == 'string':
+            payload = client.get(key)
+            if payload:
+                report.add_transaction(tid, codec.loads(payload))
+        elif key_type == 'hash':
+            fields = client.hgetall(key)
+            meta = fields.get(Transaction.redis_hash_meta_field)
+            if meta is None:
+                continue
+            raw = dict((field[len(prefix):], value) for field, value in fields.items()
+                       if field.startswith(prefix) and value != Transaction.redis_hash_tombstone)
+            data = codec.loads(meta)
+            data['compo_store'] = dict((cid, codec.loads(value)) for cid, value in raw.items())
+            report.add_transaction(tid, data, raw)
+    return report
+
+
+def analyze_memory_store(memory_store, report=None):
+    """Add all transactions of a :class:`~solute.epfl.core.epfltransaction.MemoryStore` to a report. The memory store
+    only exists inside the application process, call this from a pshell or a debug view.
+
+    :param memory_store: The :class:`~solute.epfl.core.epfltransaction.MemoryStore`.
+    :param report: (optional) The :class:`SizeReport` to be added to.
+    :returns: The :class:`SizeReport`.
+    """
+    report = report or SizeReport(memory_store.codec)
+    for key in list(memory_store.entries.keys()):
+        data = memory_store.get(key)
+        if data is not None:
+            report.add_transaction(key[3:], data)
+    return report
+
+
+def main(argv=sys.argv):
+    """Entry point of the epfl_analyze_transactions command.
+    """
+    parser = argparse.ArgumentParser(description='Report the largest epfl transactions and the component classes and '
+                                                 'compo_state attributes responsible.')
+    parser.add_argument('config_uri', nargs='?', help='Configuration file of the application, e.g. development.ini.')
+    parser.add_argument('--url', help='Redis url overriding epfl.transaction.url.')
+    parser.add_argument('--limit', type=int, default=10, help='Number of entries per section.')
+    args = parser.parse_args(argv[1:])
+
+    settings = {}
+    if args.config_uri:
+        from pyramid.paster import get_appsettings
+        settings = get_appsettings(args.config_uri)
+
+    if settings.get('epfl.transaction.store') == 'memory' and not args.url:
+        sys.stderr.write('The memory store only exists inside the application process, use analyze_memory_store from '
+                         'a pshell instead.\n')
+        return 1
+
+    url = args.url or settings.get('epfl.transaction.url', 'redis://localhost:6379/0')
+    report = analyze_redis(StrictRedis.from_url(url), TransactionCodec.from_settings(settings))
+    print report.format(args.limit)
+    return 0
@@ -0,0 +1,209 @@
+# coding: utf-8
+
+"""
+Codecs used by the :class:`~solute.epfl.core.epfltransaction.Transaction` to serialize its data for external stores.
+
+Every encoded payload starts with a small frame header naming the codec and compression used, so data written with a
+different codec setting stays readable. Payloads without a frame header are treated as plain pickles as written by
+older versions of epfl.
+"""
+
+import cPickle as pickle
+import marshal
+import zlib
+
+# lz4 is optional, the lz4 compression setting is only available if it is installed.
+use_lz4 = True
+try:
+    import lz4.block
+except ImportError:
+    use_lz4 = False
+
+
+FRAME_MARKER = '\x00'  #: Pickles never start with a null byte, so framed payloads are distinguishable.
+
+
+class Codec(object):
+    """Base class of all codecs. A codec turns transaction data into a string and back.
+    """
+
+    #: Single character identifying the codec in the frame header.
+    codec_id = None
+
+    #: Codecs by their name as used in the epfl.transaction.codec setting.
+    registry = {}
+
+    @classmethod
+    def register(cls, name, codec_cls):
+        cls.registry[name] = codec_cls
+        return codec_cls
+
+    def dumps(self, data):
+        raise NotImplementedError('You have to implement the dumps method of the Codec!')
+
+    def loads(self, payload):
+        raise NotImplementedError('You have to implement the loads method of the Codec!')
+
+
+class PickleCodec(Codec):
+    """Pickles using the highest protocol available.
+    """
+    codec_id = 'p'
+
+    def dumps(self, data):
+        return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, payload):
+        return pickle.loads(payload)
+
+
+#: Types marshal restores exactly. Subclasses of these, like Markup, are marshalled as their base type and would lose
+#: their class, so only data built from exactly these types is marshalled.
+MARSHAL_SCALAR_TYPES = (type(None), bool, int, long, float, complex, str, unicode)
+MARSHAL_CONTAINER_TYPES = (tuple, list, set, frozenset)
+
+
+def is_marshallable(data):
+    """Checks recursively if data consists of builtin types only, so marshal restores it unchanged.
+
+    :param data: The data to check.
+    :returns: True if every value in data has an exact builtin type marshal supports.
+    """
+    data_type = type(data)
+    if data_type in MARSHAL_SCALAR_TYPES:
+        return True
+    if data_type in MARSHAL_CONTAINER_TYPES:
+        return all(is_marshallable(value) for value in data)
+    if data_type is dict:
+        return all(is_marshallable(key) and is_marshallable(value) for key, value in data.iteritems())
+    return False
+
+
+class MarshalCodec(Codec):
+    """Uses marshal for plain dict, list, set and scalar data which is more compact and faster than pickle. Data
+    containing anything else, like classes, instances of custom classes or subclasses of builtin types, is pickled
+    instead.
+    """
+    codec_id = 'm'
+
+    def dumps(self, data):
+        if is_marshallable(data):
+            return 'm' + marshal.dumps(data)
+        return 'p' + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, payload):
+        if payload[0] == 'm':
+            return marshal.loads(payload[1:])
+        return pickle.loads(payload[1:])
+
+
+Codec.register('pickle', PickleCodec)
+Codec.register('marshal', MarshalCodec)
+
+
+class Compression(object):
+    """Compression applied to encoded payloads exceeding a size threshold.
+    """
+
+    #: Single character identifying the compression in the frame header.
+    compression_id = '-'
+    #: False if a required optional package is missing.
+    available = True
+
+    #: Compressions by their name as used in the epfl.transaction.compression setting.
+    registry = {}
+
+    def __init__(self, level=1):
+        self.level = level
+
+    @classmethod
+    def register(cls, name, compression_cls):
+        cls.registry[name] = compression_cls
+        return compression_cls
+
+    def compress(self, payload):
+        return payload
+
+    def decompress(self, payload):
+        return payload
+
+
+class ZlibCompression(Compression):
+    compression_id = 'z'
+
+    def compress(self, payload):
+        return zlib.compress(payload, self.level)
+
+    def decompress(self, payload):
+        return zlib.decompress(payload)
+
+
+class LZ4Compression(Compression):
+    compression_id = 'l'
+    available = use_lz4
+
+    def compress(self, payload):
+        return lz4.block.compress(payload)
+
+    def decompress(self, payload):
+        return lz4.block.decompress(payload)
+
+
+Compression.register('none', Compression)
+Compression.register('zlib', ZlibCompression)
+Compression.register('lz4', LZ4Compression)
+
+
+class TransactionCodec(object):
+    """Combines a :class:`Codec` and a :class:`Compression` and handles the frame header. Decoding works for every
+    registered codec and compression regardless of the configured ones.
+    """
+
+    def __init__(self, codec='pickle', compression='none', threshold=4096, level=1):
+        """
+        :param codec: Name of the codec used for encoding.
+        :param compression: Name of the compression used for encoding.
+        :param threshold: Encoded payloads smaller than this many bytes are not compressed.
+        :param level: Compression level, if the compression supports one.
+        """
+        if codec not in Codec.registry:
+            raise Exception('Unknown transaction codec %r!' % codec)
+        if compression not in Compression.registry:
+            raise Exception('Unknown transaction compression %r!' % compression)
+        if not Compression.registry[compression].available:
+            raise Exception('Transaction compression %r is missing its optional dependency!' % compression)
+
+        self.codec = Codec.registry[codec]()
+        self.compression = Compression.registry[compression](level)
+        self.threshold = threshold
+
+        self.codecs = dict((cls.codec_id, cls()) for cls in Codec.registry.values())
+        self.compressions = dict((cls.compression_id, cls(level)) for cls in Compression.registry.values()
+                                 if cls.available)
+        self.uncompressed = self.compressions[Compression.compression_id]
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Create the codec configured by epfl.transaction.codec, epfl.transaction.compression,
+        epfl.transaction.compression_threshold and epfl.transaction.compression_level.
+
+        :param settings: The pyramid registry settings.
+        """
+        return cls(codec=settings.get('epfl.transaction.codec', 'pickle'),
+                   compression=settings.get('epfl.transaction.compression', 'none'),
+                   threshold=int(settings.get('epfl.transaction.compression_threshold', 4096)),
+                   level=int(settings.get('epfl.transaction.compression_level', 1)))
+
+    def dumps(self, data):
+        payload = self.codec.dumps(data)
+        compression = self.compression
+        if len(payload) < self.threshold:
+            compression = self.uncompressed
+        return FRAME_MARKER + self.codec.codec_id + compression.compression_id + compression.compress(payload)
+
+    def loads(self, payload):
+        if payload[0] != FRAME_MARKER:
+            return pickle.loads(payload)
+
+        codec_id, compression_id = payload[1], payload[2]
+        return self.codecs[codec_id].loads(self.compressions[compression_id].decompress(payload[3:]))
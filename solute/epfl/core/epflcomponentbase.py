@@ -3,16 +3,21 @@ from collections import MutableSequence, MutableMapping
 import types
 import copy
 import inspect
+import hashlib
+import os
 
 from pyramid import security
+from pyramid.settings import asbool
 import ujson as json
 import jinja2
 import jinja2.runtime
 from jinja2.exceptions import TemplateNotFound
+from collections2 import OrderedDict as odict
 
 from solute.epfl.core import epflutil, epflacl, epflvalidators
-from solute.epfl.core.epfldescriptor import Descriptor, Reference, CompoStateAttribute
-from solute.epfl.core.epflutil import Lifecycle, generate_dynamic_class_id, generate_cid
+from solute.epfl.core.epfldescriptor import Descriptor, Reference, CompoStateAttribute, FastCompoStateAttribute, MISSING
+from solute.epfl.core.epflutil import Lifecycle, generate_dynamic_class_id, generate_cid, is_immutable, freeze, \
+    longest_increasing_subsequence
 
 
 class MissingContainerComponentException(Exception):
@@ -144,6 +149,17 @@ class UnboundComponent(object):
     instantiated component if it is called with an :class:`.UnboundComponent`.
     """
     __dynamic_class_store__ = None  #: Internal caching for :attr:`UnboundComponent.__dynamic_class__`
+    #: Config of the UnboundComponent this one has been derived from by calling it, e.g. a default_child_cls.
+    __unbound_base_config__ = None
+    #: Interned dynamic classes by base class and class config, least recently used first.
+    __dynamic_class_cache__ = odict()
+    dynamic_class_cache_size = 1000  #: Maximum number of interned dynamic classes.
+
+    #: Config entries that are read from the component class and can not be set per instance.
+    class_attributes = frozenset(['template_name', 'js_parts', 'js_name', 'js_name_no_bundle', 'css_name',
+                                  'css_name_no_bundle', 'compo_state', 'compo_config', 'base_compo_state', 'theme_path',
+                                  'theme_path_default', 'compo_js_auto_parts', 'compo_js_name', 'compo_js_params',
+                                  'compo_js_extras', 'new_style_compo', 'disable_auto_update'])
 
     def __init__(self, cls, config):
         """
@@ -173,7 +189,9 @@ class UnboundComponent(object):
         if kwargs.pop('__instantiate__', None) is None:
             config = self.__unbound_config__.copy()
             config.update(kwargs)
-            return UnboundComponent(self.__unbound_cls__, config)
+            ubc = UnboundComponent(self.__unbound_cls__, config)
+            ubc.__unbound_base_config__ = self.__unbound_config__
+            return ubc
         else:
             if 'config' in kwargs:
                 kwargs.update(kwargs.pop('config'))
@@ -182,7 +200,27 @@ class UnboundComponent(object):
             kwargs['__instantiate__'] = True
 
         cls = self.__dynamic_class__
-        return cls(*args, **kwargs)
+        if cls is not self.__unbound_cls__ and cls.__dict__.get('___unbound_component__') is self:
+            # Not interned, the class carries the complete config.
+            return cls(*args, **kwargs)
+
+        compo = cls.__new__(cls, *args, **kwargs)
+        compo.___unbound_component__ = self
+        compo.__instance_config__ = {}
+        class_config = cls.__dict__.get('__epfl_class_config__', ())
+        for name, value in self.__unbound_config__.items():
+            if name in class_config or name == '__autogen_cid__':
+                continue
+            if name in compo.compo_config:
+                # Values given as keyword arguments have already been copied by ComponentBase.__new__.
+                if name not in kwargs:
+                    setattr(compo, name, copy.copy(value))
+            elif name in compo.combined_compo_state:
+                compo.__instance_config__[name] = value
+            else:
+                compo.__dict__[name] = value
+        compo.__init__(*args, **kwargs)
+        return compo
 
     @classmethod
     def create_from_state(cls, state):
@@ -193,39 +231,118 @@ class UnboundComponent(object):
     @property
     def __dynamic_class__(self):
         """
-        If the config contains entries besides cid and slot a dynamic class is returned. This offers just in time
-        creation of the actual class object to be used by epfl.
+        If the config contains entries affecting the class, like methods, templates or the compo_state, a dynamic class
+        is returned. Dynamic classes are interned per base class and class config, so they are created once per shape
+        of config and not once per component. All other config entries are applied to the instance by
+        :meth:`__call__`.
         """
         if self.__dynamic_class_store__:
             return self.__dynamic_class_store__
 
-        stripped_conf = self.__unbound_config__.copy()
-        stripped_conf.pop('cid', None)
-        stripped_conf.pop('slot', None)
-        if len(stripped_conf) > 0:
-            name = self.__unbound_cls__.__name__ + '_auto_' + generate_dynamic_class_id()
-            self.__dynamic_class_store__ = type(name, (self.__unbound_cls__, ), self.__unbound_config__)
+        class_config = self.get_class_config()
+        if not class_config:
+            return self.__unbound_cls__
 
+        try:
+            key = self.__unbound_cls__, freeze(class_config)
+        except TypeError:
+            # Class config that can not be compared is not interned, the class keeps the complete config.
+            self.__dynamic_class_store__ = self.create_dynamic_class(self.__unbound_config__)
             setattr(self.__dynamic_class_store__, '___unbound_component__', self)
-            setattr(self.__dynamic_class_store__, '__epfl_do_not_track', True)
-
             return self.__dynamic_class_store__
 
-        else:
-            return self.__unbound_cls__
+        cache = UnboundComponent.__dynamic_class_cache__
+        dynamic_class = cache.pop(key, None)
+        if dynamic_class is None:
+            dynamic_class = self.create_dynamic_class(class_config)
+            if len(cache) >= self.dynamic_class_cache_size:
+                cache.popitem(last=False)
+        cache[key] = dynamic_class
+
+        self.__dynamic_class_store__ = dynamic_class
+        return dynamic_class
+
+    def create_dynamic_class(self, class_config):
+        name = self.__unbound_cls__.__name__ + '_auto_' + generate_dynamic_class_id()
+        dynamic_class = type(name, (self.__unbound_cls__, ), class_config)
+        setattr(dynamic_class, '__epfl_do_not_track', True)
+        setattr(dynamic_class, '__epfl_class_config__', frozenset(class_config))
+        return dynamic_class
+
+    def get_class_config(self):
+        """Returns the entries of the config that have to be set on the class: Attributes only read from the class,
+        methods and other descriptors and everything overwriting a descriptor of the class. Values of the compo_state
+        are instance config, as are all other plain values.
+        """
+        cls = self.__unbound_cls__
+        config = self.__unbound_config__
+        compo_state = set(config.get('base_compo_state', cls.base_compo_state)).union(
+            config.get('compo_state', cls.compo_state))
+
+        class_config = {}
+        for name, value in config.items():
+            if name in ('cid', 'slot', '__autogen_cid__'):
+                continue
+            original = None
+            for base in cls.__mro__:
+                if name in base.__dict__:
+                    original = base.__dict__[name]
+                    break
+            if name in self.class_attributes \
+                    or isinstance(original, (types.FunctionType, types.MethodType)) \
+                    or (name not in compo_state and hasattr(value, '__get__')) \
+                    or (hasattr(original, '__set__') and not isinstance(original, CompoStateAttribute)):
+                class_config[name] = value
+        return class_config
 
     def register_in_transaction(self, container, slot=None, position=None):
-        compo_info = {'class': self.__getstate__(),
-                      'config': self.__unbound_config__,
-                      'ccid': container.cid,
-                      'cid': self.position[0],
-                      'slot': slot}
+        transaction = container.page.transaction
+        compo_info = self.get_component_info(container, slot)
+        cid = compo_info['cid']
+
         try:
-            container.page.transaction.set_component(self.position[0], compo_info, position=position)
+            transaction.set_component(cid, compo_info, position=position)
         except Exception:
-            if self.position[0] == self.__unbound_config__.get('__autogen_cid__'):
+            if self.has_autogen_cid():
                 return self(cid=None).register_in_transaction(container, slot, position)
-        return container.page.transaction.get_component_instance(container.page, self.position[0])
+        return transaction.get_component_instance(container.page, cid)
+
+    def has_autogen_cid(self):
+        """
+        :returns: True if the cid has been generated and may be replaced in case of a collision.
+        """
+        return self.position[0] == self.__unbound_config__.get('__autogen_cid__')
+
+    def get_component_info(self, container, slot=None):
+        """
+        :param container: The :class:`ComponentContainerBase` the component is added to.
+        :param slot: (optional) The slot of the container.
+        :returns: The info dict of the component to be set in the transaction of the container.
+        """
+        transaction = container.page.transaction
+        cid, unbound_config = self.position[0], self.__unbound_config__
+        if transaction.compact_cids and cid == unbound_config.get('__autogen_cid__'):
+            cid = transaction.generate_cid()
+            unbound_config = dict(unbound_config, __autogen_cid__=cid)
+
+        compo_info = {'class': (self.__unbound_cls__, unbound_config, (cid, self.position[1])),
+                      'config': unbound_config,
+                      'ccid': container.cid,
+                      'cid': cid,
+                      'slot': slot}
+
+        # Config entries taken over unchanged from the base config are shared with all siblings derived from it.
+        if self.__unbound_base_config__:
+            shared_config, config = {}, {}
+            for name, value in unbound_config.items():
+                if self.__unbound_base_config__.get(name, MISSING) is value:
+                    shared_config[name] = value
+                else:
+                    config[name] = value
+            class_key = transaction.intern_class_state(self.__unbound_cls__, shared_config)
+            if class_key is not None:
+                compo_info['class'], compo_info['config'] = class_key, config
+        return compo_info
 
     def __getstate__(self):
         """
@@ -317,6 +434,8 @@ class ComponentBase(object):
     #: Internal reference to this Components :class:`UnboundComponent`. If it is None and something breaks because of it
     #: this component has not been correctly passed through the :func:`__new__`/:class:`UnboundComponent` pipe.
     ___unbound_component__ = None
+    #: Values of the compo_state given in the config of this instance, used as initial values by :meth:`get_state_attr`.
+    __instance_config__ = {}
 
     epfl_event_trace = None  #: Contains a list of CIDs an event bubbled through. Only available in handle\_ methods
 
@@ -327,6 +446,8 @@ class ComponentBase(object):
 
     is_rendered = False  #: True if this component was rendered calling :meth:`render`
     redraw_requested = False  #: Flag if this component wants to be redrawn.
+    #: The render record of this component as stored before it was rendered this request, see :meth:`record_render`.
+    previous_render = None
 
     _compo_info = None  #: Compo_info cache.
     _handles = None  #: Cache for a list of handle_event functions this component provides.
@@ -368,6 +489,11 @@ class ComponentBase(object):
 
     skip_child_access = False  #: Skip the has_access check for child components generated by update_children.
 
+    #: Lifecycle hooks the page calls on the active components every request.
+    lifecycle_hooks = ('setup_component', 'after_event_handling', 'finalize')
+    #: The lifecycle hooks implemented by this class, set by :meth:`discover`. The page only calls these.
+    subscribed_lifecycle_hooks = frozenset(lifecycle_hooks)
+
     @classmethod
     def add_pyramid_routes(cls, config):
         """ Adds the static pyramid routes needed by this component. This only works for native components stored in
@@ -417,14 +543,18 @@ class ComponentBase(object):
 
     def get_state_attr(self, key, value=None):
         """Get the attribute as stored in the compo_state or return the original value. If the original value is not
-        hashable - as all mutable builtins are - a copy is generated in the compo state.
+        hashable - as all mutable builtins are - a copy is generated in the compo state. Mutable values may be changed
+        in place by the caller, so the component is watched for changes by the transaction.
         """
         try:
             result = self.compo_info['compo_state'][key]
             if isinstance(result, Descriptor):
                 return result.__get__(self, self.__class__)
+            if not is_immutable(result):
+                self.page.transaction.watch_component(self.cid)
             return result
         except KeyError:
+            value = self.__instance_config__.get(key, value)
             if isinstance(value, Descriptor):
                 return value.__get__(self, self.__class__)
             try:
@@ -436,10 +566,43 @@ class ComponentBase(object):
             return value
 
     def set_state_attr(self, key, value):
-        if isinstance(self.compo_info.setdefault('compo_state', {}).get(key), Descriptor):
-            self.compo_info['compo_state'][key].__set__(self, value)
-        else:
-            self.compo_info.setdefault('compo_state', {})[key] = value
+        compo_state = self.compo_info.setdefault('compo_state', {})
+        current = compo_state.get(key)
+        if isinstance(current, Descriptor):
+            current.__set__(self, value)
+            return
+        # Assigning an equal immutable value is no change worth storing.
+        if key in compo_state and type(current) is type(value) and is_immutable(value) and current == value:
+            return
+        compo_state[key] = value
+        self.page.transaction.mark_component_dirty(self.cid)
+
+    def get_state_default(self, key):
+        """
+        :param key: Name of a compo_state attribute.
+        :returns: The value the attribute has as long as it is not stored in the compo_state, MISSING if key is not a
+                  compo_state attribute of this component.
+        """
+        if key in self.__instance_config__:
+            return self.__instance_config__[key]
+        attribute = getattr(type(self), key, None)
+        if isinstance(attribute, CompoStateAttribute):
+            return attribute.initial_value
+        return MISSING
+
+    def compact_compo_state(self):
+        """Remove all values from the compo_state that equal their defaults, so they are not stored. Reading them
+        again yields the default. Used by the sparse state mode of the :class:`.epfltransaction.Transaction`.
+        """
+        compo_state = self.compo_info.get('compo_state')
+        if not compo_state:
+            return
+        for key, value in compo_state.items():
+            default = self.get_state_default(key)
+            if default is MISSING or isinstance(value, Descriptor) or isinstance(default, Descriptor):
+                continue
+            if type(value) is type(default) and value == default:
+                del compo_state[key]
 
     @property
     def reflect(self):
@@ -461,7 +624,7 @@ class ComponentBase(object):
 
     @property
     def position(self):
-        return self.container_compo.compo_info['compo_struct'].index(self.cid)
+        return self.page.transaction.get_component_position(self.cid)
 
     @property
     def slot(self):
@@ -489,6 +652,7 @@ class ComponentBase(object):
     @container_slot.setter
     def container_slot(self, value):
         self.compo_info['slot'] = value
+        self.page.transaction.mark_component_dirty(self.cid)
 
     @property
     def container_compo(self):
@@ -496,11 +660,12 @@ class ComponentBase(object):
                 or 'ccid' not in self.compo_info\
                 or self.compo_info['ccid'] is None:
             return None
-        return getattr(self.page, self.compo_info['ccid'])
+        return self.page.components[self.compo_info['ccid']]
 
     @container_compo.setter
     def container_compo(self, value):
         self.compo_info['ccid'] = value.cid
+        self.page.transaction.mark_component_dirty(self.cid)
 
     def get_component_info(self):
         info = {"class": self.__unbound_component__.__getstate__(),
@@ -632,6 +797,16 @@ class ComponentBase(object):
             if self.validation_type in ['email', 'text', 'number', 'float']:
                 self.validators.insert(0, epflvalidators.ValidatorBase.by_name(self.validation_type)())
 
+    def init_added_component(self):
+        """Run :meth:`init_transaction` for a component added to the transaction by its container. Outside of
+        :meth:`.epflpage.Page.handle_transaction`, which sets up all active components itself, :meth:`setup_component`
+        is run as well.
+        """
+        self.init_transaction()
+        self.page.transaction['__initialized_components__'].add(self.cid)
+        if ('page', 'handle_transaction') not in Lifecycle.get_state():
+            self.setup_component()
+
     @Lifecycle(name=('component', 'setup_component'))
     def setup_component(self):
         """ Called from the system every request when the component-state of all components in the page is setup. Here
@@ -780,6 +955,8 @@ class ComponentBase(object):
         if not self.is_visible(False):
             # this is the container where the component can be placed if visible afterwards
             self.render_cache['main'] = jinja2.Markup("<div epflid='{cid}'></div>".format(cid=self.cid))
+            if self.page.patch_redraws:
+                self.record_render()
             return self.render_cache[target]
 
         if self.components:
@@ -788,6 +965,7 @@ class ComponentBase(object):
             js_raw = []
 
         self.is_rendered = True
+        self.page.transaction.rendered_classes[type(self)] = None
 
         # Prepare the environment and output of the render process.
         env = self.page.request.get_epfl_jinja2_environment()
@@ -804,21 +982,121 @@ class ComponentBase(object):
         self.render_cache['main'] = jinja2.Markup(template.render(context))
 
         self.render_cache['js_raw'] = ''.join(js_raw)
+        if self.page.patch_redraws:
+            self.record_render()
 
         return self.render_cache[target]
 
+    def record_render(self):
+        """Store a record of the output of this render in the compo_info, only used if the page patches redraws. The
+        record holds a hash of the output, the render stamp of this request and the render stamp of the last render
+        of the container component that included this component. If the latter equals the render stamp of the
+        container itself, this component is still part of the DOM of the container on the client.
+        """
+        transaction = self.page.transaction
+        compo_info = self.compo_info
+        self.previous_render = previous = compo_info.get('render')
+
+        container = transaction.instances.get(compo_info.get('ccid'))
+        if container is not None and container.render_cache is not None:
+            container_stamp = transaction.render_stamp
+        else:
+            container_stamp = previous[2] if previous else None
+
+        output_hash = hashlib.md5()
+        for output in (self.render_cache['main'], self.render_cache['js_raw']):
+            output_hash.update(output.encode('utf-8') if type(output) is not str else output)
+            output_hash.update('\0')
+
+        record = (output_hash.hexdigest()[:16], transaction.render_stamp, container_stamp)
+        if record != previous:
+            compo_info['render'] = record
+            transaction.mark_component_dirty(self.cid)
+
+    def get_redraw_parts(self):
+        """The parts sent to epfl.replace_component to redraw this component in an AJAX request. If the page patches
+        redraws the output of descendants that did not change since they were sent to the client is replaced by
+        placeholders listed in the keep part, the client moves their existing DOM into the new output instead. Falls
+        back to the full output if no descendant can be kept or the patch is not smaller.
+
+        :returns: dict with the parts js, main and optionally keep.
+        """
+        parts = {'js': self.render('js_raw'), 'main': self.render()}
+        if not self.page.patch_redraws or self.previous_render is None:
+            return parts
+
+        main, js = unicode(parts['main']), parts['js']
+        main_chunks, js_chunks, keep = [], [], []
+        main_pos = js_pos = 0
+        for compo in self.get_unchanged_descendants(self.previous_render[1]):
+            compo_main, compo_js = unicode(compo.render_cache['main']), compo.render_cache['js_raw']
+            main_index, js_index = main.find(compo_main, main_pos), js.find(compo_js, js_pos)
+            if main_index < 0 or js_index < 0:
+                # Not in output order, e.g. placed in a different slot, the component is sent in full.
+                continue
+            main_chunks += [main[main_pos:main_index],
+                            u"<div epflid='{cid}' data-epfl-keep='1'></div>".format(cid=compo.cid)]
+            js_chunks.append(js[js_pos:js_index])
+            main_pos, js_pos = main_index + len(compo_main), js_index + len(compo_js)
+            keep.append(compo.cid)
+
+        if not keep:
+            return parts
+        main_chunks.append(main[main_pos:])
+        js_chunks.append(js[js_pos:])
+        patch = {'js': ''.join(js_chunks), 'main': u''.join(main_chunks), 'keep': keep}
+        if len(patch['main']) + len(patch['js']) + sum(len(cid) + 3 for cid in keep) >= len(main) + len(js):
+            return parts
+        return patch
+
+    def get_unchanged_descendants(self, stamp):
+        """The descendants whose output did not change since they were sent to the client as part of this component,
+        in output order. Descendants of unchanged components are not included.
+
+        :param stamp: The render stamp of the DOM of this component on the client.
+        """
+        unchanged = []
+        for compo in self.components or ():
+            previous = compo.previous_render
+            if compo.render_cache is None or previous is None or previous[2] != stamp:
+                continue
+            if previous[0] == compo.compo_info['render'][0]:
+                unchanged.append(compo)
+            else:
+                unchanged.extend(compo.get_unchanged_descendants(previous[1]))
+        return unchanged
+
     @classmethod
     def discover(cls):
         """Handles one time actions on this specific class. Should only be called once per individual class.
         """
         cls.combined_compo_state = cls.base_compo_state.union(cls.compo_state)
 
+        # Classes overwriting the state accessors have to be called for every access.
+        fast = cls.get_state_attr.__func__ is ComponentBase.get_state_attr.__func__ \
+            and cls.set_state_attr.__func__ is ComponentBase.set_state_attr.__func__
+
         for name in cls.combined_compo_state:
             original = getattr(cls, name, None)
-            if not isinstance(original, CompoStateAttribute) \
-                    and not isinstance(original, types.MethodType):
+            if isinstance(original, CompoStateAttribute):
+                if isinstance(original, FastCompoStateAttribute) == fast:
+                    continue
+                original = original.initial_value
+            elif isinstance(original, types.MethodType):
+                continue
+            if fast:
+                setattr(cls, name, FastCompoStateAttribute(original, name, is_immutable(original)))
+            else:
                 setattr(cls, name, CompoStateAttribute(original, name))
 
+        # Lifecycle hooks left at the empty default implementation are not called at all.
+        cls.subscribed_lifecycle_hooks = frozenset(
+            hook for hook in cls.lifecycle_hooks
+            if getattr(cls, hook).__func__ is not getattr(ComponentBase, hook).__func__
+        )
+
+        epflutil.AssetManifest.register_class(cls)
+
         if not cls.template_name:
             raise Exception("You did not setup the 'self.template_name' in " + repr(cls))
 
@@ -840,6 +1118,7 @@ class ComponentBase(object):
             raise Exception('Deprecated: Partial redraws are no longer possible.')
 
         self.redraw_requested = True
+        self.page.transaction.redraw_requests.add(self.cid)
 
     def __call__(self, *args, **kwargs):
         """ For direct invocation from the jinja-template. the args and kwargs are also provided by the template """
@@ -1020,7 +1299,11 @@ class ComponentBase(object):
         """
         out = {}
         if self.components:
-            for compo in self.components:
+            for compo in self.components.views():
+                # Children without a name and without children of their own contribute nothing.
+                if compo.name is None and not compo._has_children() \
+                        and compo._component_class.get_values.im_func is ComponentBase.get_values.im_func:
+                    continue
                 out.update(compo.get_values())
 
         if self.name is not None:
@@ -1088,6 +1371,17 @@ class ComponentContainerBase(ComponentBase):
     #: Update is triggered initially in :meth:`init_transaction` if True
     auto_initialize_children = True
 
+    #: Maximum number of children kept sleeping after their data id dropped out of :meth:`get_data`. The children put
+    #: to sleep longest ago are deleted. Defaults to epfl.transaction.max_sleeping_children if None, 0 for no limit.
+    max_sleeping_children = None
+
+    #: Send the changes :meth:`update_children` makes to the children to the client as structural operations inserting,
+    #: removing and moving single children instead of redrawing the whole container, see :meth:`get_structure_update`.
+    #: Requires a template rendering every visible child in order using the same markup, like the ListLayout does.
+    structural_updates = False
+    #: The compo_struct as shown by the client before the first structural change this request.
+    __client_order__ = None
+
     #: True if update children has been called at least once. Will be used for duplicate call prevention.
     __update_children_done__ = False
 
@@ -1160,9 +1454,26 @@ class ComponentContainerBase(ComponentBase):
     def sleeping_children(self):
         return self.compo_info.get('sleeping_compo_struct', {})
 
+    def log_sleeping_children(self):
+        """Log the number of sleeping children as gauge to the configured graphite server if epfl.performance_log is
+        enabled.
+        """
+        request = self.page.request
+        settings = request.registry.settings
+        if not asbool(settings.get('epfl.performance_log.enabled', False)):
+            return
+
+        compo_cls = self.__unbound_component__.__unbound_cls__
+        key = epflutil.get_performance_log_key(request, 'sleeping_children_' + compo_cls.__name__)
+        epflutil.log_gauge(key, len(self.sleeping_children), request=request)
+
     def update_children(self, force=False):
         """If a default_child_cls has been set this updates all child components to reflect the current state from
-        get_data(). Will raise an exception if called twice without the force parameter present."""
+        get_data(). Will raise an exception if called twice without the force parameter present.
+
+        Children are matched to the data by their id and compared to it using their stored state, only children that
+        changed are instantiated. Their order is fixed in a single change of the compo_struct moving as few children as
+        possible."""
 
         if self.__update_children_done__ and not force:
             raise Exception('update_children called twice without force parameter for component %s.' % self.cid)
@@ -1172,76 +1483,245 @@ class ComponentContainerBase(ComponentBase):
             return
 
         data = self._get_data(self.row_offset, self.row_limit, self.row_data)
+        transaction = self.page.transaction
+        client_order = None
+        if self.structural_updates and self.page.request.is_xhr:
+            client_order = list(self.compo_struct)
 
-        tipping_point = len([c for c in self.components if not hasattr(c, 'id')])
-
-        current_order = []
         new_order = []
-
         data_dict = {}
-        data_cid_dict = {}
-        data_order_dict = {}
-
-        for i, d in enumerate(data):
+        for d in data:
             new_order.append(d['id'])
-            data_order_dict[d['id']] = i
             data_dict[d['id']] = d
 
         # IDs of components once represented in data and now active again. They are reactivated.
-        for data_id in set(self.sleeping_children.keys()).intersection(new_order):
-            self.page.transaction.wake_component_id(self.cid, data_id)
-            self.redraw()
+        sleeping_children = self.sleeping_children
+        for data_id in new_order:
+            if data_id in sleeping_children:
+                transaction.wake_component_id(self.cid, data_id)
+                self.request_structure_update(client_order)
 
-        for v in self.components:
-            if getattr(v, 'id', None) is None:
+        # Children without an id in front of the data driven ones are kept there, others are moved behind them.
+        tipping_point = None
+        current_order = []
+        data_cid_dict = {}
+        class_cache = {}
+        for i, cid in enumerate(self.compo_struct):
+            data_id = self.get_child_values(cid, ['id'], class_cache)['id']
+            if data_id is MISSING:
+                data_id = getattr(self.page.components[cid], 'id', None)
+            if data_id is None:
                 continue
-            current_order.append(v.id)
-            data_cid_dict[v.id] = v.cid
-
-        # IDs of components no longer present in data. Their matching components are deleted.
-        for data_id in set(current_order).difference(new_order):
-            self.page.transaction.hibernate_component_id(data_cid_dict.pop(data_id))
-            self.redraw()
+            if tipping_point is None:
+                tipping_point = i
+            current_order.append(data_id)
+            data_cid_dict[data_id] = cid
+        if tipping_point is None:
+            tipping_point = len(self.compo_struct)
+
+        # IDs of components no longer present in data. Their matching components are put to sleep.
+        hibernated = False
+        for data_id in current_order:
+            if data_id not in data_dict:
+                transaction.hibernate_component_id(data_cid_dict.pop(data_id), self.max_sleeping_children)
+                hibernated = True
+        if hibernated:
+            self.log_sleeping_children()
+            self.request_structure_update(client_order)
 
         # IDs of data represented by a component. Matching components are updated.
-        for data_id in set(new_order).intersection(current_order):
-            compo = getattr(self.page, data_cid_dict[data_id])
+        for data_id in current_order:
+            if data_id not in data_dict:
+                continue
+            cid = data_cid_dict[data_id]
+            row = data_dict[data_id]
+            compo_cls = self.get_child_class(cid, class_cache)
             # A component may decide that it can not be updated by this mechanism. Relevant for components doing heavy
             # lifting in their :meth:`ComponentBase.init_transaction`.
-            if compo.disable_auto_update:
+            if compo_cls.disable_auto_update:
                 self.del_component(data_cid_dict.pop(data_id))
-                current_order.remove(data_id)
                 self.redraw()
                 continue
-            for k, v in data_dict[data_id].items():
+            values = self.get_child_values(cid, row.keys(), class_cache)
+            changed = [k for k, v in row.items() if values[k] is MISSING or values[k] != v]
+            if not changed:
+                continue
+            compo = self.page.components[cid]
+            for k in changed:
+                v = row[k]
                 if getattr(compo, k) != v:
                     setattr(compo, k, v)
                     compo.redraw()
 
-        compo_len = len(self.components)
-
-        # IDs of data not yet represented by a component. Matching components are created.
+        # IDs of data not yet represented by a component. Matching components are created in one step and put in
+        # place below, they are instantiated once they are accessed.
+        new_ids = []
+        new_ubcs = []
         for data_id in new_order:
-            if data_id in current_order:
+            if data_id in data_cid_dict:
                 continue
-            position = data_order_dict[data_id]
-            if position > compo_len:
-                position = None
             if self.skip_child_access:
                 data_dict[data_id]['_access'] = True
-            ubc = self.default_child_cls(**data_dict[data_id])
-            bc = self.add_component(ubc, position=position)
-            compo_len += 1
-            data_cid_dict[data_id] = bc.cid
-
-            self.redraw()
+            if transaction.compact_cids and 'cid' not in data_dict[data_id]:
+                ubc = self.default_child_cls(cid=transaction.generate_child_cid(self.cid, data_id),
+                                             **data_dict[data_id])
+            else:
+                ubc = self.default_child_cls(**data_dict[data_id])
+            new_ids.append(data_id)
+            new_ubcs.append(ubc)
+        if new_ubcs:
+            data_cid_dict.update(zip(new_ids, self.add_components(new_ubcs)))
+            self.request_structure_update(client_order)
 
         # Rebuild order.
-        for i, data_id in enumerate(new_order):
-            compo_cid = self.compo_info['compo_struct'][i + tipping_point]
-            if compo_cid != data_cid_dict[data_id]:
-                self.switch_component(self.cid, data_cid_dict[data_id], position=i + tipping_point)
-                self.redraw()
+        if transaction.reorder_children(self.cid, [data_cid_dict[data_id] for data_id in new_order], tipping_point):
+            self.request_structure_update(client_order)
+
+    def request_structure_update(self, client_order):
+        """Request the children changed by :meth:`update_children` to be updated on the client by structural
+        operations, see :meth:`get_structure_update`.
+
+        :param client_order: The compo_struct as shown by the client before the change, None to redraw instead.
+        """
+        if client_order is None:
+            return self.redraw()
+        if self.__client_order__ is None:
+            self.__client_order__ = client_order
+        self.page.transaction.structure_requests.add(self.cid)
+
+    def get_visible_children(self, class_cache=None):
+        """
+        :param class_cache: (optional) dict caching the classes of children, see :meth:`get_child_class`.
+        :returns: The component ids of the visible children in order, read without instantiating them if possible.
+        """
+        visible = []
+        for cid in self.compo_struct:
+            value = self.get_child_values(cid, ['visible'], class_cache)['visible']
+            if value is MISSING:
+                value = self.page.components[cid].visible
+            if value:
+                visible.append(cid)
+        return visible
+
+    def get_structure_update(self):
+        """Compute the operations turning the children shown by the client into the current visible children. Children
+        in a longest common subsequence of both orders stay in place, the others are removed, inserted or moved next
+        to a sibling. Only the inserted children are rendered.
+
+        :returns: dict of the operations for epfl.update_structure, None if the container has to be redrawn instead
+                  since its own output changed or its children can not be located on the client.
+        """
+        class_cache = {}
+        new_order = self.get_visible_children(class_cache)
+        new_cids = set(new_order)
+        current = set(self.compo_struct)
+        old_order = [cid for cid in self.__client_order__ if cid in new_cids or cid not in current]
+        old_positions = dict((cid, i) for i, cid in enumerate(old_order) if cid in new_cids)
+
+        kept = [cid for cid in new_order if cid in old_positions]
+        stable = set(kept[i] for i in longest_increasing_subsequence([old_positions[cid] for cid in kept]))
+        # The client locates the rows of the children by the closest common ancestor of two of them.
+        if len(old_order) < 2 or not stable:
+            return None
+
+        inserted = [self.page.components[cid] for cid in new_order if cid not in old_positions]
+        shell = self.render_template([])
+        if self.get_shell_hash(shell) != self.compo_info.get('shell'):
+            return None
+        rows = self.get_rows(shell, inserted)
+        if rows is None:
+            return None
+
+        # Children in front of the first stable one are placed before their successor, from back to front. All others
+        # are placed after their predecessor.
+        place = []
+        first = [i for i, cid in enumerate(new_order) if cid in stable][0]
+        for i in reversed(range(first)):
+            place.append([new_order[i], 'before', new_order[i + 1]])
+        for i in range(first + 1, len(new_order)):
+            if new_order[i] not in stable:
+                place.append([new_order[i], 'after', new_order[i - 1]])
+
+        return {'children': old_order[:2],
+                'remove': [cid for cid in old_order if cid not in new_cids],
+                'rows': rows,
+                'place': place,
+                'js': ''.join(compo.render('js_raw') for compo in inserted)}
+
+    def get_rows(self, shell, compo_objs):
+        """Render the rows of the given children as the template of this container renders them, without the
+        surrounding markup of the container.
+
+        :param shell: The output of the template of this container without any children.
+        :param compo_objs: The children.
+        :returns: The output of the rows or None if it can not be separated from the surrounding markup.
+        """
+        if not compo_objs:
+            return ''
+        output = self.render_template(compo_objs)
+        prefix = len(os.path.commonprefix([shell, output]))
+        suffix = len(os.path.commonprefix([shell[::-1], output[::-1]]))
+        length = len(output) - len(shell)
+        # The rows are inserted somewhere in between, the common prefix and suffix of the shell may overlap with them.
+        for start in range(max(len(shell) - suffix, 0), min(prefix, len(shell)) + 1):
+            rows = output[start:start + length].strip()
+            if rows.startswith('<') and rows.endswith('>') \
+                    and all(unicode(compo.render()) in rows for compo in (compo_objs[0], compo_objs[-1])):
+                return rows
+        return None
+
+    def render_template(self, compo_objs):
+        """Render the template of this container for the given children instead of its actual ones.
+        """
+        env = self.page.request.get_epfl_jinja2_environment()
+        components = self.components
+        self.components = compo_objs
+        try:
+            return unicode(env.get_template(self.template_name).render(self.get_render_environment(env)))
+        finally:
+            self.components = components
+
+    def get_shell_hash(self, shell):
+        """
+        :param shell: The output of the template of this container without any children.
+        :returns: A hash of the output of this container itself, excluding its children.
+        """
+        output_hash = hashlib.md5(shell.encode('utf-8'))
+        output_hash.update('\0')
+        init_js = self.get_compo_init_js()
+        output_hash.update(init_js.encode('utf-8') if type(init_js) is not str else init_js)
+        return output_hash.hexdigest()[:16]
+
+    def render(self, target='main'):
+        """Containers with :attr:`structural_updates` record the hash of their own output in the compo_info when
+        rendered, :meth:`get_structure_update` falls back to a redraw if it changed.
+        """
+        rendered = self.render_cache is not None
+        output = super(ComponentContainerBase, self).render(target)
+        if self.structural_updates and not rendered and self.is_rendered:
+            shell_hash = self.get_shell_hash(self.render_template([]))
+            if self.compo_info.get('shell') != shell_hash:
+                self.compo_info['shell'] = shell_hash
+                self.page.transaction.mark_component_dirty(self.cid)
+        return output
+
+    def get_child_class(self, cid, class_cache=None):
+        """
+        :param cid: component id of a child.
+        :param class_cache: (optional) dict caching the classes of children sharing an entry of the class table.
+        :returns: The class the child component is an instance of, without instantiating it.
+        """
+        return ComponentView(self.page, cid, class_cache)._component_class
+
+    def get_child_values(self, cid, names, class_cache=None):
+        """Read attribute values of a child component from its stored state and config without instantiating it.
+
+        :param cid: component id of a child.
+        :param names: The names of the attributes.
+        :param class_cache: (optional) dict caching the classes of children, see :meth:`get_child_class`.
+        :returns: dict of the values by name, MISSING for values that can only be read from an instance.
+        """
+        return ComponentView(self.page, cid, class_cache)._stored_values(names)
 
     def _get_data(self, *args, **kwargs):
         """
@@ -1320,13 +1800,39 @@ class ComponentContainerBase(ComponentBase):
             raise DeprecationWarning("Directly adding a component that was instantiated is no longer supported.")
 
         # the transaction-setup has to be redone because the component can be displayed directly in this request.
-        compo_obj.init_transaction()
-        self.page.transaction['__initialized_components__'].add(cid)
-        if ('page', 'handle_transaction') not in Lifecycle.get_state():
-            compo_obj.setup_component()
+        compo_obj.init_added_component()
 
         return compo_obj
 
+    def add_components(self, compo_objs, position=None):
+        """Add many components to this container in one step, e.g. the rows of a large list. Their cids are validated
+        and their compo_infos inserted at once, the components are only instantiated and initialized once they are
+        accessed.
+
+        :param compo_objs: List of :class:`UnboundComponent` instances.
+        :param position: (optional) position the first of the components shall hold, the others follow it.
+        :returns: The list of the cids of the added components.
+        """
+        transaction = self.page.transaction
+        compo_infos = []
+        cids = set()
+        for compo_obj in compo_objs:
+            if not isinstance(compo_obj, UnboundComponent):
+                raise DeprecationWarning("Directly adding a component that was instantiated is no longer supported.")
+            compo_info = compo_obj.get_component_info(self, compo_obj.position[1])
+            # Generated cids are replaced in case of a collision just like in UnboundComponent.register_in_transaction.
+            while (compo_info['cid'] in cids or transaction.has_component(compo_info['cid'])) \
+                    and compo_obj.has_autogen_cid():
+                compo_obj = compo_obj(cid=None)
+                compo_info = compo_obj.get_component_info(self, compo_obj.position[1])
+            cids.add(compo_info['cid'])
+            compo_infos.append(compo_info)
+
+        transaction.set_components(self.cid, compo_infos, position=position)
+        cids = [compo_info['cid'] for compo_info in compo_infos]
+        transaction.defer_component_init(cids)
+        return cids
+
     def setup_component_slots(self):
         """ Overwrite me. This method must initialize the slots that this
         container-component provides to accumulate components """
@@ -1343,7 +1849,7 @@ class ComponentContainerBase(ComponentBase):
         """
         Removes the component from the slot and form the compo_info. Accepts either a component instance or a cid.
         """
-        return getattr(self.page, cid).delete_component()
+        return self.page.components[cid].delete_component()
 
 
 class ComponentList(MutableSequence):
@@ -1375,3 +1881,113 @@ class ComponentList(MutableSequence):
 
     def __delitem__(self, index):
         pass
+
+    def views(self):
+        """
+        :returns: List of :class:`ComponentView` instances of the children, sharing their class cache.
+        """
+        class_cache = {}
+        page = self.container_compo.page
+        return [ComponentView(page, cid, class_cache) for cid in self.container_compo.compo_struct]
+
+
+class ComponentView(object):
+    """
+    Read only view of a component that does not require it to be instantiated. Attributes are read from the stored
+    compo_state and config of the component as long as their values are immutable. Everything else, like calling
+    methods, reading mutable values or setting attributes, promotes the view to the actual component instance.
+
+    Use it for code paths that only read data from many components, like the ids of the rows of a list.
+    """
+
+    __slots__ = ('page', 'cid', 'class_cache')
+
+    def __init__(self, page, cid, class_cache=None):
+        """
+        :param page: The :class:`.epflpage.Page` the component belongs to.
+        :param cid: component id of the component.
+        :param class_cache: (optional) dict caching the classes of components sharing an entry of the class table.
+        """
+        object.__setattr__(self, 'page', page)
+        object.__setattr__(self, 'cid', cid)
+        object.__setattr__(self, 'class_cache', class_cache)
+
+    @property
+    def _instance(self):
+        """The actual component instance, it is created if necessary."""
+        return self.page.transaction.get_component_instance(self.page, self.cid)
+
+    @property
+    def _component_class(self):
+        """The class of the component."""
+        transaction = self.page.transaction
+        compo_info = transaction.get_component(self.cid)
+        class_key = compo_info.get('class')
+        class_cache = self.class_cache
+        if class_cache is not None and type(class_key) is str and class_key in class_cache:
+            return class_cache[class_key]
+
+        state = transaction.get_class_state(compo_info)
+        compo_cls = UnboundComponent.create_from_state(state).__dynamic_class__
+        epflutil.Discover.discover_component(compo_cls)
+        if class_cache is not None and type(class_key) is str:
+            class_cache[class_key] = compo_cls
+        return compo_cls
+
+    def _stored_values(self, names):
+        """
+        :param names: The names of the attributes.
+        :returns: dict of the values by name as stored in the transaction, MISSING for values that can only be read
+                  from an instance.
+        """
+        transaction = self.page.transaction
+        compo_info = transaction.get_component(self.cid)
+        compo_cls = self._component_class
+        compo_state = compo_info.get('compo_state', {})
+        config = transaction.get_class_state(compo_info)[1]
+
+        values = {}
+        for name in names:
+            attribute = MISSING
+            for base in compo_cls.__mro__:
+                if name in base.__dict__:
+                    attribute = base.__dict__[name]
+                    break
+            if isinstance(attribute, CompoStateAttribute):
+                # Only the fast accessors are known to return the stored values unchanged.
+                if not isinstance(attribute, FastCompoStateAttribute):
+                    value = MISSING
+                elif name in compo_state:
+                    value = compo_state[name]
+                else:
+                    value = config.get(name, attribute.initial_value)
+                if isinstance(value, Descriptor):
+                    value = MISSING
+            elif hasattr(attribute, '__get__'):
+                value = MISSING
+            else:
+                value = config.get(name, attribute)
+            values[name] = value
+        return values
+
+    def _has_children(self):
+        """
+        :returns: True if the component has child components.
+        """
+        return bool(self.page.transaction.get_component(self.cid).get('compo_struct'))
+
+    def __getattr__(self, name):
+        transaction = self.page.transaction
+        cid = self.cid
+        # Instances may hold values not stored yet, components waiting for their init_transaction hold outdated ones.
+        if cid not in transaction.instances and cid not in transaction.data.get('__deferred_components__', ()):
+            value = self._stored_values([name])[name]
+            if value is not MISSING and is_immutable(value):
+                return value
+        return getattr(self._instance, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._instance, name, value)
+
+    def __repr__(self):
+        return '<ComponentView of {cid}>'.format(cid=self.cid)
@@ -1,3 +1,6 @@
+from solute.epfl.core.epflutil import IMMUTABLE_TYPES
+
+
 class Descriptor(object):
     def __init__(self):
         raise NotImplementedError('You have to implement the __init__ method of the Descriptor!')
@@ -123,3 +126,49 @@ class CompoStateAttribute(object):
 
     def __set__(self, obj, value):
         return obj.set_state_attr(self.name, value)
+
+
+#: Marks compo_state entries that are not present.
+MISSING = object()
+
+
+class FastCompoStateAttribute(CompoStateAttribute):
+    """Descriptor for component state attributes of classes using the default
+    :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.get_state_attr` and
+    :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.set_state_attr`. Reads and writes of immutable builtin
+    values are handled directly, everything else is passed on to these methods.
+    """
+
+    def __init__(self, initial_value=None, name='var', immutable=False):
+        """
+        :param initial_value: The initial value of this compo state attribute.
+        :param name: The name of this compo state attribute.
+        :param immutable: True if the initial value can not be changed in place.
+        """
+        super(FastCompoStateAttribute, self).__init__(initial_value, name)
+        self.immutable = immutable
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        compo_state = (obj._compo_info or obj.compo_info).get('compo_state')
+        if compo_state is not None and self.name in compo_state:
+            value = compo_state[self.name]
+            if type(value) in IMMUTABLE_TYPES:
+                return value
+        elif self.immutable and self.name not in obj.__instance_config__:
+            return self.initial_value
+        return obj.get_state_attr(self.name, self.initial_value)
+
+    def __set__(self, obj, value):
+        compo_state = (obj._compo_info or obj.compo_info).get('compo_state')
+        if compo_state is None:
+            return obj.set_state_attr(self.name, value)
+        current = compo_state.get(self.name, MISSING)
+        current_type = type(current)
+        if current is not MISSING and current_type not in IMMUTABLE_TYPES:
+            return obj.set_state_attr(self.name, value)
+        if current_type is type(value) and current == value:
+            return
+        compo_state[self.name] = value
+        obj.page.transaction.mark_component_dirty(obj.cid)
@@ -38,6 +38,36 @@ class LazyProperty(object):
         self.callback(overwrite=True)
 
 
+def is_component_template(value):
+    """
+    :returns: True if value is an :class:`.epflcomponentbase.UnboundComponent` or a component class, either can be
+              assigned to a page to become a static component like the root_node.
+    """
+    return isinstance(value, epflcomponentbase.UnboundComponent) \
+        or (isinstance(value, type) and issubclass(value, epflcomponentbase.ComponentBase))
+
+
+class ComponentAttribute(object):
+    """
+    Placed on :class:`Page` classes by :meth:`Page.discover` for class attributes holding a component template, see
+    :func:`is_component_template`, e.g. the root_node. On instances it resolves to the component of the same cid, the
+    template is returned as long as the component does not exist.
+    """
+
+    def __init__(self, name, template):
+        self.name = name
+        self.template = template
+
+    def __get__(self, page, cls):
+        if page is None:
+            return self.template
+        transaction = page.__dict__.get('transaction')
+        if transaction is not None:
+            if transaction.has_component(self.name):
+                return transaction.get_component_instance(page, self.name)
+        return page.__dict__.get('static_components', {}).get(self.name, self.template)
+
+
 @epflacl.epfl_acl(['access'])
 class Page(object):
     """
@@ -107,12 +137,19 @@ class Page(object):
         :param request: Pyramid Request object.
         :param transaction: EPFL Transaction object.
         """
+        epflutil.Discover.discover_page(type(self))
+
+        #: Component templates assigned to this page, see :meth:`__setattr__`.
+        self.static_components = {}
         self.request = request
         self.context = context
         self.request.page = self
         self.page_request = PageRequest(request, self)
         self.response = epflclient.EPFLResponse(self)
-        self.components = PageComponents(self)  # all registered components of this page
+        self.components = PageComponents(self)  # Namespace of all components of this page by cid.
+        #: True if AJAX redraws keep the unchanged components on the client, see
+        #: :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.get_redraw_parts`. Set by epfl.patch_redraws.
+        self.patch_redraws = asbool(request.registry.settings.get('epfl.patch_redraws', False))
 
         if transaction:
             self.transaction = transaction
@@ -149,14 +186,21 @@ class Page(object):
             self.handle_ajax_events()
             content_type = "text/javascript"
         else:
-            # Reset the rendered_extra_content list since none actually has been rendered yet!
-            self.transaction['rendered_extra_content'] = set()
+            # Reset the loaded assets since none actually has been rendered yet!
+            self.transaction['rendered_assets'] = 0
 
         self.after_event_handling()
 
         out = self.render()
 
-        out += self.call_cleanup(self.request.is_xhr)
+        try:
+            out += self.call_cleanup(self.request.is_xhr)
+        except epfltransaction.TransactionConflict:
+            if not self.request.is_xhr:
+                raise
+            # A concurrent request changed the same data, the client repeats the events on the current state. The
+            # event handlers of this request have already run and will run again, see TransactionConflict.
+            return Response(body='', status=409, content_type=content_type)
 
         response = Response(body=out.encode("utf-8"),
                             status=200,
@@ -168,12 +212,12 @@ class Page(object):
 
     @Lifecycle(name=('page', 'after_event_handling'))
     def after_event_handling(self):
-        """Triggers the component after_event_handling lifecycle.
+        """Triggers the component after_event_handling lifecycle for the active components implementing it.
 
         [request-processing-flow]
         """
 
-        for compo in self.get_active_components():
+        for compo in self.transaction.get_lifecycle_subscribers('after_event_handling'):
             compo.after_event_handling()
 
     @Lifecycle(name=('page', 'prevent_transaction_loss'))
@@ -202,6 +246,7 @@ class Page(object):
             return ''
 
         self.transaction.store()
+        self.transaction.log_size()
 
         if check_tid and self.transaction.tid_new:
             return 'epfl.new_tid("%s");' % self.transaction.tid_new
@@ -230,11 +275,11 @@ class Page(object):
                 self.model = self.model(self.request)
 
     def done_request(self):
-        """Call the finalize lifecycle for all active(!) components.
+        """Call the finalize lifecycle for all active(!) components implementing it.
 
         [request-processing-flow]
         """
-        for compo_obj in self.get_active_components():
+        for compo_obj in self.transaction.get_lifecycle_subscribers('finalize'):
             if self.transaction.has_component(compo_obj.cid):
                 compo_obj.finalize()
 
@@ -255,24 +300,30 @@ class Page(object):
 
     @classmethod
     def discover(cls):
-        """Stub for discovery specific actions on page. Utilize this for removing __getattribute__ using the
-        LazyAccessor.
+        """Handles one time actions on this specific class. Class attributes holding a component template, like the
+        root_node, are replaced by a :class:`ComponentAttribute` resolving them to their component.
         """
-        pass
+        for name in dir(cls):
+            value = getattr(cls, name, None)
+            if is_component_template(value) and not isinstance(cls.__dict__.get(name), ComponentAttribute):
+                setattr(cls, name, ComponentAttribute(name, value))
+        epflutil.AssetManifest.register_class(cls)
 
-    def __getattribute__(self, item):
-        """Used to provide special handling for components in lazy_mode. Uses default behaviour of super otherwise. If
-        the requested value is an instance of :class:`LazyProperty` it will be called, then reloaded using the default
-        behaviour of super.
+    def __getattr__(self, item):
+        """Compatibility access to components by cid as attributes of the page. Only called for names that are no
+        regular attribute, so page attributes are not slowed down. Use :attr:`components` to access components
+        directly, a cid that equals the name of a page attribute can only be accessed that way.
 
         :param item: Name of the attribute.
         """
-        if item not in ['components', 'transaction', '_active_initiations', 'request', 'response'] \
-                and hasattr(self, 'transaction') \
-                and self.transaction.has_component(item):
-            return self.transaction.get_component_instance(self, item)
-
-        return super(Page, self).__getattribute__(item)
+        transaction = self.__dict__.get('transaction')
+        if transaction is not None:
+            if transaction.has_component(item):
+                return transaction.get_component_instance(self, item)
+        static_components = self.__dict__.get('static_components')
+        if static_components and item in static_components:
+            return static_components[item]
+        raise AttributeError("'{cls}' object has no attribute '{item}'".format(cls=type(self).__name__, item=item))
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -294,6 +345,9 @@ class Page(object):
         """
         if isinstance(value, epflcomponentbase.ComponentBase):
             self.add_static_component(key, value)
+        elif is_component_template(value):
+            # Kept aside, the attribute resolves to the component once it exists.
+            self.static_components[key] = value
         else:
             super(Page, self).__setattr__(key, value)  # Use normal behaviour.
 
@@ -324,12 +378,9 @@ class Page(object):
         """Returns the currently active components as known to the transaction.
 
         :param sorted_by_depth: Important flag for rendering process where components need to be rendered in
-                                hierarchical order, expensive feature.
+                                hierarchical order.
         """
-        active_components = self.transaction.get_active_components()[:]
-        if sorted_by_depth:
-            active_components.sort(key=lambda x: self.transaction.get_component_depth(x.cid))
-        return active_components
+        return self.transaction.get_active_components(sorted_by_depth=sorted_by_depth)[:]
 
     def has_access(self):
         """ Checks if the current user has sufficient rights to see/access this page.
@@ -372,7 +423,8 @@ class Page(object):
 
         opts = {"tid": self.transaction.get_id(),
                 "ptid": self.transaction.get_pid(),
-                "log_time": asbool(self.request.registry.settings.get('epfl.performance_log.enabled', False))}
+                "log_time": asbool(self.request.registry.settings.get('epfl.performance_log.enabled', False)),
+                "parallel_requests": asbool(self.request.registry.settings.get('epfl.parallel_requests', False))}
 
         return "epfl.init_page(" + json.encode(opts) + ")"
 
@@ -398,7 +450,9 @@ class Page(object):
             digraph foo {
                 "Page.render" -> "request.is_xhr";
                 "Page.render" -> "not request.is_xhr";
-                "request.is_xhr" -> "Page.get_active_components" -> "compo.render()" -> "ComponentBase.render";
+                "request.is_xhr" -> "Transaction.plan_structure_updates" ->
+                "ComponentContainerBase.get_structure_update";
+                "request.is_xhr" -> "Transaction.plan_redraws" -> "compo.render()" -> "ComponentBase.render";
                 "not request.is_xhr" -> "root_node.render()";
                 "root_node.render()" -> "ComponentBase.render";
                 "ComponentBase.render" -> "EPFLResponse.render_jinja";
@@ -421,16 +475,29 @@ class Page(object):
 
         # Ajax partial page rendering.
         else:
-            # Get render entry points.
-            for compo in self.get_active_components(sorted_by_depth=True)[:]:
-                # If a component has requested a redraw and has not yet been rendered (usually courtesy of a parent
-                # being rendered before) it is rendered and added as a js_response using the client function
-                # epfl.replace_component.
-                if compo.redraw_requested and not compo.is_rendered:
+            # Containers send the changes of their children as structural operations if possible, only the inserted
+            # children are rendered. Otherwise they are redrawn.
+            for cid in self.transaction.plan_structure_updates():
+                compo = self.transaction.instances.get(cid)
+                if compo is None or compo.render_cache is not None:
+                    continue
+                update = compo.get_structure_update()
+                if update is None:
+                    compo.redraw()
+                else:
+                    self.add_js_response("epfl.update_structure('{cid}', {update})".format(
+                        cid=compo.cid,
+                        update=json.encode(update)))
+
+            # Get render entry points: The components that requested a redraw without an ancestor doing so as well.
+            for cid in self.transaction.plan_redraws():
+                compo = self.transaction.instances.get(cid)
+                # If a component has not yet been rendered it is rendered and added as a js_response using the client
+                # function epfl.replace_component.
+                if compo is not None and compo.redraw_requested and not compo.is_rendered:
                     self.add_js_response("epfl.replace_component('{cid}', {parts})".format(
                         cid=compo.cid,
-                        parts=json.encode({'js': compo.render('js_raw'),
-                                           'main': compo.render()})))
+                        parts=json.encode(compo.get_redraw_parts())))
 
             # Attach fresh CSS and JS imports dynamically if they were not present on the page before.
             extra_content = self.get_css_imports(only_fresh_imports=True) + self.get_js_imports(only_fresh_imports=True)
@@ -457,11 +524,12 @@ class Page(object):
             self.setup_components()
             self.transaction["components_assigned"] = True
 
-        if 'root_node' not in self.transaction['__initialized_components__']:
+        # Read without marking the key as changed, it only changes if the root_node has to be initialized.
+        if 'root_node' not in self.transaction.data['__initialized_components__']:
             self.root_node.init_transaction()
             self.transaction['__initialized_components__'].add('root_node')
 
-        for compo in self.get_active_components():
+        for compo in self.transaction.get_lifecycle_subscribers('setup_component'):
             compo.setup_component()
 
     def make_new_tid(self):
@@ -562,39 +630,58 @@ class Page(object):
         )
         self.add_js_response(js)
 
+    def get_asset_ids(self, name, only_fresh_ids=False):
+        """Get the ids of the resources of the page and all component classes rendered in this request, see
+        :class:`~solute.epfl.core.epflutil.AssetManifest`. Resources contained in the webasset bundles are left out.
+
+        :param name: Resource name, either css_name or js_name.
+        :param only_fresh_ids: Leaves out resources already loaded previously in this transaction.
+        :returns: List of asset ids in the order they are needed.
+        """
+        bundled = epflutil.AssetManifest.get_bundled_ids(getattr(self, 'bundled_names', []))
+        loaded = self.get_loaded_assets() if only_fresh_ids else 0
+        asset_ids = []
+        seen = set(bundled)
+        for compo_cls in [type(self)] + self.transaction.rendered_classes.keys():
+            for asset_id in epflutil.AssetManifest.get_class_manifest(compo_cls, name):
+                if asset_id not in seen and not loaded >> asset_id & 1:
+                    seen.add(asset_id)
+                    asset_ids.append(asset_id)
+        return asset_ids
+
+    def get_loaded_assets(self):
+        """The assets already loaded in this transaction are stored as a bitset of asset ids together with the
+        fingerprint of the manifest they refer to. If the fingerprint differs, e.g. since the transaction was written
+        by a process that registered its assets in a different order, nothing is considered loaded.
+
+        :returns: The bitset of the asset ids loaded previously in this transaction.
+        """
+        loaded = self.transaction.get('rendered_assets', 0)
+        fingerprint = epflutil.AssetManifest.fingerprint(loaded.bit_length())
+        if loaded and self.transaction.get('rendered_assets_manifest') != fingerprint:
+            return 0
+        return loaded
+
+    def add_loaded_assets(self, asset_ids):
+        """Mark the given asset ids as loaded in this transaction.
+        """
+        loaded = self.get_loaded_assets()
+        for asset_id in asset_ids:
+            loaded |= 1 << asset_id
+        if loaded != self.transaction.get('rendered_assets', 0):
+            self.transaction['rendered_assets'] = loaded
+        fingerprint = epflutil.AssetManifest.fingerprint(loaded.bit_length())
+        if fingerprint != self.transaction.get('rendered_assets_manifest', ''):
+            self.transaction['rendered_assets_manifest'] = fingerprint
+
     def get_names(self, name, only_fresh_names=False):
-        """Get the static urls of resources from all components currently active.
+        """Get the static urls of resources from the page and all components rendered in this request.
 
         :param name: Resource name, either css_name or js_name.
         :param only_fresh_names: Prevents resources already loaded previously in this transaction from being reloaded.
         """
-
-        names = []
-        for compo in [self] + self.get_active_components():
-            if not getattr(compo, 'is_rendered', True):
-                continue
-
-            name_list = getattr(compo, name)
-            if type(name_list) is not list:
-                name_list = [name_list]
-            for sub_name in name_list:
-                if type(sub_name) is not tuple:
-                    sub_name = compo.asset_spec, sub_name
-                if sub_name in getattr(self, 'bundled_names', []):
-                    continue
-                ## support external urls
-                if sub_name[1].startswith('//') or sub_name[1].startswith('http://') or sub_name[1].startswith('https://'):
-                    static_url = sub_name[1]
-                else:
-                    static_url = epflutil.StaticUrlFactory.create_static_url(self, sub_name[1], sub_name[0])
-
-                if static_url not in names:
-                    names.append(static_url)
-
-        if only_fresh_names:
-            names = [name for name in names if name not in self.transaction.get('rendered_extra_content', set())]
-
-        return names
+        asset_ids = self.get_asset_ids(name, only_fresh_ids=only_fresh_names)
+        return [epflutil.AssetManifest.get_static_url(self, asset_id) for asset_id in asset_ids]
 
     def get_css_imports(self, only_fresh_imports=False):
         """This function delivers the <link> tags for all stylesheets needed by this page and it's components.
@@ -602,9 +689,10 @@ class Page(object):
 
         :param only_fresh_imports: Prevents resources already loaded previously in this transaction from being reloaded.
         """
-        imports = self.get_names('css_name', only_fresh_names=only_fresh_imports)
+        asset_ids = self.get_asset_ids('css_name', only_fresh_ids=only_fresh_imports)
+        self.add_loaded_assets(asset_ids)
 
-        self.transaction.setdefault('rendered_extra_content', set()).update(imports)
+        imports = [epflutil.AssetManifest.get_static_url(self, asset_id) for asset_id in asset_ids]
 
         return jinja2.Markup(''.join(['<link rel="stylesheet" type="text/css" href="%s"/>\r\n'
                                       % css for css in imports]))
@@ -628,9 +716,10 @@ class Page(object):
 
         :param only_fresh_imports: Prevents resources already loaded previously in this transaction from being reloaded.
         """
-        imports = self.get_names('js_name', only_fresh_names=only_fresh_imports)
+        asset_ids = self.get_asset_ids('js_name', only_fresh_ids=only_fresh_imports)
+        self.add_loaded_assets(asset_ids)
 
-        self.transaction.setdefault('rendered_extra_content', set()).update(imports)
+        imports = [epflutil.AssetManifest.get_static_url(self, asset_id) for asset_id in asset_ids]
 
         return jinja2.Markup(''.join(['<script type="text/javascript" src="%s"></script>\r\n'
                                       % js for js in imports]))
@@ -779,21 +868,32 @@ class PageRequest(object):
 
 
 class PageComponents(object):
-    """DEPRECATED: Just expose the compo_store directly.
+    """Namespace of the components of a page by cid, available as :attr:`Page.components`. Components are resolved
+    directly from the transaction, by item or attribute access:
 
-    OLD:
-    Wrapper dict that just holds the information which component is actually supposed to be present while leaving the
-    actual instances stored only in :attr:`Page.__dict__`.
-    Implements MutableMapping_.
+        page.components['root_node']
+        page.components.root_node
 
-.. _MutableMapping: https://docs.python.org/2/library/collections.html#collections.MutableMapping
-"""
+    Names not known to the transaction fall back to the attributes of the page.
+    """
 
     def __init__(self, page):
         self.page = page
 
     def __getitem__(self, key):
-        return getattr(self.page, key)
+        page = self.page
+        transaction = page.transaction
+        if transaction.has_component(key):
+            return transaction.get_component_instance(page, key)
+        return getattr(page, key)
+
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        return self[key]
+
+    def __contains__(self, key):
+        return self.page.transaction.has_component(key)
 
     def __len__(self):
         return len(self.page.transaction.get('compo_store', {}))
@@ -6,20 +6,378 @@ A Dict-Like Object that represents a epfl-transaction
 """
 
 from pprint import pprint
-from redis import StrictRedis
+from redis import StrictRedis, BlockingConnectionPool
+from redis.exceptions import WatchError
+from contextlib import contextmanager
 import cPickle as pickle
 from copy import deepcopy
 from collections2 import OrderedDict as odict
-import types, copy, string, uuid, time
+import types, copy, string, uuid, time, threading, hashlib, re, logging
 
 from collections import MutableMapping, defaultdict
 from solute.epfl.core import epflcomponentbase
+from solute.epfl.core.epflcodec import TransactionCodec
+from solute.epfl.core.epflanalyzer import SizeReport
+from solute.epfl.core.epflutil import is_immutable, freeze, base62, longest_increasing_subsequence, \
+    get_performance_log_key, log_gauge
+from pyramid.settings import asbool
+
+logger = logging.getLogger(__name__)
 
 
 class TransactionRouteViolation(Exception):
     pass
 
 
+class TransactionConflict(Exception):
+    """Raised by :meth:`Transaction.store` if a concurrent request changed the same data. The request has to be
+    repeated on the current state of the transaction.
+
+    The transaction is only stored after all event handlers of the request have run, so the client repeating the
+    events runs the handlers again. Handlers with side effects outside of the transaction, like writing to a database,
+    have to tolerate being called twice for the same event if epfl.parallel_requests is set.
+    """
+    pass
+
+
+class ComponentStore(MutableMapping):
+    """The compo_store of a :class:`Transaction` loaded from the redis_hash store. Every compo_info is kept in its
+    encoded form until it is accessed for the first time, components untouched by a request are never decoded.
+    Pickles as a plain dict.
+    """
+
+    def __init__(self, raw, loads=pickle.loads):
+        """
+        :param raw: dict of component ids and their encoded compo_info.
+        :param loads: callable decoding a single compo_info.
+        """
+        self.raw = raw
+        self.loads = loads
+        self.loaded = {}
+
+    def __getitem__(self, cid):
+        try:
+            return self.loaded[cid]
+        except KeyError:
+            compo_info = self.loaded[cid] = self.loads(self.raw.pop(cid))
+            return compo_info
+
+    def __setitem__(self, cid, compo_info):
+        self.raw.pop(cid, None)
+        self.loaded[cid] = compo_info
+
+    def __delitem__(self, cid):
+        if cid in self.loaded:
+            del self.loaded[cid]
+        else:
+            del self.raw[cid]
+
+    def __contains__(self, cid):
+        return cid in self.loaded or cid in self.raw
+
+    def __iter__(self):
+        for cid in self.loaded.keys():
+            yield cid
+        for cid in self.raw.keys():
+            yield cid
+
+    def __len__(self):
+        return len(self.loaded) + len(self.raw)
+
+    def keys(self):
+        return self.loaded.keys() + self.raw.keys()
+
+    def __reduce__(self):
+        return dict, (dict(self.items()), )
+
+
+class ComponentInstances(dict):
+    """The component instances of a transaction by their cid. For every lifecycle hook of the page it keeps the
+    instances whose class implements it, see
+    :attr:`~solute.epfl.core.epflcomponentbase.ComponentBase.subscribed_lifecycle_hooks`.
+    """
+
+    def __init__(self):
+        super(ComponentInstances, self).__init__()
+        #: Instances by cid for each lifecycle hook.
+        self.subscribers = defaultdict(dict)
+
+    def __setitem__(self, cid, compo_obj):
+        if cid in self:
+            self.unsubscribe(cid)
+        super(ComponentInstances, self).__setitem__(cid, compo_obj)
+        for hook in compo_obj.subscribed_lifecycle_hooks:
+            self.subscribers[hook][cid] = compo_obj
+
+    def __delitem__(self, cid):
+        super(ComponentInstances, self).__delitem__(cid)
+        self.unsubscribe(cid)
+
+    def pop(self, cid, *default):
+        self.unsubscribe(cid)
+        return super(ComponentInstances, self).pop(cid, *default)
+
+    def clear(self):
+        super(ComponentInstances, self).clear()
+        self.subscribers.clear()
+
+    def unsubscribe(self, cid):
+        for subscribers in self.subscribers.values():
+            subscribers.pop(cid, None)
+
+
+class ChildIndex(object):
+    """Positions of the component ids in a compo_struct list. The list itself stays a plain list, so stored
+    transactions are unchanged. Positions are computed lazily: all positions below :attr:`valid` are known, inserting or
+    removing at a position only invalidates the positions behind it. Appending, looking up the position of and moving
+    children behind the last change are amortized O(1).
+    """
+
+    def __init__(self, struct):
+        """
+        :param struct: The compo_struct list to be indexed.
+        """
+        self.struct = struct
+        self.positions = {}
+        self.valid = 0
+
+    def index(self, cid):
+        """
+        :param cid: component id of a child.
+        :returns: The position of the child.
+        :raises ValueError: If the component is no child.
+        """
+        struct = self.struct
+        position = self.positions.get(cid)
+        if position is not None and position < self.valid and position < len(struct) and struct[position] == cid:
+            return position
+
+        for start in (self.valid, 0):
+            # Starting over at 0 if the list has been changed without using this index.
+            for i in xrange(start, len(struct)):
+                self.positions[struct[i]] = i
+                self.valid = i + 1
+                if struct[i] == cid:
+                    return i
+        raise ValueError('%r is not in list' % cid)
+
+    def __contains__(self, cid):
+        try:
+            self.index(cid)
+        except ValueError:
+            return False
+        return True
+
+    def insert(self, position, cid):
+        """Insert the child at the given position, append it if position is None.
+        """
+        struct = self.struct
+        if position is None or position >= len(struct):
+            if self.valid == len(struct):
+                self.positions[cid] = self.valid
+                self.valid += 1
+            struct.append(cid)
+            return
+        if position < 0:
+            position = max(0, len(struct) + position)
+        struct.insert(position, cid)
+        self.valid = min(self.valid, position)
+
+    def insert_many(self, position, cids):
+        """Insert the children at the given position in one step, append them if position is None.
+        """
+        struct = self.struct
+        if position is None or position >= len(struct):
+            if self.valid == len(struct):
+                for i, cid in enumerate(cids, len(struct)):
+                    self.positions[cid] = i
+                self.valid += len(cids)
+            struct.extend(cids)
+            return
+        if position < 0:
+            position = max(0, len(struct) + position)
+        struct[position:position] = cids
+        self.valid = min(self.valid, position)
+
+    def reorder(self, start, cids):
+        """Replace the children from the given position on with cids, which has to contain the same children in a new
+        order.
+        """
+        self.struct[start:] = cids
+        self.valid = min(self.valid, start)
+
+    def remove(self, cid):
+        """Remove the child.
+
+        :returns: The position the child had.
+        """
+        position = self.index(cid)
+        del self.struct[position]
+        del self.positions[cid]
+        self.valid = min(self.valid, position)
+        return position
+
+
+class RedisBackend(object):
+    """Connection handling for the redis transaction stores. All clients share a blocking connection pool of fixed
+    size, requests wait for a free connection instead of opening new ones under load.
+    """
+
+    def __init__(self, url, pool_size=50, pool_timeout=20):
+        """
+        :param url: The redis url, e.g. redis://localhost:6379.
+        :param pool_size: Maximum number of connections held by the pool.
+        :param pool_timeout: Seconds to wait for a free connection before an error is raised.
+        """
+        self.pool = BlockingConnectionPool.from_url(url, max_connections=pool_size, timeout=pool_timeout)
+        self.client = StrictRedis(connection_pool=self.pool)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Create the backend configured by epfl.transaction.url, epfl.transaction.pool_size and
+        epfl.transaction.pool_timeout.
+
+        :param settings: The pyramid registry settings.
+        """
+        redis_url = settings.get('epfl.transaction.url')
+        if not redis_url:
+            raise Exception('Transaction redis url not set!')
+        return cls(redis_url,
+                   pool_size=int(settings.get('epfl.transaction.pool_size', 50)),
+                   pool_timeout=int(settings.get('epfl.transaction.pool_timeout', 20)))
+
+    @contextmanager
+    def context(self):
+        """Provides the client, connections are taken from and returned to the pool per command or pipeline.
+        """
+        yield self.client
+
+
+class MemoryStore(object):
+    """In-process transaction store. Transactions are kept encoded, so every read returns a private copy without the
+    cost of :func:`copy.deepcopy` and the size of every entry is known. Entries expire after the transaction timeout
+    and the least recently used entries are evicted if the configured number of entries or bytes is exceeded.
+    """
+
+    def __init__(self, codec, timeout=1800, max_entries=10000, max_bytes=0):
+        """
+        :param codec: The :class:`~solute.epfl.core.epflcodec.TransactionCodec` used to encode entries.
+        :param timeout: Seconds after its last write an entry expires.
+        :param max_entries: Maximum number of entries, 0 for no limit.
+        :param max_bytes: Maximum number of encoded bytes of all entries, 0 for no limit.
+        """
+        self.codec = codec
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries = odict()  #: Key to (expiry time, payload), least recently used first.
+        self.size = 0  #: Current number of encoded bytes of all entries.
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_settings(cls, settings, codec):
+        """Create the store configured by epfl.transaction.timeout, epfl.transaction.memory.max_entries and
+        epfl.transaction.memory.max_bytes.
+
+        :param settings: The pyramid registry settings.
+        :param codec: The :class:`~solute.epfl.core.epflcodec.TransactionCodec` used to encode entries.
+        """
+        return cls(codec,
+                   timeout=int(settings.get('epfl.transaction.timeout', 1800)),
+                   max_entries=int(settings.get('epfl.transaction.memory.max_entries', 10000)),
+                   max_bytes=int(settings.get('epfl.transaction.memory.max_bytes', 0)))
+
+    def get(self, key, default=None):
+        """Return a copy of the data stored under key or default if there is none or it has expired.
+        """
+        payload = self.get_payload(key)
+        if payload is None:
+            return default
+        return self.codec.loads(payload)
+
+    def get_payload(self, key):
+        """Return the encoded data stored under key or None if there is none or it has expired.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] < time.time():
+                self.size -= len(entry[1])
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+        return entry[1]
+
+    def set(self, key, data):
+        """Store a copy of the data under key.
+
+        :returns: The size of the encoded data in bytes.
+        """
+        payload = self.codec.dumps(data)
+        with self.lock:
+            self.pop_entry(key)
+            self.entries[key] = time.time() + self.timeout, payload
+            self.size += len(payload)
+            self.evict()
+        return len(payload)
+
+    def __setitem__(self, key, data):
+        self.set(key, data)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.pop_entry(key)
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] >= time.time()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def pop_entry(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+        return entry
+
+    def evict(self):
+        """Remove expired entries from the least recently used end, then the least recently used entries until the
+        limits are met again. The most recently written entry is always kept.
+        """
+        now = time.time()
+        while len(self.entries) > 1:
+            key, (expiry, payload) = next(self.entries.iteritems())
+            if expiry < now:
+                self.expirations += 1
+            elif (self.max_entries and len(self.entries) > self.max_entries) \
+                    or (self.max_bytes and self.size > self.max_bytes):
+                self.evictions += 1
+            else:
+                break
+            self.pop_entry(key)
+
+    def stats(self):
+        """
+        :returns: dict with the current number of entries and bytes and the hit, miss, eviction and expiration counters.
+        """
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
 class Transaction(MutableMapping):
     """ An object that encapsulates the transaction-access.
     The transactions are stored in the session.
@@ -28,8 +386,47 @@ class Transaction(MutableMapping):
 
     #: Internal cache of the data this transaction holds.
     _data = None
-    #: Internal cache of the data this transaction held when loaded.
-    _data_original = None
+
+    #: Change journal: Component ids whose entries have been changed since the last load or store.
+    _dirty_components = None
+    #: Change journal: Top level keys that have been changed since the last load or store.
+    _dirty_keys = None
+    #: Change journal: Snapshots of the entries of components whose mutable values have been handed out, by component
+    #: id. See :meth:`watch_component`.
+    _watched_components = None
+    #: Change journal: Snapshots of the mutable top level values that have been handed out, by key.
+    _watched_keys = None
+    #: Top level keys whose changes are recorded by the component api methods instead of on access.
+    tracked_keys = frozenset(['compo_store', 'compo_struct', '__class_table__'])
+    #: Top level keys holding integer bitsets, concurrent changes to them are merged bitwise by :meth:`merge_meta`.
+    bitset_keys = frozenset(['rendered_assets'])
+    #: The transaction id the data was loaded from or last stored to. Stores that write changes only need a full write
+    #: if this differs from :attr:`tid`.
+    stored_tid = None
+
+    #: Hash field of the redis_hash store containing everything but the compo_store.
+    redis_hash_meta_field = 'm'
+    #: Prefix of the redis_hash store fields containing a single compo_info each.
+    redis_hash_component_prefix = 'c:'
+    #: Hash field of the redis_hash store flagging the transaction as locked.
+    redis_hash_lock_field = 'l'
+    #: Hash field of the redis_hash store listing the transaction ids of the versions a version is based on.
+    redis_hash_base_field = 'b'
+    #: Hash field of the redis_hash store counting the stores, used to detect concurrent changes.
+    redis_hash_version_field = 'v'
+    #: Value of a redis_hash store component field marking a component of a base version as deleted.
+    redis_hash_tombstone = ''
+
+    #: The redis_hash store version the data was loaded from or last stored as. See :meth:`store_redis_hash`.
+    stored_version = None
+    #: The encoded compo_infos by component id as loaded from or last stored to the redis_hash store.
+    stored_fields = None
+    #: The encoded meta field as loaded from or last stored to the redis_hash store.
+    stored_meta = None
+
+    #: The transaction ids of the locked versions the stored version of the redis_hash store is based on, nearest
+    #: first. Components not changed since the nearest base version are only stored in the base versions.
+    base_tids = ()
 
     #: Can contain a new transaction id to be used for storing this transaction. If given, the original transaction will
     #: be stored as locked under its original id so that it will be preserved in the state it was left in. Should be
@@ -47,16 +444,45 @@ class Transaction(MutableMapping):
     #: The session of the request currently in progress.
     session = None
 
+    #: Size of the data read from the store this request in bytes.
+    bytes_read = 0
+    #: Size of the data written to the store this request in bytes.
+    bytes_written = 0
+
+    #: Depths of the components by component id, see :meth:`get_component_depth`. Kept up to date by the component
+    #: api methods, it is not stored.
+    component_depths = None
+    #: Data ids used for component ids by :meth:`generate_child_cid`.
+    data_id_pattern = re.compile(r'^[A-Za-z0-9]{1,32}$')
+    #: Keys of the class table entries by their frozen class and config. See :meth:`intern_class_state`.
+    class_keys = None
+    #: :class:`ChildIndex` instances by container id, None for the top level. See :meth:`get_child_index`.
+    child_indexes = None
+
     def __init__(self, request, context, tid=None):
         """ Give tid = None to create a new one """
 
-        self.instances = {}
+        self.instances = ComponentInstances()
+        #: Component ids of the components that requested a redraw during this request, see :meth:`plan_redraws`.
+        self.redraw_requests = set()
+        #: Component ids of the containers that requested a structure update during this request, see
+        #: :meth:`plan_structure_updates`.
+        self.structure_requests = set()
+        #: Classes of the components rendered during this request in render order, see
+        #: :meth:`~solute.epfl.core.epflpage.Page.get_asset_ids`.
+        self.rendered_classes = odict()
+        #: Identifies the renders of this request in the render records of the components, see
+        #: :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.record_render`.
+        self.render_stamp = uuid.uuid4().hex[:8]
         self.request = request
         self.session = request.session
         self.tid = tid
         self.created = False
 
         self.compo_reference = {}
+        self.component_depths = {}
+        self.child_indexes = {}
+        self.reset_journal()
 
         if not self.tid:
             self.tid = uuid.uuid4().hex
@@ -115,14 +541,64 @@ class Transaction(MutableMapping):
 
     # EPFL Core Api methods
     def get_component_depth(self, cid):
-        """
+        """Depths are kept in :attr:`component_depths` once computed, a component and all its containers are looked up
+        at most once per request.
+
         :param cid: component id of target component.
         :returns: the number of containers the component with the given cid is part of.
         """
         try:
-            return self.get_component_depth(self['compo_store'][cid]['ccid']) + 1
+            return self.component_depths[cid]
         except KeyError:
+            pass
+
+        compo_info = self['compo_store'].get(cid)
+        if compo_info is None:
             return 0
+        depth = 0
+        if 'ccid' in compo_info:
+            depth = self.get_component_depth(compo_info['ccid']) + 1
+        self.component_depths[cid] = depth
+        return depth
+
+    def forget_component_depth(self, cid):
+        """Remove the component and all its children from :attr:`component_depths`. Since the depth of a component is
+        only known if the depths of its containers are known, the children need not be visited if the component itself
+        is unknown.
+
+        :param cid: component id of target component.
+        """
+        if self.component_depths.pop(cid, None) is None:
+            return
+        compo_info = self.get_component(cid) or {}
+        for child_cid in compo_info.get('compo_struct', []):
+            self.forget_component_depth(child_cid)
+        for child_cid in compo_info.get('sleeping_compo_struct', {}).values():
+            self.forget_component_depth(child_cid)
+
+    def get_child_index(self, ccid):
+        """Return the :class:`ChildIndex` of the compo_struct of a container. All changes to a compo_struct done by the
+        component api methods go through its index.
+
+        :param ccid: component id of the container, None for the top level compo_struct.
+        :returns: :class:`ChildIndex`
+        """
+        if ccid is None:
+            struct = self['compo_struct']
+        else:
+            struct = self.get_component(ccid).setdefault('compo_struct', [])
+
+        child_index = self.child_indexes.get(ccid)
+        if child_index is None or child_index.struct is not struct:
+            child_index = self.child_indexes[ccid] = ChildIndex(struct)
+        return child_index
+
+    def get_component_position(self, cid):
+        """
+        :param cid: component id of target component.
+        :returns: The position of the component in the compo_struct of its container.
+        """
+        return self.get_child_index(self.get_component(cid).get('ccid')).index(cid)
 
     def get_existing_components(self):
         """
@@ -137,23 +613,146 @@ class Transaction(MutableMapping):
         :param cid: component id of target component.
         :returns: :class:`~solute.epfl.core.epflcomponentbase.ComponentBase` instance.
         """
-        if cid not in self.instances:
-            compo_info = self.get_component(cid)
-            if compo_info is None:
-                raise Exception('Component with cid %s not found in transaction.' % cid)
-            ubc = epflcomponentbase.UnboundComponent.create_from_state(compo_info['class'])
-            self.instances[cid] = ubc(page,
-                                      cid,
-                                      __instantiate__=True,
-                                      config=compo_info['config'])
+        compo_obj = self.instances.get(cid)
+        if compo_obj is not None:
+            return compo_obj
+        compo_info = self.get_component(cid)
+        if compo_info is None:
+            raise Exception('Component with cid %s not found in transaction.' % cid)
+        state = self.get_class_state(compo_info)
+        ubc = epflcomponentbase.UnboundComponent.create_from_state(state)
+        self.instances[cid] = ubc(page,
+                                  cid,
+                                  __instantiate__=True,
+                                  config=state[1])
+        if cid in self.data.get('__deferred_components__', ()):
+            self['__deferred_components__'].discard(cid)
+            self.instances[cid].init_added_component()
         return self.instances[cid]
 
-    def get_active_components(self):
+    def get_class_state(self, compo_info):
+        """
+        :param compo_info: info dict of a component.
+        :returns: The state (class, config, position) of the
+                  :class:`~solute.epfl.core.epflcomponentbase.UnboundComponent` the component was created from.
+        """
+        state = compo_info['class']
+        if type(state) is tuple:
+            return state
+        cls, shared_config = self.data['__class_table__'][state]
+        config = shared_config.copy()
+        config.update(compo_info['config'])
+        return cls, config, (compo_info.get('cid'), compo_info.get('slot'))
+
+    def intern_class_state(self, cls, shared_config):
+        """Add a class and the config shared by many components, like the children created from the same
+        default_child_cls, to the class table of this transaction. Their compo_infos reference the entry by its key and
+        only contain the rest of their config.
+
+        :param cls: The component class.
+        :param shared_config: The shared config.
+        :returns: The key of the entry, None if the config can not be interned.
         """
+        try:
+            frozen = cls, freeze(shared_config)
+        except TypeError:
+            return None
+
+        table = self.data.get('__class_table__')
+        if table is None:
+            table = self.data['__class_table__'] = {}
+            self.mark_key_dirty('__class_table__')
+        if self.class_keys is None:
+            self.class_keys = {}
+            for key, (table_cls, table_config) in table.items():
+                try:
+                    self.class_keys[table_cls, freeze(table_config)] = key
+                except TypeError:
+                    pass
+
+        key = self.class_keys.get(frozen)
+        if key is None or key not in table:
+            try:
+                # The key is derived from the content, so concurrent requests agree on it.
+                digest = hashlib.md5(pickle.dumps((cls, shared_config), pickle.HIGHEST_PROTOCOL)).hexdigest()
+            except Exception:
+                return None
+            key = digest[:8]
+            if key in table and (table[key][0], freeze(table[key][1])) != frozen:
+                key = digest
+            table[key] = cls, shared_config
+            self.class_keys[frozen] = key
+            self.mark_key_dirty('__class_table__')
+        return key
+
+    def get_active_components(self, sorted_by_depth=False):
+        """
+        :param sorted_by_depth: (optional) Order the components by their depth, containers before their children.
         :returns: Return all :class:`~solute.epfl.core.epflcomponentbase.ComponentBase` instances held in this
                   :class:`Transaction` instance.
         """
-        return self.instances.values()
+        if not sorted_by_depth:
+            return self.instances.values()
+
+        by_depth = defaultdict(list)
+        for compo_obj in self.instances.itervalues():
+            by_depth[self.get_component_depth(compo_obj.cid)].append(compo_obj)
+        return [compo_obj for depth in sorted(by_depth) for compo_obj in by_depth[depth]]
+
+    def get_lifecycle_subscribers(self, hook):
+        """
+        :param hook: Name of a lifecycle hook, see
+                     :attr:`~solute.epfl.core.epflcomponentbase.ComponentBase.lifecycle_hooks`.
+        :returns: List of the active components whose class implements the hook.
+        """
+        return self.instances.subscribers[hook].values()
+
+    def plan_redraws(self):
+        """Plan the partial rendering of an AJAX request. Only components that requested a redraw are considered,
+        those with an ancestor redrawn as well are left out since they are rendered by it. Components that have been
+        deleted or put to sleep since are left out as well.
+
+        :returns: The component ids of the components to be redrawn in document order.
+        """
+        requested = self.redraw_requests
+        paths = []
+        for cid in requested:
+            # The positions from the top level down to the component, comparing them yields the document order.
+            path = []
+            current = cid
+            while current is not None:
+                compo_info = self.get_component(current)
+                if compo_info is None:
+                    break
+                ccid = compo_info.get('ccid')
+                if ccid in requested:
+                    break
+                try:
+                    path.append(self.get_child_index(ccid).index(current))
+                except ValueError:
+                    break
+                current = ccid
+            else:
+                path.reverse()
+                paths.append((path, cid))
+        paths.sort()
+        return [cid for path, cid in paths]
+
+    def plan_structure_updates(self):
+        """Containers redrawn themselves or by an ancestor are left out, as well as those that have been deleted since.
+
+        :returns: The component ids of the containers whose children are updated by structural operations, outer
+                  containers first.
+        """
+        planned = []
+        for cid in self.structure_requests:
+            current = cid
+            while current is not None and current not in self.redraw_requests:
+                compo_info = self.get_component(current)
+                current = compo_info.get('ccid') if compo_info is not None else False
+            if current is None:
+                planned.append(cid)
+        return sorted(planned, key=self.get_component_depth)
 
     def is_active_component(self, cid):
         """Check if a component is currently initialized inside this :class:`Transaction` instance.
@@ -171,15 +770,49 @@ class Transaction(MutableMapping):
         :param position: (optional) position the component should hold after the switch.
         """
         compo_info = self.get_component(cid)
-        old_parent = self.get_component(compo_info['ccid'])
-        old_parent['compo_struct'].remove(cid)
+        self.mark_component_dirty(cid)
+        self.mark_component_dirty(compo_info['ccid'])
+        self.mark_component_dirty(ccid)
+        self.get_child_index(compo_info['ccid']).remove(cid)
 
         compo_info['ccid'] = ccid
-        if position is None:
-            position = len(self.get_component(ccid)['compo_struct'])
-
-        new_parent = self.get_component(compo_info['ccid'])
-        new_parent['compo_struct'].insert(position, cid)
+        # The client removes the component from its old container, it is no longer part of any rendered DOM.
+        compo_info.pop('render', None)
+        self.forget_component_depth(cid)
+        self.get_child_index(ccid).insert(position, cid)
+
+    def reorder_children(self, ccid, order, start=0):
+        """Bring the children of a container into the given order in a single change of its compo_struct. Only the
+        children not part of a longest subsequence already in order have to be moved, they are returned.
+
+        :param ccid: component id of the container, None for the top level compo_struct.
+        :param order: The component ids in their new order. Children missing in it are kept behind them.
+        :param start: (optional) Position of the first child to be reordered, children in front of it are kept.
+        :returns: The list of the component ids that have been moved.
+        """
+        child_index = self.get_child_index(ccid)
+        current = child_index.struct[start:]
+        if current == order:
+            return []
+
+        positions = dict((cid, i) for i, cid in enumerate(current))
+        ordered = set(order)
+        if len(ordered) != len(order) or not ordered.issubset(positions):
+            raise ValueError('The new order of the children of %r contains unknown or repeated children.' % ccid)
+        target = list(order) + [cid for cid in current if cid not in ordered]
+
+        sequence = [positions[cid] for cid in target]
+        kept = set(target[i] for i in longest_increasing_subsequence(sequence))
+        moved = [cid for cid in target if cid not in kept]
+        if not moved:
+            return moved
+
+        child_index.reorder(start, target)
+        if ccid is None:
+            self.mark_key_dirty('compo_struct')
+        else:
+            self.mark_component_dirty(ccid)
+        return moved
 
     def get_component(self, cid):
         """Return the components entry in this :class:`Transaction` instance.
@@ -214,19 +847,63 @@ class Transaction(MutableMapping):
         if compo_obj:
             self.instances[cid] = compo_obj
 
-        container = self
-        if 'ccid' in compo_info:
-            container = self.get_component(compo_info['ccid'])
+        ccid = compo_info.get('ccid')
+        if ccid is not None:
+            self.mark_component_dirty(ccid)
+        else:
+            self.setdefault('compo_struct', list())
+            self.mark_key_dirty('compo_struct')
+        self.mark_component_dirty(cid)
         if 'cid' not in compo_info:
             compo_info['cid'] = cid
 
-        compo_struct = container.setdefault('compo_struct', list())
-        if position is None:
-            compo_struct.append(cid)
-        else:
-            compo_struct.insert(position, cid)
+        self.get_child_index(ccid).insert(position, cid)
 
         self['compo_store'][cid] = compo_info
+        if ccid is None:
+            self.component_depths[cid] = 0
+        elif compo_info['ccid'] in self.component_depths:
+            self.component_depths[cid] = self.component_depths[compo_info['ccid']] + 1
+
+    def set_components(self, ccid, compo_infos, position=None):
+        """Set the entries of many children of a container in one step. Their component ids are validated up front, if
+        any of them is not unique no entry is set at all.
+
+        :param ccid: component id of the container, None for the top level compo_struct.
+        :param compo_infos: List of info dicts of the components, each containing its cid.
+        :param position: (optional) position the first of the components shall hold inside the container, the others
+                         follow it.
+        """
+        cids = [compo_info['cid'] for compo_info in compo_infos]
+        compo_store = self['compo_store']
+        taken = [cid for cid in cids if cid in compo_store]
+        if taken or len(set(cids)) != len(cids):
+            raise Exception('CIDs {cids} are not unique for this transaction.'.format(cids=taken or cids))
+
+        if ccid is not None:
+            self.mark_component_dirty(ccid)
+        else:
+            self.setdefault('compo_struct', list())
+            self.mark_key_dirty('compo_struct')
+
+        depth = self.component_depths.get(ccid) if ccid is not None else -1
+        for compo_info in compo_infos:
+            cid = compo_info['cid']
+            compo_info['ccid'] = ccid
+            self.mark_component_dirty(cid)
+            compo_store[cid] = compo_info
+            if depth is not None:
+                self.component_depths[cid] = depth + 1
+
+        self.get_child_index(ccid).insert_many(position, cids)
+
+    def defer_component_init(self, cids):
+        """Mark components whose :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.init_transaction` is run on
+        their first instantiation by :meth:`get_component_instance` instead of when they are added.
+
+        :param cids: component ids of the components.
+        """
+        self.setdefault('__deferred_components__', set()).update(cids)
 
     def del_component(self, cid):
         """Remove the components entry in this :class:`Transaction` instance.
@@ -234,17 +911,18 @@ class Transaction(MutableMapping):
         :param cid: component id of target component.
         """
         compo = self.get_component(cid)
+        self.mark_component_dirty(cid)
 
         # Wake components that have been put to sleep in order to correctly delete them.
         if 'sleeping_compo_struct' in compo:
             for sid in compo['sleeping_compo_struct'].keys():
                 self.wake_component_id(cid, sid)
 
+        self.get_child_index(compo.get('ccid')).remove(cid)
         if 'ccid' in compo:
-            container = self.get_component(compo['ccid'])
-            container['compo_struct'].remove(cid)
+            self.mark_component_dirty(compo['ccid'])
         else:
-            self['compo_struct'].remove(cid)
+            self.mark_key_dirty('compo_struct')
 
         # List has to be copied, since del_component modifies it.
         for child_cid in list(compo.get('compo_struct', [])):
@@ -254,7 +932,11 @@ class Transaction(MutableMapping):
         if cid in self.instances:
             del self.instances[cid]
 
+        self.component_depths.pop(cid, None)
+        self.child_indexes.pop(cid, None)
         self['compo_store'].pop(cid)
+        if cid in self.data.get('__deferred_components__', ()):
+            self['__deferred_components__'].discard(cid)
 
     def has_component(self, cid):
         """Check if the child component has an entry in this :class:`Transaction` instance.
@@ -262,39 +944,281 @@ class Transaction(MutableMapping):
         :param cid: component id of target component.
         :returns: True or False
         """
-        return cid in self['compo_store']
+        return cid in self.data['compo_store']
+
+    @property
+    def compact_cids(self):
+        """True if automatically generated component ids are allocated by :meth:`generate_cid`, enabled by the
+        epfl.transaction.compact_cids setting.
+        """
+        return asbool(self.request.registry.settings.get('epfl.transaction.compact_cids', False))
+
+    def generate_cid(self):
+        """Returns a new short component id, unique in this transaction. The ids are a base62 counter stored in the
+        transaction. Concurrent requests allocating the same id both add a component under it, which is a conflict
+        when they are stored, so ids never collide across workers.
 
-    def hibernate_component_id(self, cid):
+        :returns: The component id.
+        """
+        counter = self.data.get('__cid_counter__', 0)
+        while True:
+            counter += 1
+            cid = '_' + base62(counter)
+            if not self.has_component(cid):
+                break
+        self['__cid_counter__'] = counter
+        return cid
+
+    def generate_child_cid(self, ccid, data_id):
+        """Returns a deterministic component id for the child of a data driven container, derived from the container
+        id and the data id, separated by a dash since templates derive element ids from the component id with an
+        underscore. Data ids that are neither non negative integers nor short alphanumeric strings and ids already
+        taken are replaced by :meth:`generate_cid`.
+
+        :param ccid: component id of the container.
+        :param data_id: The id of the data the child represents.
+        :returns: The component id.
+        """
+        if type(data_id) in (int, long) and data_id >= 0:
+            cid = '%s-%s' % (ccid, base62(data_id))
+        elif isinstance(data_id, basestring) and self.data_id_pattern.match(data_id):
+            cid = '%s-%s' % (ccid, data_id)
+        else:
+            return self.generate_cid()
+        if self.has_component(cid):
+            return self.generate_cid()
+        return str(cid)
+
+    def hibernate_component_id(self, cid, max_sleeping=None):
         """Sets the given component to be temporarily inactive. The component will not be listed or accessible unless
         reactivated using :func:`wake_component_id` on it.
 
+        Sleeping components are kept in the order they were put to sleep. If the container holds more than max_sleeping
+        or the transaction more than epfl.transaction.max_sleeping_components sleeping components, the ones put to sleep
+        longest ago are deleted, see :meth:`evict_sleeping_components`.
+
         :param cid: The component to be put to sleep.
+        :param max_sleeping: (optional) Maximum number of sleeping components of the container, defaults to
+                             epfl.transaction.max_sleeping_children. 0 for no limit.
         """
         compo = self.get_component(cid)
-        parent = self.get_component(compo.get('ccid'))
+        ccid = compo.get('ccid')
+        parent = self.get_component(ccid)
+        self.mark_component_dirty(ccid)
 
-        parent['compo_struct'].remove(cid)
-        parent.setdefault('sleeping_compo_struct', {})[compo['config']['id']] = cid
+        self.get_child_index(ccid).remove(cid)
         if cid in self.instances:
             del self.instances[cid]
 
+        config = compo['config']
+        if 'id' not in config:
+            config = self.get_class_state(compo)[1]
+        data_id = config['id']
+        sleeping = parent.setdefault('sleeping_compo_struct', {})
+        if data_id in sleeping:
+            # A component for the same data id is already sleeping, it would be unreachable.
+            self.del_sleeping_component(ccid, data_id)
+        self['__sleeping_seq__'] = self.get('__sleeping_seq__', 0) + 1
+        self.get_sleeping_order(ccid).append((self['__sleeping_seq__'], data_id))
+        sleeping[data_id] = cid
+        self.update_sleeping_count(ccid)
+
+        settings = self.request.registry.settings
+        if max_sleeping is None:
+            max_sleeping = int(settings.get('epfl.transaction.max_sleeping_children', 1000))
+        self.evict_sleeping_components(ccid, max_sleeping,
+                                       int(settings.get('epfl.transaction.max_sleeping_components', 10000)))
+
     def wake_component_id(self, cid, data_id):
         """Sets the child component identified by the data_id to be active again.
 
         :param data_id: The data id of the component to be woken.
         """
         parent = self.get_component(cid)
+        self.mark_component_dirty(cid)
 
-        parent['compo_struct'].append(parent.get('sleeping_compo_struct').pop(data_id))
+        self.get_child_index(cid).insert(None, parent.get('sleeping_compo_struct').pop(data_id))
+        sleeping_order = self.get_sleeping_order(cid)
+        for i, (seq, sleeping_id) in enumerate(sleeping_order):
+            if sleeping_id == data_id:
+                del sleeping_order[i]
+                break
+        self.update_sleeping_count(cid)
+
+    def del_sleeping_component(self, cid, data_id):
+        """Delete the sleeping child component identified by the data_id and all its children.
+
+        :param cid: component id of the container.
+        :param data_id: The data id of the component to be deleted.
+        """
+        child_cid = self.get_component(cid)['sleeping_compo_struct'][data_id]
+        self.wake_component_id(cid, data_id)
+        self.del_component(child_cid)
+
+    def get_sleeping_order(self, cid):
+        """Return the list of (sequence number, data id) of the sleeping child components of a container, oldest first.
+        The sequence number counts the components put to sleep in the transaction. Containers stored without it get one
+        in arbitrary order.
+
+        :param cid: component id of the container.
+        :returns: list
+        """
+        compo_info = self.get_component(cid)
+        sleeping_order = compo_info.get('sleeping_order')
+        if sleeping_order is None:
+            sleeping_order = compo_info['sleeping_order'] = [(0, data_id) for data_id in
+                                                             compo_info.get('sleeping_compo_struct', {})]
+        return sleeping_order
+
+    def update_sleeping_count(self, cid):
+        """Update the number of sleeping child components of a container in the transaction wide counts, see
+        :meth:`get_sleeping_counts`.
+
+        :param cid: component id of the container.
+        """
+        count = len(self.get_component(cid).get('sleeping_compo_struct', {}))
+        sleeping_counts = self.data.setdefault('__sleeping_counts__', {})
+        if sleeping_counts.get(cid, 0) == count:
+            return
+        if count:
+            sleeping_counts[cid] = count
+        else:
+            sleeping_counts.pop(cid, None)
+        self.mark_key_dirty('__sleeping_counts__')
+
+    def get_sleeping_counts(self):
+        """
+        :returns: dict of the number of sleeping child components by component id of their container.
+        """
+        return dict(self.data.get('__sleeping_counts__', {}))
+
+    def evict_sleeping_components(self, cid, max_sleeping, max_sleeping_total=0):
+        """Delete the sleeping child components put to sleep longest ago until the container holds at most
+        max_sleeping and the transaction at most max_sleeping_total sleeping components. The transaction wide limit
+        evicts from all containers.
+
+        :param cid: component id of the container.
+        :param max_sleeping: Maximum number of sleeping components of the container, 0 for no limit.
+        :param max_sleeping_total: (optional) Maximum number of sleeping components of the transaction, 0 for no limit.
+        """
+        if max_sleeping:
+            sleeping_order = self.get_sleeping_order(cid)
+            while len(sleeping_order) > max_sleeping:
+                self.del_sleeping_component(cid, sleeping_order[0][1])
+
+        if not max_sleeping_total:
+            return
+        sleeping_counts = self.data.get('__sleeping_counts__', {})
+        total = sum(sleeping_counts.values())
+        while total > max_sleeping_total:
+            oldest = min((self.get_sleeping_order(ccid)[0], ccid) for ccid in sleeping_counts)
+            self.del_sleeping_component(oldest[1], oldest[0][1])
+            total -= 1
+
+    # Change journal
+    def mark_component_dirty(self, cid):
+        """Record in the change journal that the entry of a component has been changed this request. Has to be called by
+        everything that modifies a compo_info in place.
+
+        :param cid: component id of target component.
+        """
+        self._dirty_components.add(cid)
+
+    def mark_key_dirty(self, key):
+        """Record in the change journal that a top level entry of this :class:`Transaction` instance has been changed.
+
+        :param key: The top level key.
+        """
+        self._dirty_keys.add(key)
+
+    def watch_component(self, cid):
+        """Record in the change journal that a mutable value of the entry of a component has been handed out and may
+        be changed in place. The entry is compared to a snapshot taken now by :meth:`collect_changes`, it is only
+        recorded as changed if it differs.
+
+        :param cid: component id of target component.
+        """
+        if cid not in self._dirty_components and cid not in self._watched_components:
+            self._watched_components[cid] = self.get_snapshot(self.get_component(cid))
+
+    def watch_key(self, key):
+        """Record in the change journal that the mutable value of a top level key has been handed out, see
+        :meth:`watch_component`.
+
+        :param key: The top level key.
+        """
+        if key not in self._dirty_keys and key not in self._watched_keys:
+            self._watched_keys[key] = self.get_snapshot(self._data[key])
+
+    def get_snapshot(self, value):
+        """
+        :param value: A value of the transaction data.
+        :returns: A private copy of value to compare it to later on. Values that can not be compared, like instances of
+                  classes without an __eq__ method, always differ from their copy.
+        """
+        # Encoding and decoding is cheaper than copy.deepcopy. The encoded form depends on the identity of the objects
+        # referenced, so it can not be compared itself.
+        return self.codec.loads(self.codec.dumps(value))
+
+    def collect_changes(self):
+        """Compare the watched entries to their snapshots and record those that have been changed in place.
+        """
+        compo_store = self._data['compo_store'] if self._data else {}
+        for cid, snapshot in self._watched_components.items():
+            if cid in self._dirty_components or cid not in compo_store:
+                del self._watched_components[cid]
+            elif compo_store[cid] != snapshot:
+                del self._watched_components[cid]
+                self._dirty_components.add(cid)
+        for key, snapshot in self._watched_keys.items():
+            if key in self._dirty_keys or key not in self._data:
+                del self._watched_keys[key]
+            elif self._data[key] != snapshot:
+                del self._watched_keys[key]
+                self._dirty_keys.add(key)
+
+    def get_dirty_components(self):
+        """
+        :returns: The set of component ids whose entries have been changed since the last load or store.
+        """
+        self.collect_changes()
+        return self._dirty_components
+
+    def get_dirty_keys(self):
+        """
+        :returns: The set of top level keys that have been changed since the last load or store.
+        """
+        self.collect_changes()
+        return self._dirty_keys
+
+    def reset_journal(self):
+        """Forget all recorded changes, the current data is considered to be equal to the stored data.
+        """
+        self._dirty_components = set()
+        self._dirty_keys = set()
+        self._watched_components = {}
+        self._watched_keys = {}
 
     # MutableMapping requirements:
     def __getitem__(self, key):
-        return self.data.__getitem__(key)
+        value = self.data.__getitem__(key)
+        # Mutable values may be changed in place by the caller, so they are compared to a snapshot on store.
+        if key not in self.tracked_keys and not is_immutable(value):
+            self.watch_key(key)
+        return value
 
     def __setitem__(self, key, value):
+        self._dirty_keys.add(key)
+        if key == 'compo_store':
+            self.component_depths.clear()
+            self.child_indexes.clear()
         return self.data.__setitem__(key, value)
 
     def __delitem__(self, key):
+        self._dirty_keys.add(key)
+        if key == 'compo_store':
+            self.component_depths.clear()
+            self.child_indexes.clear()
         return self.data.__delitem__(key)
 
     def __contains__(self, key):
@@ -307,16 +1231,32 @@ class Transaction(MutableMapping):
         return self.data.__len__()
 
     # Internal storage handling
-    def lock_transaction(self):
+    def lock_transaction(self, tid, pipe=None):
         """
-        Load a copy of the current transaction, unset the flag requesting a new transaction, reset the lock status and
-        store it as locked. After calling this the transaction related to this :class:`Transaction` instance should be
-        stored under a new transaction id, else it would override the locked copy.
+        Mark the stored copy of the transaction with the given id as locked without loading it. It keeps the state it
+        was last stored with, so browser navigation can switch back to it. Used by :meth:`store` before storing the
+        current data under a new transaction id.
+
+        :param tid: The transaction id of the stored copy.
+        :param pipe: The redis pipeline of the store in progress, required for the redis stores.
         """
-        old_transaction = Transaction(self.request, self.tid)
-        old_transaction.tid_new = None
-        old_transaction.pop('locked', None)
-        old_transaction.store(lock=True)
+        store_type = self.request.registry.settings.get('epfl.transaction.store')
+        transaction_timeout = int(self.request.registry.settings.get('epfl.transaction.timeout', 1800))
+        if store_type in ['redis', 'redis_context']:
+            pipe.setex('TA_%s_locked' % tid, transaction_timeout, 1)
+            pipe.expire('TA_%s' % tid, transaction_timeout)
+        elif store_type == 'redis_hash':
+            pipe.hset('TA_%s' % tid, self.redis_hash_lock_field, 1)
+            # Concurrent requests still working on the locked copy must not store their changes into it.
+            pipe.hincrby('TA_%s' % tid, self.redis_hash_version_field, 1)
+            pipe.expire('TA_%s' % tid, transaction_timeout)
+        elif store_type == 'memory':
+            stored_data = self.memory.get('TA_%s' % tid)
+            if stored_data is not None:
+                stored_data['locked'] = True
+                self.memory['TA_%s' % tid] = stored_data
+        else:
+            raise Exception('No valid transaction store found!')
 
     def store_as_new(self):
         """
@@ -326,36 +1266,388 @@ class Transaction(MutableMapping):
 
     def store(self, lock=False):
         """
-        Recursive storing mechanism. If no changes have occurred during this request nothing is done. If the transaction
-        is locked because it has spawned a child transaction a new transaction will be generated. If a new transaction
-        has been requested the current transaction is stored locked and a new unlocked transaction with the same content
-        is stored in its stead.
+        Recursive storing mechanism. If the change journal did not record any changes during this request nothing is
+        done. If the transaction is locked because it has spawned a child transaction a new transaction will be
+        generated. If a new transaction has been requested the stored copy of the current transaction is marked as
+        locked and the current data is stored under the new transaction id. For the redis stores both happen in a
+        single round trip.
         """
-        if self.is_clean and not lock:
+        self.collect_changes()
+        if not self._dirty_components and not self._dirty_keys and not lock:
             return
 
+        if asbool(self.request.registry.settings.get('epfl.transaction.sparse_state', False)):
+            self.compact_compo_states()
+
         if self.pop('locked', False):
             self.store_as_new()
 
         if lock:
             self['locked'] = lock
 
-        if self.tid_new:
-            self.lock_transaction()
-            self.tid = self.tid_new
+        locked_tid = None
+        if self.tid_new and self.tid_new != self.tid:
+            locked_tid, self.tid = self.tid, self.tid_new
 
         store_type = self.request.registry.settings.get('epfl.transaction.store')
-        transaction_timeout = self.request.registry.settings.get('epfl.transaction.timeout', 1800)
+        transaction_timeout = int(self.request.registry.settings.get('epfl.transaction.timeout', 1800))
         if store_type == 'redis':
-            self.redis.setex('TA_%s' % self.tid, transaction_timeout, pickle.dumps(self._data))
+            self.store_redis(self.redis, transaction_timeout, locked_tid)
         elif store_type == 'redis_context':
             with self.redis_context() as redis:
-                redis.setex('TA_%s' % self.tid, pickle.dumps(self._data, pickle.HIGHEST_PROTOCOL), transaction_timeout)
+                self.store_redis(redis, transaction_timeout, locked_tid)
+        elif store_type == 'redis_hash':
+            self.store_redis_hash(transaction_timeout, locked_tid)
         elif store_type == 'memory':
-            self.memory['TA_%s' % self.tid] = self._data
+            if locked_tid:
+                self.lock_transaction(locked_tid)
+            self.bytes_written += self.memory.set('TA_%s' % self.tid, self._data)
         else:
             raise Exception('No valid transaction store found!')
 
+        self.stored_tid = self.tid
+        self.reset_journal()
+
+    def compact_compo_states(self):
+        """Remove the compo_state values equal to their defaults from all changed components instantiated during this
+        request, see :meth:`~solute.epfl.core.epflcomponentbase.ComponentBase.compact_compo_state`. Transactions stored
+        without sparse state stay readable, their components are compacted once they change.
+        """
+        for cid in self._dirty_components:
+            compo = self.instances.get(cid)
+            if compo is not None:
+                compo.compact_compo_state()
+
+    def get_size_report(self):
+        """Measure the encoded size of the current data broken down to component classes. Decodes all components.
+
+        :returns: :class:`~solute.epfl.core.epflanalyzer.SizeReport`
+        """
+        report = SizeReport(self.codec)
+        compo_store = self.data['compo_store']
+        report.add_transaction(self.tid, self.data, dict(getattr(compo_store, 'raw', {})))
+        return report
+
+    def log_size(self):
+        """Log the bytes read from and written to the store this request and the number of components as gauges if
+        epfl.performance_log.enabled is set. If epfl.transaction.size_report is set as well the size of every component
+        class, its compo_state, config and sleeping components is logged, see :meth:`get_size_report`.
+        """
+        settings = self.request.registry.settings
+        if not asbool(settings.get('epfl.performance_log.enabled', False)):
+            return
+
+        values = [('transaction_bytes_read', self.bytes_read),
+                  ('transaction_bytes_written', self.bytes_written),
+                  ('transaction_components', len(self.data['compo_store']))]
+        if asbool(settings.get('epfl.transaction.size_report', False)):
+            for class_size in self.get_size_report().classes.values():
+                name = 'transaction_size_' + class_size.name
+                values += [(name, class_size.bytes),
+                           (name + '_compo_state', class_size.state_bytes),
+                           (name + '_config', class_size.config_bytes),
+                           (name + '_sleeping', class_size.sleeping_bytes)]
+
+        for name, value in values:
+            log_gauge(get_performance_log_key(self.request, name), value, request=self.request)
+
+    def store_redis(self, redis, transaction_timeout, locked_tid=None):
+        """Write the whole transaction as a single value, locking the previous copy in the same MULTI/EXEC round trip.
+
+        :param redis: The redis client to be used.
+        :param transaction_timeout: Expiry of the transaction in seconds.
+        :param locked_tid: (optional) Transaction id of a stored copy to be locked, see :meth:`lock_transaction`.
+        """
+        payload = self.codec.dumps(self._data)
+        self.bytes_written += len(payload)
+        pipe = redis.pipeline()
+        pipe.setex('TA_%s' % self.tid, transaction_timeout, payload)
+        if locked_tid:
+            self.lock_transaction(locked_tid, pipe)
+        pipe.execute()
+
+    def load_redis(self, redis):
+        """Read the value written by :meth:`store_redis` and its lock flag in a single round trip.
+
+        :param redis: The redis client to be used.
+        :returns: The transaction data or None if it does not exist.
+        """
+        pipe = redis.pipeline(transaction=False)
+        pipe.get('TA_%s' % self.tid)
+        pipe.exists('TA_%s_locked' % self.tid)
+        payload, locked = pipe.execute()
+        if not payload:
+            return None
+
+        self.bytes_read += len(payload)
+        data = self.codec.loads(payload)
+        if locked:
+            data['locked'] = True
+        return data
+
+    def store_redis_hash(self, transaction_timeout, locked_tid=None):
+        """Write the changes recorded in the change journal to a redis hash with one field per component and one field
+        for all remaining data. Components and the remaining data are only written if they changed, deleted components
+        are removed from the hash. If the compo_store was replaced or the transaction was not stored yet everything is
+        written. Runs as a single MULTI/EXEC round trip.
+
+        If the current data is stored under a new transaction id while the previous version is locked, the new version
+        only contains the changed components and refers to the locked version as its base, so components not changed
+        since are shared between the versions. Chains longer than epfl.transaction.max_version_depth are compacted by
+        writing the new version completely. The expiry of all base versions is refreshed on every store.
+
+        Every store increments the version field of the hash. If a concurrent request stored the same transaction
+        since it was loaded, the changes are merged by :meth:`merge_concurrent_store` and the store is repeated up to
+        epfl.transaction.store_attempts times.
+
+        :param transaction_timeout: Expiry of the hash in seconds.
+        :param locked_tid: (optional) Transaction id of a stored copy to be locked, see :meth:`lock_transaction`.
+        :raises TransactionConflict: If the changes could not be merged.
+        """
+        key = 'TA_%s' % self.tid
+        prefix = self.redis_hash_component_prefix
+        compo_store = self._data['compo_store']
+        settings = self.request.registry.settings
+        max_depth = int(settings.get('epfl.transaction.max_version_depth', 8))
+        attempts = max(1, int(settings.get('epfl.transaction.store_attempts', 3)))
+
+        base_tids = list(self.base_tids)
+        full_write = self.stored_tid is None or 'compo_store' in self._dirty_keys
+        new_version = False
+        if locked_tid and locked_tid == self.stored_tid and len(base_tids) < max_depth:
+            base_tids.insert(0, locked_tid)
+            new_version = True
+        elif self.tid != self.stored_tid:
+            full_write = True
+        if full_write:
+            base_tids = []
+            new_version = False
+        # Only the hash the data was loaded from may have been changed by concurrent requests.
+        guarded = self.tid == self.stored_tid
+
+        if full_write:
+            cids, deleted_cids = compo_store.keys(), []
+        else:
+            cids = [cid for cid in self._dirty_components if cid in compo_store]
+            deleted_cids = [cid for cid in self._dirty_components if cid not in compo_store]
+
+        raw = getattr(compo_store, 'raw', {})
+        fields = {}
+        for cid in cids:
+            if cid in raw:
+                # Never accessed, so it is still in its encoded form.
+                fields[prefix + cid] = raw[cid]
+            else:
+                fields[prefix + cid] = self.codec.dumps(compo_store[cid])
+        if base_tids:
+            # Deleting the field would reveal the component of a base version.
+            for cid in deleted_cids:
+                fields[prefix + cid] = self.redis_hash_tombstone
+            deleted_cids = []
+        if full_write or new_version or self._dirty_keys:
+            meta = dict((k, v) for k, v in self._data.items() if k != 'compo_store')
+            fields[self.redis_hash_meta_field] = self.codec.dumps(meta)
+        if new_version:
+            fields[self.redis_hash_base_field] = ','.join(base_tids)
+
+        with self.redis.pipeline() as pipe:
+            for attempt in range(attempts):
+                write_fields, write_deleted_cids, merged_meta = fields, deleted_cids, None
+                try:
+                    version = 1
+                    if guarded:
+                        pipe.watch(key)
+                        stored_version = pipe.hget(key, self.redis_hash_version_field)
+                        if stored_version != self.stored_version:
+                            if full_write:
+                                raise TransactionConflict('Transaction %s was changed by a concurrent request.'
+                                                          % self.tid)
+                            write_fields, write_deleted_cids, merged_meta = self.merge_concurrent_store(
+                                pipe, key, fields, deleted_cids)
+                        version = int(stored_version or 0) + 1
+                    write_fields = dict(write_fields)
+                    write_fields[self.redis_hash_version_field] = version
+
+                    pipe.multi()
+                    if full_write or new_version:
+                        pipe.delete(key)
+                    if write_deleted_cids:
+                        pipe.hdel(key, *[prefix + cid for cid in write_deleted_cids])
+                    pipe.hmset(key, write_fields)
+                    pipe.expire(key, transaction_timeout)
+                    for base_tid in base_tids:
+                        pipe.expire('TA_%s' % base_tid, transaction_timeout)
+                    if locked_tid:
+                        self.lock_transaction(locked_tid, pipe)
+                    pipe.execute()
+                    self.bytes_written += sum(len(str(value)) for value in write_fields.itervalues())
+                    break
+                except WatchError:
+                    continue
+            else:
+                raise TransactionConflict('Transaction %s is changed by too many concurrent requests.' % self.tid)
+
+        if merged_meta is not None:
+            for key in [key for key in self._data if key != 'compo_store' and key not in merged_meta]:
+                del self._data[key]
+            self._data.update(merged_meta)
+
+        if full_write or new_version or self.stored_fields is None:
+            self.stored_fields = {}
+        for field, value in write_fields.iteritems():
+            if field.startswith(prefix):
+                self.stored_fields[field[len(prefix):]] = value
+        for cid in write_deleted_cids:
+            self.stored_fields.pop(cid, None)
+        self.stored_meta = write_fields.get(self.redis_hash_meta_field, self.stored_meta)
+        self.stored_version = str(version)
+        self.base_tids = tuple(base_tids)
+
+    def merge_concurrent_store(self, pipe, key, fields, deleted_cids):
+        """Merge the changes about to be written by :meth:`store_redis_hash` with those a concurrent request stored
+        since the data was loaded. Components changed by this request only are written, components changed by both
+        requests to different values are a conflict. Top level keys are merged by :meth:`merge_meta`.
+
+        :param pipe: The redis pipeline watching the hash.
+        :param key: The key of the hash.
+        :param fields: The fields about to be written.
+        :param deleted_cids: The component ids about to be deleted from the hash.
+        :returns: The fields and deleted component ids to be written instead and the merged top level keys, None if
+                  they are not written.
+        :raises TransactionConflict: If both requests changed the same data.
+        """
+        prefix = self.redis_hash_component_prefix
+        meta_field = self.redis_hash_meta_field
+        cids = [field[len(prefix):] for field in fields if field.startswith(prefix)] + deleted_cids
+
+        values = pipe.hmget(key, [meta_field, self.redis_hash_base_field, self.redis_hash_lock_field] +
+                            [prefix + cid for cid in cids])
+        stored_meta, stored_base, locked = values[:3]
+        if stored_meta is None or locked or (stored_base or '') != ','.join(self.base_tids):
+            raise TransactionConflict('Transaction %s was replaced or locked by a concurrent request.' % self.tid)
+
+        merged_fields, merged_deleted_cids = {}, []
+        for cid, theirs in zip(cids, values[3:]):
+            if theirs == self.redis_hash_tombstone:
+                theirs = None
+            elif theirs is None and self.base_tids:
+                # Still the component of the base version.
+                theirs = self.stored_fields.get(cid)
+            loaded = self.stored_fields.get(cid)
+            ours = None if cid in deleted_cids else fields[prefix + cid]
+            if ours == self.redis_hash_tombstone:
+                ours = None
+
+            if ours == loaded or ours == theirs:
+                continue
+            if theirs != loaded:
+                raise TransactionConflict('Component %s of transaction %s was changed by a concurrent request.'
+                                          % (cid, self.tid))
+            if cid in deleted_cids:
+                merged_deleted_cids.append(cid)
+            else:
+                merged_fields[prefix + cid] = fields[prefix + cid]
+
+        merged_meta = None
+        if meta_field in fields:
+            merged_meta = self.merge_meta(self.codec.loads(self.stored_meta), self.codec.loads(stored_meta),
+                                          self.codec.loads(fields[meta_field]))
+            merged_fields[meta_field] = self.codec.dumps(merged_meta)
+        return merged_fields, merged_deleted_cids, merged_meta
+
+    @staticmethod
+    def merge_meta(loaded, theirs, ours):
+        """Three way merge of the top level keys of a transaction. Keys changed by one side only take its value, sets
+        changed by both sides get the additions and removals of both, dicts changed by both sides get the changed
+        entries of both. The same applies to the bits of the integer bitsets listed in :attr:`bitset_keys`.
+
+        :param loaded: The top level keys as loaded.
+        :param theirs: The top level keys as stored by a concurrent request.
+        :param ours: The top level keys about to be stored.
+        :returns: The merged top level keys.
+        :raises TransactionConflict: If both sides changed a key to different values that can not be merged.
+        """
+        missing = object()
+        merged = {}
+        for key in set(loaded) | set(theirs) | set(ours):
+            base, their_value, our_value = loaded.get(key, missing), theirs.get(key, missing), ours.get(key, missing)
+            if our_value == base:
+                value = their_value
+            elif their_value == base or their_value == our_value:
+                value = our_value
+            elif isinstance(base, set) and isinstance(their_value, set) and isinstance(our_value, set):
+                value = (their_value | (our_value - base)) - (base - our_value)
+            elif key in Transaction.bitset_keys and isinstance(their_value, (int, long)) \
+                    and isinstance(our_value, (int, long)):
+                base = 0 if base is missing else base
+                value = (their_value | (our_value & ~base)) & ~(base & ~our_value)
+            elif isinstance(base, dict) and isinstance(their_value, dict) and isinstance(our_value, dict):
+                value = Transaction.merge_meta(base, their_value, our_value)
+            elif base is missing and isinstance(their_value, dict) and isinstance(our_value, dict):
+                value = Transaction.merge_meta({}, their_value, our_value)
+            else:
+                raise TransactionConflict('Transaction key %r was changed by a concurrent request.' % key)
+            if value is not missing:
+                merged[key] = value
+        return merged
+
+    def load_redis_hash(self):
+        """Read the redis hash written by :meth:`store_redis_hash`. The compo_info of each component is left encoded in
+        a :class:`ComponentStore` until it is accessed. If the version is based on other versions they are read in a
+        second round trip.
+
+        :returns: The transaction data or None if the hash or one of its base versions does not exist. A missing base
+                  version is logged as a warning, the state of the transaction is lost.
+        """
+        fields = self.redis.hgetall('TA_%s' % self.tid)
+        meta = fields.pop(self.redis_hash_meta_field, None)
+        locked = fields.pop(self.redis_hash_lock_field, None)
+        base = fields.pop(self.redis_hash_base_field, None)
+        version = fields.pop(self.redis_hash_version_field, None)
+        if meta is None:
+            return None
+
+        versions = [fields]
+        base_tids = base.split(',') if base else []
+        if base_tids:
+            pipe = self.redis.pipeline(transaction=False)
+            for base_tid in base_tids:
+                pipe.hgetall('TA_%s' % base_tid)
+            versions.extend(pipe.execute())
+            missing_tids = [base_tid for base_tid, fields in zip(base_tids, versions[1:]) if not fields]
+            if missing_tids:
+                # Base versions expire together with their newest version, so they have been deleted or evicted.
+                logger.warning('Transaction %s can not be loaded, its base versions %s are missing.',
+                               self.tid, ', '.join(missing_tids))
+                return None
+
+        self.bytes_read += len(meta) + sum(len(value) for fields in versions for value in fields.itervalues())
+        data = self.codec.loads(meta)
+        raw = self.merge_versions(versions)
+        data['compo_store'] = ComponentStore(raw, loads=self.codec.loads)
+        if locked:
+            data['locked'] = True
+        self.base_tids = tuple(base_tids)
+        self.stored_version, self.stored_fields, self.stored_meta = version, dict(raw), meta
+        return data
+
+    @classmethod
+    def merge_versions(cls, versions):
+        """Reconstruct the encoded compo_infos of a version of the redis_hash store from its own hash fields and those
+        of its base versions.
+
+        :param versions: The hash fields of the version followed by those of its base versions, nearest first.
+        :returns: A dict of encoded compo_infos by component id.
+        """
+        prefix = cls.redis_hash_component_prefix
+        prefix_len = len(prefix)
+        raw = {}
+        for fields in reversed(versions):
+            for field, value in fields.iteritems():
+                if field.startswith(prefix):
+                    raw[field[prefix_len:]] = value
+        return dict((cid, value) for cid, value in raw.iteritems() if value != cls.redis_hash_tombstone)
+
     @property
     def data(self):
         """
@@ -371,26 +1663,32 @@ class Transaction(MutableMapping):
 
         store_type = self.request.registry.settings.get('epfl.transaction.store')
         if store_type in ['redis', 'redis_context']:
-
             if store_type == 'redis_context':
                 with self.redis_context() as redis:
-                    data = redis.get('TA_%s' % self.tid)
-            else:
-                data = self.redis.get('TA_%s' % self.tid)
-            if data:
-                self._data = pickle.loads(data)
-                self._data_original = pickle.loads(data)
+                    self._data = self.load_redis(redis)
             else:
-                self._data = default_data
-                self._data_original = deepcopy(self._data)
-            if not self.is_clean:
-                raise Exception("There has been an error in the transaction system.")
+                self._data = self.load_redis(self.redis)
+            self._data = self._data or default_data
+            self.stored_tid = self.tid
+            self.reset_journal()
+            return self._data
+        elif store_type == 'redis_hash':
+            self._data = self.load_redis_hash()
+            # A transaction that does not exist yet has to be written completely on its first store.
+            self.stored_tid = self.tid if self._data else None
+            self._data = self._data or default_data
+            self.reset_journal()
             return self._data
         elif store_type == 'memory':
-            self._data = deepcopy(self.memory.setdefault('TA_%s' % self.tid, default_data))
+            payload = self.memory.get_payload('TA_%s' % self.tid)
+            self._data = default_data
+            if payload is not None:
+                self.bytes_read += len(payload)
+                self._data = self.memory.codec.loads(payload)
             if self._data == default_data:
                 self.created = True
-            self._data_original = deepcopy(self._data)
+            self.stored_tid = self.tid
+            self.reset_journal()
             return self._data
         else:
             raise Exception('No valid transaction store found!')
@@ -400,47 +1698,74 @@ class Transaction(MutableMapping):
         """
         Delete the transaction from its respective Storage.
         """
-        del self._data
-        del self._data_original
+        self._data = None
+        self.component_depths.clear()
+        self.child_indexes.clear()
+        self.reset_journal()
 
         store_type = self.request.registry.settings.get('epfl.transaction.store')
-        if store_type == 'redis':
-            self.redis.delete('TA_%s' % self.tid)
+        if store_type in ['redis', 'redis_hash']:
+            self.redis.delete('TA_%s' % self.tid, 'TA_%s_locked' % self.tid)
         elif store_type == 'redis_context':
             with self.redis_context() as redis:
-                redis.delete('TA_%s' % self.tid)
+                redis.delete('TA_%s' % self.tid, 'TA_%s_locked' % self.tid)
         elif store_type == 'memory':
             del self.memory['TA_%s' % self.tid]
         else:
             raise Exception('No valid transaction store found!')
 
+    @property
+    def redis_backend(self):
+        """
+        Pooled redis connections configured by epfl.transaction.url, epfl.transaction.pool_size and
+        epfl.transaction.pool_timeout. Returns a singleton :class:`RedisBackend`.
+        """
+        if getattr(self.request.registry, 'transaction_redis_backend', None) is None:
+            self.request.registry.transaction_redis_backend = RedisBackend.from_settings(self.request.registry.settings)
+        return self.request.registry.transaction_redis_backend
+
     @property
     def redis(self):
         """
-        Redis storage abstraction layer. Returns a singleton with get, delete and set methods.
+        Redis storage abstraction layer. Returns a singleton client using the connection pool of
+        :attr:`redis_backend`.
         """
         if getattr(self.request.registry, 'transaction_redis', None) is None:
-            redis_url = self.request.registry.settings.get('epfl.transaction.url')
-            if not redis_url:
-                raise Exception('Transaction redis url not set!')
-            self.request.registry.transaction_redis = StrictRedis.from_url(redis_url)
+            self.request.registry.transaction_redis = self.redis_backend.client
         return self.request.registry.transaction_redis
 
+    @property
+    def codec(self):
+        """
+        Codec used to encode the data for the redis stores, configured by epfl.transaction.codec and
+        epfl.transaction.compression. Returns a singleton :class:`~solute.epfl.core.epflcodec.TransactionCodec`.
+        """
+        if getattr(self.request.registry, 'transaction_codec', None) is None:
+            self.request.registry.transaction_codec = TransactionCodec.from_settings(self.request.registry.settings)
+        return self.request.registry.transaction_codec
+
     @property
     def memory(self):
         """
-        Memory storage abstraction layer. Returns a singleton dictionary.
+        Memory storage abstraction layer. Returns a singleton :class:`MemoryStore`, a new one if anything else has been
+        put in its place.
         """
-        if getattr(self.request.registry, 'transaction_memory', None) is None:
-            self.request.registry.transaction_memory = {}
+        if not isinstance(getattr(self.request.registry, 'transaction_memory', None), MemoryStore):
+            self.request.registry.transaction_memory = MemoryStore.from_settings(self.request.registry.settings,
+                                                                                 self.codec)
         return self.request.registry.transaction_memory
 
     @property
     def is_clean(self):
         """
-        Returns true if the transaction has not been changed.
+        Returns true if the change journal did not record any changes since the last load or store.
         """
-        return self._data == self._data_original
+        self.collect_changes()
+        return not self._dirty_components and not self._dirty_keys
 
     def redis_context(self):
-        raise NotImplementedError('You have to implement this method!')
+        """
+        Context manager providing the redis client used by the redis_context store. Uses :attr:`redis_backend` by
+        default, overwrite it to provide your own client handling.
+        """
+        return self.redis_backend.context()
@@ -13,10 +13,13 @@ import solute.epfl
 from solute.epfl import core
 import threading
 import functools
+import bisect
 import itertools
 from os import getpid
 import hashlib
 import inspect
+import string
+import types
 
 # statsd is preferred over pystatsd since the latter is apparently not maintained any longer.
 use_statsd = True
@@ -38,13 +41,90 @@ def generate_cid():
     return COMPONENT_COUNTER_PREFIX + "_" + str(getpid()) + "_" + str(COMPONENT_COUNTER.next())
 
 
+BASE62_DIGITS = string.digits + string.ascii_letters
+
+
+def base62(number):
+    """Returns the base62 representation of a non negative integer, using digits and ascii letters only.
+    """
+    digits = []
+    while True:
+        number, digit = divmod(number, 62)
+        digits.append(BASE62_DIGITS[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
 def generate_dynamic_class_id():
     """Generates a dynamic class id using next(), which is an atomic operation on itertools.count() generators.
     """
     return str(DYNAMIC_CLASS_COUNTER.next())
 
 
-def log_timing(key, timing, server=None, port=None, request=None):
+#: Builtin types whose instances can not be changed in place.
+IMMUTABLE_TYPES = frozenset([str, unicode, int, long, float, bool, complex, types.NoneType])
+
+
+def is_immutable(value):
+    """Returns True if the given value is guaranteed to be unchangeable in place. Tuples and frozensets are immutable if
+    all their items are. Everything else, including instances of custom classes, is treated as mutable.
+    """
+    value_type = type(value)
+    if value_type in IMMUTABLE_TYPES:
+        return True
+    if value_type is tuple or value_type is frozenset:
+        for item in value:
+            if not is_immutable(item):
+                return False
+        return True
+    return False
+
+
+def freeze(value):
+    """Returns a hashable representation of value that is equal for equal values. Dicts, lists, tuples and sets are
+    converted recursively, descriptors and unbound components are represented by their pickle state. Raises a
+    TypeError if value contains anything else that is not hashable.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return dict, tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if value_type is list or value_type is tuple:
+        return value_type, tuple(freeze(item) for item in value)
+    if value_type is set or value_type is frozenset:
+        return value_type, frozenset(freeze(item) for item in value)
+    if isinstance(value, (core.epfldescriptor.Descriptor, core.epflcomponentbase.UnboundComponent)):
+        return value_type, freeze(value.__getstate__())
+    hash(value)
+    return value
+
+
+def longest_increasing_subsequence(sequence):
+    """Returns the indices of a longest strictly increasing subsequence of sequence in O(n log n).
+    """
+    tails, tail_indices, predecessors = [], [], []
+    for i, value in enumerate(sequence):
+        length = bisect.bisect_left(tails, value)
+        if length == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[length] = value
+            tail_indices[length] = i
+        predecessors.append(tail_indices[length - 1] if length else None)
+
+    indices = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.append(i)
+        i = predecessors[i]
+    indices.reverse()
+    return indices
+
+
+def get_statsd_client(server=None, port=None, request=None):
+    """Returns a statsd client for the given server and port, defaulting to epfl.performance_log.server and
+    epfl.performance_log.port.
+    """
     if not server or not port:
         if not request:
             request = threadlocal.get_current_request()
@@ -56,11 +136,30 @@ def log_timing(key, timing, server=None, port=None, request=None):
             port = int(settings.get('epfl.performance_log.port'))
 
     if use_statsd:
-        client = statsd.StatsClient(server, port)
-    else:
-        client = pystatsd.Client(server, port)
+        return statsd.StatsClient(server, port)
+    return pystatsd.Client(server, port)
 
-    client.timing(key, timing)
+
+def get_performance_log_key(request, lifecycle_name):
+    """Returns the statsd key for a value of the current route, formatted according to epfl.performance_log.prefix.
+    """
+    return request.registry.settings.get(
+        'epfl.performance_log.prefix',
+        'epfl.performance.{route_name}.{lifecycle_name}'
+    ).format(
+        host=socket.gethostname().replace('.', '_'),
+        fqdn=socket.getfqdn().replace('.', '_'),
+        route_name=request.matched_route.name.replace('.', '_'),
+        lifecycle_name=lifecycle_name.replace('.', '_'),
+    )
+
+
+def log_timing(key, timing, server=None, port=None, request=None):
+    get_statsd_client(server, port, request).timing(key, timing)
+
+
+def log_gauge(key, value, server=None, port=None, request=None):
+    get_statsd_client(server, port, request).gauge(key, value)
 
 
 class Lifecycle(object):
@@ -210,6 +309,127 @@ class StaticUrlFactory(object):
             return cls.hash_cache[absolute_path]
 
 
+class AssetManifest(object):
+    """Registry of the static assets of all component and page classes. Every asset gets an integer id in the order it
+    is first registered, so the assets already loaded by a transaction can be kept as a bitset. Assets are registered
+    for every class at discover time, processes running the same code therefore assign the same ids. Since a process
+    may still register assets in a different order, e.g. for dynamic classes, every bitset has to be stored together
+    with the :meth:`fingerprint` of the ids it refers to.
+    """
+    assets = []  #: Asset keys by id, either (asset_spec, name) tuples or external urls.
+    asset_ids = {}  #: Asset ids by key.
+    fingerprints = []  #: Fingerprint of the first n + 1 assets at index n.
+    manifests = {}  #: Ordered asset ids by asset_spec and asset list.
+    bundled_ids = {}  #: Asset ids by list of bundled assets.
+    lock = threading.Lock()
+
+    asset_names = ('js_name', 'js_name_no_bundle', 'css_name', 'css_name_no_bundle')
+
+    @classmethod
+    def get_asset_key(cls, asset_spec, sub_name):
+        """
+        :param asset_spec: The asset_spec of the class the asset is listed by.
+        :param sub_name: The asset as listed, either a name relative to asset_spec, an (asset_spec, name) tuple or an
+                         external url.
+        :returns: The key identifying the asset in the manifest.
+        """
+        if type(sub_name) is not tuple:
+            sub_name = asset_spec, sub_name
+        if sub_name[1].startswith('//') or sub_name[1].startswith('http://') or sub_name[1].startswith('https://'):
+            return sub_name[1]
+        return sub_name
+
+    @classmethod
+    def register(cls, asset):
+        """
+        :param asset: The key of an asset as returned by :meth:`get_asset_key`.
+        :returns: The id of the asset, registering it if it is new.
+        """
+        try:
+            return cls.asset_ids[asset]
+        except KeyError:
+            pass
+        with cls.lock:
+            if asset not in cls.asset_ids:
+                previous = cls.fingerprints[-1] if cls.fingerprints else ''
+                cls.fingerprints.append(hashlib.md5(previous + repr(asset)).hexdigest()[:16])
+                cls.assets.append(asset)
+                cls.asset_ids[asset] = len(cls.assets) - 1
+            return cls.asset_ids[asset]
+
+    @classmethod
+    def register_class(cls, compo_cls):
+        """Register all assets of a component or page class.
+        """
+        for name in cls.asset_names:
+            cls.get_class_manifest(compo_cls, name)
+
+    @classmethod
+    def get_class_manifest(cls, compo_cls, name):
+        """Resolves the asset list of a component or page class into asset ids. The result is cached by the content of
+        the list, so classes extended by the webasset bundles after discovery are resolved again.
+
+        :param compo_cls: The component or page class.
+        :param name: Name of the asset list, e.g. css_name or js_name.
+        :returns: Tuple of asset ids in the order they are listed.
+        """
+        name_list = getattr(compo_cls, name, [])
+        if type(name_list) is not list:
+            name_list = [name_list]
+        asset_spec = getattr(compo_cls, 'asset_spec', None)
+        key = asset_spec, tuple(name_list)
+        try:
+            return cls.manifests[key]
+        except KeyError:
+            pass
+
+        ids = []
+        for sub_name in name_list:
+            asset_id = cls.register(cls.get_asset_key(asset_spec, sub_name))
+            if asset_id not in ids:
+                ids.append(asset_id)
+        cls.manifests[key] = tuple(ids)
+        return cls.manifests[key]
+
+    @classmethod
+    def get_bundled_ids(cls, bundled_names):
+        """
+        :param bundled_names: List of (asset_spec, name) tuples contained in the webasset bundles of a page.
+        :returns: frozenset of the ids of the bundled assets.
+        """
+        key = tuple(bundled_names)
+        try:
+            return cls.bundled_ids[key]
+        except KeyError:
+            cls.bundled_ids[key] = frozenset(cls.register(cls.get_asset_key(None, asset)) for asset in bundled_names)
+            return cls.bundled_ids[key]
+
+    @classmethod
+    def fingerprint(cls, count):
+        """
+        :param count: Number of assets, e.g. the bit length of a bitset.
+        :returns: The fingerprint identifying the first count assets of this manifest, None if fewer assets are
+                  registered, e.g. for a bitset written by a process that registered more of them.
+        """
+        if not count:
+            return ''
+        if count > len(cls.fingerprints):
+            return None
+        return cls.fingerprints[count - 1]
+
+    @classmethod
+    def get_static_url(cls, page, asset_id):
+        """
+        :param page: The :class:`epflpage.Page` instance of the current request.
+        :param asset_id: The id of the asset.
+        :returns: The static url of the asset, see :meth:`StaticUrlFactory.create_static_url`.
+        """
+        asset = cls.assets[asset_id]
+        if type(asset) is not tuple:
+            return asset
+        return StaticUrlFactory.create_static_url(page, asset[1], asset[0])
+
+
 def get_page_classes_from_route(request, route_name):
     """
     Given the request and a route-name, it collects all Page-Objects that are bound to this route.
@@ -304,9 +524,15 @@ class Discover(object):
     def discover_component(cls, input_class):
         if input_class in cls.discovered_components_set:
             return
-        if not getattr(input_class, '__epfl_do_not_track', False):
-            cls.discovered_components.append(input_class)
-            cls.discovered_components_set.add(input_class)
+        if getattr(input_class, '__epfl_do_not_track', False):
+            # Dynamic classes are not tracked but interned, they only have to be discovered once as well.
+            if input_class.__dict__.get('__epfl_discovered', False):
+                return
+            input_class.discover()
+            setattr(input_class, '__epfl_discovered', True)
+            return
+        cls.discovered_components.append(input_class)
+        cls.discovered_components_set.add(input_class)
         input_class.discover()
 
     @classmethod
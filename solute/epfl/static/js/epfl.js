@@ -30,6 +30,7 @@ epfl_module = function () {
     epfl.show_please_wait_counter = 0;
     epfl.flush_queue = [];
     epfl.flush_queue_active = false;
+    epfl.conflict_retries = 3;
 
     epfl.init_page = function (opts) {
         $("body").append("<div id='epfl_please_wait'><i class='fa fa-spinner fa-spin fa-5x text-primary'></i></div>");
@@ -38,6 +39,7 @@ epfl_module = function () {
         epfl.new_tid(opts["tid"], true);
         epfl.ptid = opts["ptid"];
         epfl.log_time = opts["log_time"];
+        epfl.parallel_requests = opts["parallel_requests"];
         $(document).attr("data:tid", epfl.tid);
         epfl.init_struct();
         epfl.after_response();
@@ -99,6 +101,7 @@ epfl_module = function () {
             if (parts.hasOwnProperty(part_name)) {
                 if (part_name == "js") continue;
                 if (part_name == "prefetch") continue;
+                if (part_name == "keep") continue;
                 var part_html = parts[part_name];
                 var epflid = cid;
                 if (part_name != "main") {
@@ -113,6 +116,9 @@ epfl_module = function () {
                 if (parts["prefetch"]) {
                     $.ajax(parts["prefetch"], {async: false});
                 }
+                if (part_name == "main" && parts["keep"]) {
+                    epfl.keep_components(el, parts_jq, parts["keep"]);
+                }
                 el.replaceWith(parts_jq);
                 epfl.init_struct();
             }
@@ -120,6 +126,62 @@ epfl_module = function () {
         eval(parts["js"]);
     };
 
+    epfl.keep_components = function (el, parts_jq, keep) {
+        // Patched redraws contain placeholders for unchanged components, their existing DOM is moved into the new one.
+        for (var i = 0; i < keep.length; i++) {
+            var selector = "[epflid='" + keep[i] + "']";
+            var kept = el.find(selector);
+            if (kept.length == 0) {
+                epfl.console_log("Kept element not found!", keep[i]);
+                continue;
+            }
+            parts_jq.find(selector + "[data-epfl-keep]").replaceWith(kept.first());
+        }
+    };
+
+    epfl.update_structure = function (cid, update) {
+        // Structural update of the children of a container: Rows are removed, inserted from the given markup or moved
+        // next to a sibling. The rows are the children of the closest common ancestor of two children.
+        var el = $("[epflid='" + cid + "']");
+        var first = el.find("[epflid='" + update.children[0] + "']");
+        var second = el.find("[epflid='" + update.children[1] + "']");
+        if (first.length == 0 || second.length == 0) {
+            epfl.console_log("Element not found!", cid, update);
+            return;
+        }
+        var rows_parent = first.parents().has(second[0]).first();
+        var get_row = function (child) {
+            var row = child.parentsUntil(rows_parent).last();
+            return row.length ? row : child;
+        };
+
+        for (var i = 0; i < update.remove.length; i++) {
+            var removed = el.find("[epflid='" + update.remove[i] + "']");
+            if (removed.length) {
+                get_row(removed).remove();
+            }
+        }
+
+        var rows = $(update.rows).filter("*");
+        for (i = 0; i < update.place.length; i++) {
+            var selector = "[epflid='" + update.place[i][0] + "']";
+            var row = rows.filter(function () {
+                return $(this).is(selector) || $(this).find(selector).length > 0;
+            }).first();
+            if (row.length == 0) {
+                row = get_row(el.find(selector));
+            }
+            var sibling = get_row(el.find("[epflid='" + update.place[i][2] + "']"));
+            if (update.place[i][1] == "before") {
+                sibling.before(row);
+            } else {
+                sibling.after(row);
+            }
+        }
+        epfl.init_struct();
+        eval(update.js);
+    };
+
     epfl.hide_component = function (cid) {
         $("[epflid='" + cid + "']").replaceWith("<div epflid='" + cid + "'></div>");
     };
@@ -181,7 +243,9 @@ epfl_module = function () {
         return epfl.post_event(queue, sync, callback_func);
     };
 
-    epfl.post_event = function (queue, sync, callback_func, unqueued) {
+    epfl.post_event = function (queue, sync, callback_func, unqueued, parallel, retries) {
+        var retrying = false;
+        retries = retries || 0;
 
         return $.ajax({
             url: location.href,
@@ -227,21 +291,31 @@ epfl_module = function () {
                     callback_func(data);
                 }
                 epfl.after_response();
-                if (unqueued) {
+                if (unqueued || parallel) {
                     return;
                 }
                 epfl.hide_please_wait(true);
             },
             error: function (httpRequest, message, errorThrown) {
+                if (httpRequest.status == 409 && retries < epfl.conflict_retries) {
+                    // A concurrent request changed the same data, repeat the events on the current state. The server
+                    // already ran the event handlers once, they run again for the repeated events.
+                    retrying = true;
+                    return;
+                }
                 epfl.show_message({"msg": "Server Error: " + errorThrown, "typ": "error", "fading": true});
                 console.log('error on ajax request: ', httpRequest, message, errorThrown);
-                if (unqueued) {
+                if (unqueued || parallel) {
                     return;
                 }
                 epfl.hide_please_wait(true);
             },
             complete: function (jqXHR, status) {
-                if (unqueued) {
+                if (retrying) {
+                    epfl.post_event(queue, sync, callback_func, unqueued, parallel, retries + 1);
+                    return;
+                }
+                if (unqueued || parallel) {
                     return;
                 }
                 epfl.flush_queue_active = false;
@@ -259,6 +333,15 @@ epfl_module = function () {
         epfl.post_event([epflevent], false, callback_func, true);
     };
 
+    epfl.send_parallel = function (epflevent, callback_func) {
+        // Sends an event independent of the queue, its changes are merged with those of concurrent requests by the
+        // server. Falls back to epfl.send unless epfl.parallel_requests is enabled.
+        if (!epfl.parallel_requests) {
+            return epfl.send(epflevent, callback_func);
+        }
+        epfl.post_event([epflevent], false, callback_func, false, true);
+    };
+
     epfl.enqueue = function (epflevent) {
         epfl.queue.push(epflevent);
     };
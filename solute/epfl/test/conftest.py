@@ -4,6 +4,7 @@ import inspect
 import os
 
 from solute.epfl.core.epflcomponentbase import ComponentBase, ComponentContainerBase
+from solute.epfl.core.epfltransaction import RedisBackend
 from solute.epfl import get_epfl_jinja2_environment, includeme, epflpage, components
 from pyramid_jinja2 import get_jinja2_environment
 
@@ -138,6 +139,25 @@ def pyramid_xhr_req(pyramid_req):
     return pyramid_req
 
 
+@pytest.fixture
+def redis_req(pyramid_req):
+    """Fixture to access a pyramid mock request using the redis_hash transaction store on an empty fake redis server.
+
+    :param pyramid_req: Mocked pyramid request.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeStrictRedis()
+    client.flushall()
+
+    pyramid_req.registry.settings['epfl.transaction.store'] = 'redis_hash'
+    pyramid_req.registry.settings['epfl.transaction.url'] = 'redis://localhost:6379'
+    backend = RedisBackend.from_settings(pyramid_req.registry.settings)
+    backend.client = client
+    pyramid_req.registry.transaction_redis_backend = backend
+    pyramid_req.registry.transaction_redis = client
+    return pyramid_req
+
+
 @pytest.fixture
 def page(pyramid_req):
     """Fixture to access a mocked EPFL Page setup with a pyramid mock request.
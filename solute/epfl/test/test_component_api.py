@@ -4,8 +4,10 @@ from solute.epfl import components
 
 from component_asserts import AssertCoherence, AssertRendering, AssertStyle
 
-from solute.epfl.core.epflcomponentbase import ComponentBase, ComponentContainerBase
-from solute.epfl.core.epfldescriptor import CompoStateAttribute
+from solute.epfl.core.epflcomponentbase import ComponentBase, ComponentContainerBase, ComponentView
+from solute.epfl.core.epfltransaction import Transaction
+from solute.epfl.core import epflpage
+from solute.epfl.core.epfldescriptor import CompoStateAttribute, FastCompoStateAttribute
 
 
 pytestmark = pytest.mark.component_api
@@ -170,3 +172,169 @@ def test_new_style_deprecation_protection(page):
 
     with pytest.raises(Exception):
         page()
+
+
+def test_dynamic_class_interning(page):
+    def get_text(self):
+        return 'formatted'
+
+    page.root_node = ComponentContainerBase(
+        node_list=[
+            components.Text(cid='text_1', value='first', tag='h1'),
+            components.Text(cid='text_2', value='second', tag='h2'),
+            components.Text(cid='text_3', value='third', tag='h3', get_text=get_text),
+            components.Text(cid='text_4', value='fourth', tag='h4', get_text=get_text),
+            components.Text(cid='text_5', value='fifth', template_name='text/text.html'),
+        ]
+    )
+    page.handle_transaction()
+
+    # Plain values are set per instance, the class of the component is not changed.
+    assert type(page.text_1) is components.Text
+    assert type(page.text_2) is components.Text
+    assert (page.text_1.value, page.text_1.tag) == ('first', 'h1')
+    assert (page.text_2.value, page.text_2.tag) == ('second', 'h2')
+
+    # Methods are set on a dynamic class which is shared by all components with the same class config.
+    assert type(page.text_3) is type(page.text_4)
+    assert type(page.text_3) is not components.Text
+    assert type(page.text_5) not in [components.Text, type(page.text_3)]
+    assert page.text_3.get_text() == page.text_4.get_text() == 'formatted'
+    assert (page.text_3.value, page.text_3.tag) == ('third', 'h3')
+    assert (page.text_4.value, page.text_4.tag) == ('fourth', 'h4')
+
+    # Each component keeps its own unbound component to be recreated from.
+    assert page.text_4.__unbound_component__.__unbound_config__['value'] == 'fourth'
+
+    page.text_1.value = 'changed'
+    assert page.text_1.value == 'changed'
+    assert page.text_2.value == 'second'
+
+    # The interned class survives the next request.
+    text_3_class = type(page.text_3)
+    page.transaction.instances.clear()
+    assert type(page.text_3) is text_3_class
+    assert page.text_3.value == 'third'
+
+
+def test_fast_compo_state_accessors(page):
+    class OverwritingComponent(components.Text):
+        def set_state_attr(self, key, value):
+            super(OverwritingComponent, self).set_state_attr(key, value)
+            self.compo_info['compo_state']['last_key'] = key
+
+    page.root_node = ComponentContainerBase(
+        node_list=[components.Text(cid='text'), OverwritingComponent(cid='overwriting')]
+    )
+    page.handle_transaction()
+
+    assert isinstance(components.Text.__dict__['value'], FastCompoStateAttribute)
+    assert type(OverwritingComponent.__dict__['value']) is CompoStateAttribute
+
+    transaction = page.transaction
+    transaction.get_dirty_components().clear()
+    assert page.text.value is None
+    assert page.text.visible is True
+    assert 'text' not in transaction.get_dirty_components()
+
+    page.text.value = 'foo'
+    assert page.text.value == 'foo'
+    assert 'text' in transaction.get_dirty_components()
+
+    # Mutable values are handed out by get_state_attr, which records them if they are changed in place.
+    page.text.value = ['foo']
+    transaction.get_dirty_components().clear()
+    assert page.text.value == ['foo']
+    assert 'text' not in transaction.get_dirty_components()
+    page.text.value.append('bar')
+    assert page.text.value == ['foo', 'bar']
+    assert 'text' in transaction.get_dirty_components()
+
+    page.overwriting.value = 'foo'
+    assert page.overwriting.compo_info['compo_state']['last_key'] == 'value'
+
+
+def get_view_rows(*args, **kwargs):
+    return [{'id': i, 'text': 'row %s' % i} for i in range(5)]
+
+
+def test_component_views(page):
+    """Component views read stored values without instantiating the component, everything else promotes them.
+    """
+    page.root_node = ComponentContainerBase(
+        node_list=[components.SelectableList(cid='list', get_data=get_view_rows, default_child_cls=components.Link),
+                   components.Form(cid='form', node_list=[components.Text(cid='plain'),
+                                                          components.TextInput(cid='input', name='input',
+                                                                               default='x')])]
+    )
+    page.handle_transaction()
+    page.transaction.store()
+
+    transaction = Transaction(page.request, None, page.transaction.tid)
+    page = epflpage.Page(None, page.request, transaction)
+    views = transaction.get_component_instance(page, 'list').components.views()
+    assert [view.id for view in views] == range(5)
+    assert views[1].text == 'row 1'
+    assert views[1]._component_class is components.Link
+    assert set(transaction.instances) == {'list'}
+
+    # Methods, mutable values and writes need the instance.
+    assert views[0].get_values() == {}
+    assert views[1].validators == []
+    views[2].text = 'changed'
+    assert set(transaction.instances) == {'list', views[0].cid, views[1].cid, views[2].cid}
+    assert views[2].text == 'changed'
+
+    form = transaction.get_component_instance(page, 'form')
+    assert form.registered_names.keys() == ['input']
+    assert set(transaction.instances) == {'list', 'form', views[0].cid, views[1].cid, views[2].cid}
+    assert form.get_values() == {'input': 'x'}
+    assert 'plain' not in transaction.instances
+    assert repr(ComponentView(page, 'input')) == '<ComponentView of input>'
+
+
+def get_changing_rows(*args, **kwargs):
+    return [{'id': i, 'text': 'changed %s' % i} for i in range(3)]
+
+
+def test_disable_auto_update(page):
+    """Children created with disable_auto_update are recreated instead of updated in place.
+    """
+    page.root_node = ComponentContainerBase(
+        node_list=[components.ListLayout(cid='list', get_data=get_view_rows,
+                                         default_child_cls=components.Link(disable_auto_update=True))]
+    )
+    page.handle_transaction()
+
+    cids = [compo.cid for compo in page.list.components]
+    assert page.list.get_child_class(cids[0]).disable_auto_update is True
+    assert page.list.components[0].disable_auto_update is True
+
+    page.list.get_data = get_changing_rows
+    page.list.update_children(force=True)
+    assert [compo.text for compo in page.list.components] == ['changed 0', 'changed 1', 'changed 2']
+    assert not set(cids) & set(compo.cid for compo in page.list.components)
+
+
+class SetupComponent(components.Text):
+    def setup_component(self):
+        super(SetupComponent, self).setup_component()
+        self.value = 'set up'
+
+
+def test_lifecycle_subscriptions(page):
+    """The page calls lifecycle hooks only on components whose class implements them.
+    """
+    page.root_node = ComponentContainerBase(node_list=[components.Text(cid='text'), SetupComponent(cid='setup')])
+    page.handle_transaction()
+
+    assert components.Text.subscribed_lifecycle_hooks == frozenset()
+    assert SetupComponent.subscribed_lifecycle_hooks == {'setup_component'}
+    assert ComponentContainerBase.subscribed_lifecycle_hooks == {'after_event_handling'}
+    assert page.setup.value == 'set up'
+
+    transaction = page.transaction
+    assert transaction.get_lifecycle_subscribers('setup_component') == [page.setup]
+    del transaction.instances['setup']
+    assert transaction.get_lifecycle_subscribers('setup_component') == []
+    assert transaction.get_lifecycle_subscribers('after_event_handling') == [page.root_node]
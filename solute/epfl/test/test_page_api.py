@@ -6,8 +6,11 @@ import inspect
 
 from pyramid import testing
 
-from solute.epfl import extract_static_assets_from_components
+from solute.epfl import extract_static_assets_from_components, includeme
 from solute.epfl.core.epflassets import ModelBase
+from solute.epfl.core.epfltransaction import Transaction
+from solute.epfl import components
+from solute.epfl.core import epflpage
 from solute.epfl.core.epflpage import Page
 from solute.epfl.core.epflpage import MissingEventTargetException
 from solute.epfl.core.epflcomponentbase import MissingEventHandlerException
@@ -683,6 +686,72 @@ def test_page_init_transaction_handling(pyramid_req, another_route):
     assert page_reload.transaction.tid == page.transaction.tid
 
 
+def test_page_handle_transaction_without_changes(pyramid_req):
+    """ handling a stored transaction again without any events must not record changes in it. """
+    page = Page(None, pyramid_req)
+    page.root_node = ComponentContainerBase
+    page.handle_transaction()
+    assert 'root_node' in page.transaction.get_dirty_components()
+    page.transaction.store()
+
+    pyramid_req.params = {'tid': page.transaction.tid}
+    page_reload = Page(None, pyramid_req)
+    page_reload.root_node = ComponentContainerBase
+    page_reload.handle_transaction()
+
+    assert page_reload.transaction.tid == page.transaction.tid
+    assert page_reload.transaction.get_dirty_keys() == set()
+    assert page_reload.transaction.is_clean
+
+
+def get_read_only_rows(*args, **kwargs):
+    return [{'id': i, 'text': 'row %s' % i} for i in range(5)]
+
+
+class ReadOnlyPage(Page):
+    root_node = ComponentContainerBase(
+        node_list=[components.SelectableList(cid='list', get_data=get_read_only_rows,
+                                             default_child_cls=components.Link),
+                   components.Form(cid='form', node_list=[
+                       components.TextInput(cid='input', name='input', default='x'),
+                       components.Select(cid='select', name='select', options=[{'value': 1, 'visual': 'one'}])])])
+
+
+def test_page_render_without_changes(pyramid_req, monkeypatch):
+    """ rendering a stored transaction again reads mutable values of its components, but must not record them as
+    changed. """
+    page = ReadOnlyPage(None, pyramid_req)
+    page()
+
+    stored_changes = []
+    store = Transaction.store
+
+    def recording_store(transaction, *args, **kwargs):
+        stored_changes.append(set(transaction.get_dirty_components()))
+        return store(transaction, *args, **kwargs)
+
+    monkeypatch.setattr(Transaction, 'store', recording_store)
+    pyramid_req.params = {'tid': page.transaction.tid}
+    page = ReadOnlyPage(None, pyramid_req)
+    response = page()
+
+    assert 'row 4' in response.text
+    assert page.select.options == [{'value': 1, 'visual': 'one'}]
+    assert stored_changes == [set()]
+
+    # Changing a mutable value in place is still recorded.
+    page.select.options.append({'value': 2, 'visual': 'two'})
+    assert page.transaction.get_dirty_components() == {'select'}
+
+
+def test_parallel_requests_setting():
+    """ parallel requests are only safe with the redis_hash store, any other store is rejected at config load. """
+    config = testing.setUp(settings={'epfl.parallel_requests': 'true', 'epfl.transaction.store': 'redis'})
+    with pytest.raises(Exception) as excinfo:
+        includeme(config)
+    assert 'redis_hash' in str(excinfo.value)
+
+
 def test_page_call_ajax(pyramid_req):
     page = Page(None, pyramid_req)
 
@@ -884,3 +953,203 @@ def test_js_helper_methods(pyramid_req, function_name, kwargs, snippet_in_respon
 def test_add_js_response(pyramid_req):
     # XXX: add test for the tuple parameter variant, if relevant
     pass
+
+
+class PageWithStaticRoot(Page):
+    root_node = ComponentContainerBase(node_list=[ComponentBase(cid='title')])
+
+
+def test_component_namespace(pyramid_req):
+    """Components are resolved by the components namespace, attributes of the page take precedence over cids.
+    """
+    page = PageWithStaticRoot(None, pyramid_req)
+    assert PageWithStaticRoot.root_node is page.root_node
+    assert page.root_node.__unbound_cls__ is ComponentContainerBase
+    page.handle_transaction()
+
+    assert isinstance(PageWithStaticRoot.__dict__['root_node'], epflpage.ComponentAttribute)
+    assert isinstance(page.root_node, ComponentContainerBase)
+    assert page.root_node is page.components.root_node is page.components['root_node'] is page['root_node']
+    assert 'title' in page.components
+    assert page.title == 'Empty Page'
+    assert page.components.title.cid == 'title'
+    assert page.components.model is None
+    with pytest.raises(AttributeError):
+        page.missing
+
+
+def test_asset_manifest(pyramid_req):
+    """Static assets are resolved to ids per class. The assets loaded by a transaction are kept as a bitset, so only
+    the assets of newly rendered component classes are imported again.
+    """
+    from solute.epfl.components import Button
+    from solute.epfl.core.epflutil import AssetManifest
+
+    page = Page(None, pyramid_req)
+    page.root_node = ComponentContainerBase
+    page.handle_transaction()
+    page.transaction['rendered_assets'] = 0
+    page.render()
+
+    page_ids = AssetManifest.get_class_manifest(Page, 'js_name')
+    button_ids = AssetManifest.get_class_manifest(Button, 'js_name')
+    assert page_ids and button_ids
+    assert page.transaction.rendered_classes.keys() == [type(page.root_node)]
+    assert page.get_loaded_assets() == sum(1 << asset_id for asset_id in page_ids
+                                           + AssetManifest.get_class_manifest(Page, 'css_name'))
+    assert page.transaction['rendered_assets_manifest'] == AssetManifest.fingerprint(
+        page.transaction['rendered_assets'].bit_length())
+
+    page.root_node.add_component(Button(cid='button', value='Button'))
+    page.button.render()
+    button_urls = [AssetManifest.get_static_url(page, asset_id) for asset_id in button_ids]
+    assert page.get_names('js_name') == [AssetManifest.get_static_url(page, asset_id)
+                                         for asset_id in page_ids + button_ids]
+    assert page.get_names('js_name', only_fresh_names=True) == button_urls
+    assert all(url in page.get_js_imports(only_fresh_imports=True) for url in button_urls)
+    assert page.get_names('js_name', only_fresh_names=True) == []
+
+    # A bitset written with a different manifest is not trusted, everything is imported again.
+    page.transaction['rendered_assets_manifest'] = 'other'
+    assert page.get_loaded_assets() == 0
+    assert len(page.get_names('js_name', only_fresh_names=True)) == len(page_ids + button_ids)
+
+    # A bitset written by a process that registered more assets is not trusted either.
+    page.transaction['rendered_assets'] = 1 << len(AssetManifest.assets) + 10
+    page.transaction['rendered_assets_manifest'] = 'other'
+    assert AssetManifest.fingerprint(len(AssetManifest.assets) + 11) is None
+    assert page.get_loaded_assets() == 0
+    assert page.get_names('js_name', only_fresh_names=True) == page.get_names('js_name')
+
+
+def test_patch_redraws(pyramid_req):
+    """Redraws in patch mode keep the DOM of components whose output did not change since it was sent to the client.
+    """
+    from solute.epfl.components import Text
+
+    pyramid_req.registry.settings['epfl.patch_redraws'] = True
+
+    def next_request(page):
+        page.transaction.store()
+        pyramid_req.params = {'tid': page.transaction.tid}
+        pyramid_req.is_xhr = False
+        page = Page(None, pyramid_req)
+        page.handle_transaction()
+        pyramid_req.is_xhr = True
+        return page
+
+    page = Page(None, pyramid_req)
+    page.root_node = ComponentContainerBase(node_list=[
+        ComponentContainerBase(cid='box', node_list=[Text(cid='text_a', value='A'), Text(cid='text_b', value='B')]),
+        ComponentContainerBase(cid='other_box', node_list=[Text(cid='text_c', value='C')]),
+    ])
+    page.handle_transaction()
+    page.render()
+    assert sorted(page.root_node.get_redraw_parts().keys()) == ['js', 'main']
+
+    # Only the changed text is sent, the others are kept by the client.
+    page = next_request(page)
+    page.text_a.value = 'Changed'
+    page.root_node.redraw()
+    out = page.render()
+    parts = page.root_node.get_redraw_parts()
+    assert parts['keep'] == ['text_b', 'other_box']
+    assert 'Changed' in parts['main'] and '>B<' not in parts['main'] and '>C<' not in parts['main']
+    assert u"<div epflid='text_b' data-epfl-keep='1'></div>" in parts['main']
+    assert "epfl.replace_component('root_node'" in out and '"keep":["text_b","other_box"]' in out
+
+    page = next_request(page)
+    page.root_node.redraw()
+    page.render()
+    assert page.root_node.get_redraw_parts()['keep'] == ['box', 'other_box']
+
+    # Components removed from the DOM of the client while their container was hidden are sent again.
+    page = next_request(page)
+    page.other_box.set_hidden()
+    page.root_node.redraw()
+    page.render()
+    assert page.root_node.get_redraw_parts()['keep'] == ['box']
+
+    page = next_request(page)
+    page.other_box.set_visible()
+    page.root_node.redraw()
+    page.render()
+    parts = page.root_node.get_redraw_parts()
+    assert parts['keep'] == ['box']
+    assert '>C<' in parts['main']
+
+    # Without patch mode the full output is sent.
+    page = next_request(page)
+    page.patch_redraws = False
+    page.root_node.redraw()
+    page.render()
+    assert sorted(page.root_node.get_redraw_parts().keys()) == ['js', 'main']
+
+
+text_rows = []
+
+
+def get_text_rows(*args, **kwargs):
+    return [dict(row) for row in text_rows]
+
+
+def test_structure_updates(pyramid_req):
+    """Data driven changes to the children of a list are sent as structural operations, only inserted children are
+    rendered.
+    """
+    from solute.epfl.components import ListLayout, Text
+
+    def next_request(page):
+        page.transaction.store()
+        pyramid_req.params = {'tid': page.transaction.tid}
+        pyramid_req.is_xhr = False
+        page = Page(None, pyramid_req)
+        pyramid_req.is_xhr = True
+        page.handle_transaction()
+        return page
+
+    text_rows[:] = [{'id': i, 'value': 'row %s' % i} for i in range(5)]
+    page = Page(None, pyramid_req)
+    page.root_node = ComponentContainerBase(node_list=[
+        ListLayout(cid='rows', get_data=get_text_rows, default_child_cls=Text, data_interface={'id': None,
+                                                                                               'value': None})
+    ])
+    page.handle_transaction()
+    page.render()
+    cids = page.rows.compo_struct[:]
+    assert page.transaction.get_component('rows')['shell']
+
+    # Appending a row renders it alone and places it after the last one.
+    text_rows.append({'id': 5, 'value': 'row 5'})
+    page = next_request(page)
+    page.rows.update_children(force=True)
+    update = page.rows.get_structure_update()
+    new_cid = page.rows.compo_struct[-1]
+    assert update['remove'] == []
+    assert update['place'] == [[new_cid, 'after', cids[-1]]]
+    assert update['rows'].startswith('<li>') and 'row 5' in update['rows'] and 'row 4' not in update['rows']
+    assert [cid for cid in cids + [new_cid] if page.components[cid].is_rendered] == [new_cid]
+
+    out = page.render()
+    assert "epfl.update_structure('rows'" in out
+    assert "epfl.replace_component" not in out
+    cids.append(new_cid)
+
+    # Dropping a row and moving another one to the front.
+    text_rows.insert(0, text_rows.pop(3))
+    del text_rows[1]
+    page = next_request(page)
+    page.rows.update_children(force=True)
+    update = page.rows.get_structure_update()
+    assert update['remove'] == [cids[0]]
+    assert update['place'] == [[cids[3], 'before', cids[1]]]
+    assert update['rows'] == '' and update['js'] == ''
+
+    # A container whose own output changed is redrawn.
+    text_rows.append({'id': 6, 'value': 'row 6'})
+    page = next_request(page)
+    page.rows.compo_info['shell'] = 'changed'
+    page.rows.update_children(force=True)
+    out = page.render()
+    assert "epfl.update_structure" not in out
+    assert "epfl.replace_component('rows'" in out
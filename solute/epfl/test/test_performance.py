@@ -1,5 +1,11 @@
 import pytest
 from solute.epfl import components, epflassets, epflpage
+from solute.epfl.core.epflcodec import TransactionCodec
+from solute.epfl.core.epflcomponentbase import ComponentBase
+from solute.epfl.core.epfldescriptor import CompoStateAttribute
+from solute.epfl.core import epflutil
+from solute.epfl.core.epflutil import Discover
+import cPickle as pickle
 import time
 
 
@@ -141,3 +147,295 @@ class MyModel(epflassets.ModelBase):
             {'id': i, 'text': 'text compo %s' % i}
             for i in range(0, row_limit)
         ]
+
+
+@pytest.mark.parametrize('compo_count', [1000, 5000])
+def test_codec_performance(performance_page, compo_count):
+    """Compare encoding and decoding time and payload size of the transaction codecs on the data of a rendered page.
+    """
+    performance_page()
+    data = performance_page.transaction.data
+    compo_state = dict((cid, compo_info.get('compo_state', {}))
+                       for cid, compo_info in data['compo_store'].items())
+
+    print ""
+    print "=" * 70
+    print "Codecs on %s components." % (compo_count * 4)
+    print "=" * 70
+    for payload_name, payload in [('transaction', data), ('compo_state only', compo_state)]:
+        legacy_start = time.time()
+        legacy = pickle.dumps(payload)
+        legacy_time = time.time() - legacy_start
+        print "{0:<18} {1:<16} dumps {2:7.1f}ms {3:10} bytes".format(payload_name, 'pickle protocol 0',
+                                                                    legacy_time * 1000, len(legacy))
+        for codec, compression in [('pickle', 'none'), ('pickle', 'zlib'), ('marshal', 'none'), ('marshal', 'zlib')]:
+            transaction_codec = TransactionCodec(codec=codec, compression=compression)
+            timings = [time.time()]
+            encoded = transaction_codec.dumps(payload)
+            timings.append(time.time())
+            decoded = transaction_codec.loads(encoded)
+            timings.append(time.time())
+
+            assert decoded == payload
+            print "{0:<18} {1:<17} dumps {2:7.1f}ms loads {3:7.1f}ms {4:10} bytes".format(
+                payload_name, codec + '/' + compression, (timings[1] - timings[0]) * 1000,
+                (timings[2] - timings[1]) * 1000, len(encoded))
+    print "=" * 70
+
+
+class StateComponent(ComponentBase):
+    compo_state = ['text', 'count', 'flag', 'items']
+    text = 'text'
+    count = 0
+    flag = False
+    items = []
+
+
+class GenericStateComponent(StateComponent):
+    """Uses the generic compo_state descriptors instead of the fast ones generated by discover."""
+    pass
+
+
+@pytest.mark.parametrize('access_count', [100000])
+def test_compo_state_access_performance(page, access_count):
+    """Compare compo_state read and write throughput of the fast accessors generated by discover with the generic
+    descriptor calling get_state_attr and set_state_attr.
+    """
+    Discover.discover_component(GenericStateComponent)
+    for name in GenericStateComponent.compo_state:
+        initial_value = GenericStateComponent.__dict__[name].initial_value
+        setattr(GenericStateComponent, name, CompoStateAttribute(initial_value, name))
+
+    page.root_node = components.Box(
+        node_list=[StateComponent(cid='fast', text='stored'), GenericStateComponent(cid='generic', text='stored')]
+    )
+    page.handle_transaction()
+    fast, generic = page.fast, page.generic
+    fast.text = generic.text = 'stored'
+
+    print ""
+    print "=" * 70
+    print "compo_state accessors, %s accesses each." % access_count
+    print "=" * 70
+    results = {}
+    for compo in [generic, fast]:
+        compo_type = type(compo).__name__
+        accesses = xrange(access_count)
+        timings = [time.time()]
+        for i in accesses:
+            compo.text
+        timings.append(time.time())
+        for i in accesses:
+            compo.count
+        timings.append(time.time())
+        for i in accesses:
+            compo.count = i
+        timings.append(time.time())
+        for i in accesses:
+            compo.flag = True
+        timings.append(time.time())
+
+        assert (compo.text, compo.count, compo.flag, compo.items) == ('stored', access_count - 1, True, [])
+        results[compo_type] = [end - start for start, end in zip(timings, timings[1:])]
+        for label, runtime in zip(['read stored', 'read default', 'write', 'write unchanged'], results[compo_type]):
+            print "{0:<22} {1:<16} {2:7.1f}ms {3:12.0f}/s".format(compo_type, label, runtime * 1000,
+                                                                    access_count / max(runtime, 1e-9))
+    print "Read speedup: {0:.1f}x, write speedup: {1:.1f}x".format(
+        sum(results['GenericStateComponent'][:2]) / sum(results['StateComponent'][:2]),
+        sum(results['GenericStateComponent'][2:]) / sum(results['StateComponent'][2:]))
+    print "=" * 70
+
+
+@pytest.mark.parametrize('compo_count', [2500])
+def test_lifecycle_hook_performance(performance_page, compo_count):
+    """Compare calling the lifecycle hooks on all active components with calling them only on the components whose
+    class implements them.
+    """
+    performance_page()
+    transaction = performance_page.transaction
+    active = transaction.get_active_components()
+    assert len(active) > compo_count * 4
+
+    print ""
+    print "=" * 70
+    print "Lifecycle hooks on %s active components." % len(active)
+    print "=" * 70
+    for hook in ['setup_component', 'finalize']:
+        subscribers = transaction.get_lifecycle_subscribers(hook)
+        assert set(subscribers) == set(compo for compo in active if hook in type(compo).subscribed_lifecycle_hooks)
+        assert len(subscribers) < len(active) / 100
+
+        timings = [time.time()]
+        for compo in active:
+            getattr(compo, hook)()
+        timings.append(time.time())
+        for compo in subscribers:
+            getattr(compo, hook)()
+        timings.append(time.time())
+
+        all_time, subscribed_time = timings[1] - timings[0], timings[2] - timings[1]
+        print "{0:<16} all {1:7.1f}ms, {2:5} subscribers {3:7.1f}ms".format(hook, all_time * 1000, len(subscribers),
+                                                                           subscribed_time * 1000)
+    print "=" * 70
+
+
+class LegacyAttributePage(epflpage.Page):
+    """Resolves components in __getattribute__ for every attribute access, as pages did before."""
+
+    def __getattribute__(self, item):
+        if item not in ['components', 'transaction', '_active_initiations', 'request', 'response'] \
+                and hasattr(self, 'transaction') \
+                and self.transaction.has_component(item):
+            return self.transaction.get_component_instance(self, item)
+        return super(LegacyAttributePage, self).__getattribute__(item)
+
+    def __getattr__(self, item):
+        raise AttributeError(item)
+
+
+@pytest.mark.parametrize('access_count', [100000])
+def test_page_attribute_performance(page, access_count):
+    """Compare attribute access on a page resolving components in __getattribute__ with the regular attribute lookup
+    of the page and the components namespace.
+    """
+    page.root_node = components.Box(node_list=[components.Text(cid='text')])
+    page.handle_transaction()
+    legacy_page = LegacyAttributePage(None, page.request, page.transaction)
+    new_page = epflpage.Page(None, page.request, page.transaction)
+    assert legacy_page.text is new_page.text is new_page.components.text is new_page.components['text']
+
+    print ""
+    print "=" * 70
+    print "Page attribute access, %s accesses each." % access_count
+    print "=" * 70
+    accesses = xrange(access_count)
+    for label, access in [('page.model', lambda p: p.model),
+                          ('page.root_node', lambda p: p.root_node),
+                          ('page.render', lambda p: p.render),
+                          ('page.text', lambda p: p.text),
+                          ('page.components.text', lambda p: p.components.text)]:
+        runtimes = []
+        for current_page in [legacy_page, new_page]:
+            start = time.time()
+            for i in accesses:
+                access(current_page)
+            runtimes.append(time.time() - start)
+        print "{0:<22} legacy {1:7.1f}ms, current {2:7.1f}ms, speedup {3:.1f}x".format(
+            label, runtimes[0] * 1000, runtimes[1] * 1000, runtimes[0] / max(runtimes[1], 1e-9))
+    print "=" * 70
+
+
+@pytest.mark.parametrize('compo_count', [2500])
+def test_redraw_planning_performance(performance_page, compo_count):
+    """Compare finding the components to be redrawn in an AJAX request by sorting all active components by depth with
+    planning only from the components that requested a redraw.
+    """
+    performance_page()
+    transaction = performance_page.transaction
+    active = transaction.get_active_components()
+    for compo in active:
+        compo.redraw_requested = False
+    transaction.redraw_requests.clear()
+
+    leaf = [compo for compo in active if compo.cid != 'root_node' and not compo.compo_struct][-1]
+    leaf.redraw()
+
+    timings = [time.time()]
+    legacy = [compo.cid for compo in transaction.get_active_components(sorted_by_depth=True) if compo.redraw_requested]
+    timings.append(time.time())
+    planned = transaction.plan_redraws()
+    timings.append(time.time())
+    assert legacy == planned == [leaf.cid]
+
+    print ""
+    print "=" * 70
+    print "Redraw planning for one of %s active components." % len(active)
+    print "=" * 70
+    print "sorted by depth {0:7.2f}ms, planned {1:7.2f}ms".format((timings[1] - timings[0]) * 1000,
+                                                                 (timings[2] - timings[1]) * 1000)
+    print "=" * 70
+
+
+def legacy_get_names(page, name):
+    """The static urls of all rendered components collected per component, as done before the asset manifest.
+    """
+    names = []
+    for compo in [page] + page.get_active_components():
+        if not getattr(compo, 'is_rendered', True):
+            continue
+        name_list = getattr(compo, name)
+        if type(name_list) is not list:
+            name_list = [name_list]
+        for sub_name in name_list:
+            if type(sub_name) is not tuple:
+                sub_name = compo.asset_spec, sub_name
+            if sub_name in getattr(page, 'bundled_names', []):
+                continue
+            static_url = epflutil.StaticUrlFactory.create_static_url(page, sub_name[1], sub_name[0])
+            if static_url not in names:
+                names.append(static_url)
+    return names
+
+
+@pytest.mark.parametrize('compo_count', [2500])
+def test_asset_import_performance(performance_page, compo_count):
+    """Compare collecting the static urls of a full page render per component with resolving them from the asset
+    manifests of the rendered component classes.
+    """
+    performance_page()
+    active = performance_page.transaction.get_active_components()
+
+    timings = [time.time()]
+    legacy = legacy_get_names(performance_page, 'js_name')
+    timings.append(time.time())
+    names = performance_page.get_names('js_name')
+    timings.append(time.time())
+    assert set(legacy) == set(names)
+
+    print ""
+    print "=" * 70
+    print "Static js imports of %s active components." % len(active)
+    print "=" * 70
+    print "per component {0:7.2f}ms, per class {1:7.2f}ms".format((timings[1] - timings[0]) * 1000,
+                                                                (timings[2] - timings[1]) * 1000)
+    print "=" * 70
+
+
+list_rows = []
+
+
+def get_list_rows(*args, **kwargs):
+    return [dict(row) for row in list_rows]
+
+
+def test_structure_update_performance(page):
+    """Compare redrawing a list of 500 rows after appending a row with sending the row as a structural update.
+    """
+    list_rows[:] = [{'id': i, 'text': 'row %s' % i} for i in range(500)]
+    page.root_node = components.ListLayout(get_data=get_list_rows, row_limit=1000, default_child_cls=components.Link)
+    page.handle_transaction()
+    page.render()
+    page.transaction.store()
+
+    list_rows.append({'id': 500, 'text': 'row 500'})
+    page.request.params = {'tid': page.transaction.tid}
+    page = epflpage.Page(None, page.request)
+    page.request.is_xhr = True
+    page.handle_transaction()
+    page.root_node.update_children(force=True)
+
+    timings = [time.time()]
+    update = page.root_node.get_structure_update()
+    timings.append(time.time())
+    rendered = [compo for compo in page.root_node.components if compo.is_rendered]
+    page.root_node.render()
+    timings.append(time.time())
+    assert update is not None and len(rendered) == 1
+
+    print ""
+    print "=" * 70
+    print "Appending a row to a list of 500 rows."
+    print "=" * 70
+    print "structural update {0:7.2f}ms, redraw {1:7.2f}ms".format((timings[1] - timings[0]) * 1000,
+                                                                  (timings[2] - timings[1]) * 1000)
+    print "=" * 70
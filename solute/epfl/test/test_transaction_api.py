@@ -1,8 +1,16 @@
 import time
 import pytest
+import cPickle as pickle
 
-from solute.epfl.core.epfltransaction import Transaction
+from solute.epfl.core.epfltransaction import Transaction, TransactionConflict, ComponentStore, MemoryStore, ChildIndex
+from solute.epfl.core.epfltransaction import RedisBackend
+from solute.epfl.core.epflcodec import TransactionCodec
+from solute.epfl.core.epflanalyzer import analyze_memory_store
+from solute.epfl.core.epflcomponentbase import ComponentContainerBase
+from solute.epfl.core import epflpage
+from solute.epfl import components
 from collections2.dicts import OrderedDict
+from jinja2 import Markup
 
 
 pytestmark = pytest.mark.transaction_api
@@ -48,6 +56,39 @@ def test_basic_component_operations(pyramid_req):
     assert transaction['compo_store'].keys() == ['root_node']
 
 
+def test_component_depth(pyramid_req):
+    """Component depths are kept up to date by set_component, switch_component and del_component.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+    transaction.set_component('a', {'ccid': 'root_node'})
+    transaction.set_component('b', {'ccid': 'root_node'})
+    transaction.set_component('a_1', {'ccid': 'a'})
+    transaction.set_component('a_1_1', {'ccid': 'a_1'})
+
+    assert [transaction.get_component_depth(cid) for cid in ['root_node', 'a', 'b', 'a_1', 'a_1_1', 'x']] == \
+        [0, 1, 1, 2, 3, 0]
+
+    # Moving a component changes the depth of all its children.
+    transaction.switch_component('a_1', 'root_node')
+    assert transaction.get_component_depth('a_1') == 1
+    assert transaction.get_component_depth('a_1_1') == 2
+
+    transaction.switch_component('b', 'a')
+    transaction.switch_component('a_1', 'a')
+    assert [transaction.get_component_depth(cid) for cid in ['a', 'b', 'a_1', 'a_1_1']] == [1, 2, 2, 3]
+
+    transaction.del_component('a_1')
+    assert 'a_1_1' not in transaction.component_depths
+    assert transaction.get_component_depth('a_1_1') == 0
+
+    # The index is not stored, a fresh instance computes the same depths.
+    transaction.set_component('a_2', {'ccid': 'a'})
+    assert transaction.get_component_depth('a_2') == 2
+    transaction.store()
+    assert Transaction(pyramid_req, None, transaction.tid).get_component_depth('a_2') == 2
+
+
 def test_component_mass_insert(pyramid_req):
     """Tests for mass inserting components.
     """
@@ -112,6 +153,89 @@ def test_performance_has_and_set_component(pyramid_req):
     assert (steps[-1] - steps[-2]) / 1000 < 0.00001  # Checking if the component exists in under 0.00001s.
 
 
+def test_child_index():
+    """The child index keeps track of the positions in a plain compo_struct list.
+    """
+    struct = ['a', 'b', 'c']
+    child_index = ChildIndex(struct)
+    assert [child_index.index(cid) for cid in struct] == [0, 1, 2]
+
+    child_index.insert(None, 'd')
+    child_index.insert(1, 'e')
+    child_index.insert(-1, 'f')
+    assert struct == ['a', 'e', 'b', 'c', 'f', 'd']
+    assert [child_index.index(cid) for cid in struct] == [0, 1, 2, 3, 4, 5]
+
+    assert child_index.remove('b') == 2
+    assert struct == ['a', 'e', 'c', 'f', 'd']
+    assert [child_index.index(cid) for cid in struct] == [0, 1, 2, 3, 4]
+    assert 'b' not in child_index
+    with pytest.raises(ValueError):
+        child_index.remove('b')
+
+    # Changes done without the index are detected.
+    struct.reverse()
+    assert [child_index.index(cid) for cid in struct] == [0, 1, 2, 3, 4]
+
+
+def test_performance_child_positions(pyramid_req):
+    """Reordering a large container and looking up the positions of all children is linear.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+
+    compo_width = 10000
+    for i in range(compo_width):
+        transaction.set_component('child_node_%s' % i, {'ccid': 'root_node'})
+
+    steps = [time.time()]
+    for i in range(compo_width):
+        assert transaction.get_component_position('child_node_%s' % i) == i
+    steps.append(time.time())
+
+    # Move the last child to the front, as update_children does for a new first row.
+    transaction.switch_component('child_node_%s' % (compo_width - 1), 'root_node', position=0)
+    for i in range(compo_width - 1):
+        assert transaction.get_component_position('child_node_%s' % i) == i + 1
+    steps.append(time.time())
+
+    assert (steps[1] - steps[0]) / compo_width < 0.00002
+    assert (steps[2] - steps[1]) / compo_width < 0.00002
+
+
+def test_sleeping_components(pyramid_req):
+    """Sleeping components beyond the per container and per transaction limits are deleted, those put to sleep longest
+    ago first.
+    """
+    pyramid_req.registry.settings['epfl.transaction.max_sleeping_components'] = 5
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+    for container in ['a', 'b']:
+        transaction.set_component(container, {'ccid': 'root_node'})
+        for i in range(5):
+            transaction.set_component('%s_%s' % (container, i), {'ccid': container, 'config': {'id': i}})
+            transaction.set_component('%s_%s_child' % (container, i), {'ccid': '%s_%s' % (container, i)})
+
+    for i in range(4):
+        transaction.hibernate_component_id('a_%s' % i, max_sleeping=3)
+    assert sorted(transaction.get_component('a')['sleeping_compo_struct'].values()) == ['a_1', 'a_2', 'a_3']
+    assert not transaction.has_component('a_0')
+    assert not transaction.has_component('a_0_child')
+
+    transaction.wake_component_id('a', 1)
+    assert transaction.get_component('a')['compo_struct'] == ['a_4', 'a_1']
+    assert transaction.get_sleeping_counts() == {'a': 2}
+
+    for i in range(4):
+        transaction.hibernate_component_id('b_%s' % i, max_sleeping=0)
+    assert transaction.get_sleeping_counts() == {'a': 1, 'b': 4}
+    assert not transaction.has_component('a_2')
+
+    transaction.del_component('b')
+    assert transaction.get_sleeping_counts() == {'a': 1}
+    assert not transaction.has_component('b_3_child')
+
+
 def test_duplicated_cid_on_set_component(pyramid_req):
     """ There can be only one cid in the compo_store per transaction """
     transaction = Transaction(pyramid_req, None)
@@ -119,3 +243,786 @@ def test_duplicated_cid_on_set_component(pyramid_req):
 
     with pytest.raises(Exception):
         transaction.set_component('child_node_0', {})
+
+
+def test_change_journal(pyramid_req):
+    """The change journal has to record every change made through the component api, a store has to reset it and an
+    unchanged transaction must not be stored again.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+    transaction.set_component('child_node', {'ccid': 'root_node', 'compo_state': {'value': 'foo'}})
+
+    assert transaction.get_dirty_components() == {'root_node', 'child_node'}
+    assert 'compo_struct' in transaction.get_dirty_keys()
+    assert not transaction.is_clean
+
+    transaction.store()
+    assert transaction.is_clean
+
+    # Reading immutable values does not change anything.
+    assert transaction['route'] == 'dummy_route'
+    assert transaction.has_component('child_node')
+    assert transaction.is_clean
+
+    # Mutable values may be changed in place, they are recorded if they differ from their value on access.
+    transaction['__initialized_components__'] = set()
+    transaction.store()
+    assert 'child_node' not in transaction['__initialized_components__']
+    assert transaction.is_clean
+    transaction['__initialized_components__'].add('child_node')
+    assert transaction.get_dirty_keys() == {'__initialized_components__'}
+    transaction.store()
+
+    # Structural changes record both the component and its container.
+    transaction.set_component('other_node', {'ccid': 'root_node'})
+    transaction.store()
+    transaction.switch_component('other_node', 'root_node', position=0)
+    assert transaction.get_dirty_components() == {'other_node', 'root_node'}
+    transaction.store()
+
+    transaction.del_component('child_node')
+    assert transaction.get_dirty_components() == {'child_node', 'root_node'}
+    transaction.store()
+
+    # A reloaded transaction starts out clean.
+    reloaded = Transaction(pyramid_req, None, transaction.tid)
+    assert sorted(reloaded['compo_store'].keys()) == ['other_node', 'root_node']
+    assert reloaded.is_clean
+
+
+def test_component_store():
+    """The compo_store of the redis_hash store unpickles compo_info entries only on access.
+    """
+    raw = dict(('child_node_%s' % i, pickle.dumps({'cid': 'child_node_%s' % i}, pickle.HIGHEST_PROTOCOL))
+               for i in range(0, 10))
+    compo_store = ComponentStore(raw)
+
+    assert len(compo_store) == 10
+    assert 'child_node_3' in compo_store
+    assert compo_store.get('child_node_3') == {'cid': 'child_node_3'}
+    assert 'child_node_3' not in compo_store.raw
+    assert len(compo_store.raw) == 9
+
+    compo_store['child_node_3'] = {'cid': 'child_node_3', 'slot': None}
+    compo_store['child_node_10'] = {'cid': 'child_node_10'}
+    compo_store.pop('child_node_4')
+    assert len(compo_store) == 10
+    assert 'child_node_4' not in compo_store
+
+    # Pickling yields a plain dict.
+    unpickled = pickle.loads(pickle.dumps(compo_store))
+    assert type(unpickled) is dict
+    assert unpickled['child_node_3'] == {'cid': 'child_node_3', 'slot': None}
+    assert sorted(unpickled.keys()) == sorted(compo_store.keys())
+
+
+@pytest.mark.parametrize('codec, compression', [
+    ('pickle', 'none'),
+    ('pickle', 'zlib'),
+    ('marshal', 'none'),
+    ('marshal', 'zlib'),
+])
+def test_transaction_codec(codec, compression):
+    """Every codec has to restore the encoded data and decode payloads written by any other codec as well as plain
+    pickles as written by older versions.
+    """
+    transaction_codec = TransactionCodec(codec=codec, compression=compression, threshold=64)
+
+    plain_data = {'compo_state': {'value': u'foo', 'row_data': {}, 'visible': True}, 'compo_struct': ['a', 'b'] * 50}
+    class_data = {'class': (Transaction, {'test': None}, ('child_node', None)), 'compo_struct': ['a', 'b']}
+
+    for data in [plain_data, class_data]:
+        payload = transaction_codec.dumps(data)
+        assert transaction_codec.loads(payload) == data
+
+        for other_codec in ['pickle', 'marshal']:
+            assert TransactionCodec(codec=other_codec, compression='zlib').loads(payload) == data
+
+    assert transaction_codec.loads(pickle.dumps(class_data)) == class_data
+    assert len(transaction_codec.dumps({})) < 64
+
+
+class CustomString(str):
+    pass
+
+
+@pytest.mark.parametrize('codec', ['pickle', 'marshal'])
+def test_transaction_codec_str_subclasses(codec):
+    """Subclasses of builtin types have to keep their type, marshal would silently restore them as their base type.
+    """
+    transaction_codec = TransactionCodec(codec=codec, compression='none')
+
+    data = {'compo_state': {'label': Markup(u'<b>foo</b>'), 'name': CustomString('bar')}, 'items': [CustomString('x')]}
+    loaded = transaction_codec.loads(transaction_codec.dumps(data))
+
+    assert loaded == data
+    assert type(loaded['compo_state']['label']) is Markup
+    assert type(loaded['compo_state']['name']) is CustomString
+    assert type(loaded['items'][0]) is CustomString
+
+
+def test_store_as_new(pyramid_req):
+    """Storing under a new transaction id keeps the previously stored state locked under the old id without loading it
+    again.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {'compo_state': {'value': 'old'}})
+    transaction.store()
+    old_tid = transaction.tid
+
+    transaction = Transaction(pyramid_req, None, old_tid)
+    transaction.get_component('root_node')['compo_state']['value'] = 'new'
+    transaction.mark_component_dirty('root_node')
+    transaction.store_as_new()
+    transaction.store()
+    assert transaction.tid != old_tid
+
+    locked_transaction = Transaction(pyramid_req, None, old_tid)
+    assert locked_transaction['locked'] is True
+    assert locked_transaction.get_component('root_node')['compo_state']['value'] == 'old'
+
+    new_transaction = Transaction(pyramid_req, None, transaction.tid)
+    assert 'locked' not in new_transaction
+    assert new_transaction.get_component('root_node')['compo_state']['value'] == 'new'
+
+    # Changing a locked transaction stores it under yet another id.
+    locked_transaction['foo'] = 'bar'
+    locked_transaction.store()
+    assert locked_transaction.tid not in [old_tid, transaction.tid]
+    assert Transaction(pyramid_req, None, old_tid)['locked'] is True
+
+
+def test_memory_store():
+    """The memory store returns private copies, evicts least recently used entries beyond its limits, expires entries
+    after the timeout and counts all of it.
+    """
+    store = MemoryStore(TransactionCodec(), timeout=1800, max_entries=3)
+
+    data = {'compo_store': {'root_node': {'compo_state': {'value': []}}}}
+    store['TA_1'] = data
+    data['compo_store']['root_node']['compo_state']['value'].append('changed')
+    copy = store.get('TA_1')
+    assert copy == {'compo_store': {'root_node': {'compo_state': {'value': []}}}}
+    copy['compo_store'].clear()
+    assert store.get('TA_1') != copy
+
+    store['TA_2'] = {}
+    store['TA_3'] = {}
+    store.get('TA_1')
+    store['TA_4'] = {}
+    assert 'TA_1' in store
+    assert 'TA_2' not in store
+    assert store.get('TA_2') is None
+    assert len(store) == 3
+
+    store.max_bytes = store.size - 1
+    store['TA_4'] = {}
+    assert len(store) == 2
+    assert 'TA_3' not in store
+
+    store.max_bytes = 0
+    store.timeout = -1
+    store['TA_5'] = {}
+    assert store.get('TA_5') is None
+
+    del store['TA_1']
+    assert 'TA_1' not in store
+
+    assert store.stats() == {'entries': 1, 'bytes': store.size, 'hits': 3, 'misses': 2, 'evictions': 2,
+                             'expirations': 1}
+
+
+def test_merge_versions():
+    """Versions of the redis_hash store only containing changes are reconstructed from their base versions, nearest
+    base first.
+    """
+    base_base = {'m': 'meta', 'l': '1', 'c:a': 'a0', 'c:b': 'b0', 'c:c': 'c0'}
+    base = {'m': 'meta', 'l': '1', 'b': 'base_base', 'c:a': 'a1', 'c:c': Transaction.redis_hash_tombstone}
+    version = {'b': 'base,base_base', 'c:b': 'b2', 'c:d': 'd2'}
+
+    assert Transaction.merge_versions([base_base]) == {'a': 'a0', 'b': 'b0', 'c': 'c0'}
+    assert Transaction.merge_versions([base, base_base]) == {'a': 'a1', 'b': 'b0'}
+    assert Transaction.merge_versions([version, base, base_base]) == {'a': 'a1', 'b': 'b2', 'd': 'd2'}
+
+
+def test_merge_meta():
+    """Top level keys changed by concurrent requests are merged, conflicting changes raise a TransactionConflict.
+    """
+    loaded = {'route': 'home', 'rendered_extra_content': set(['a', 'b']), 'foo': 1, 'bar': 1}
+    theirs = {'route': 'home', 'rendered_extra_content': set(['a', 'b', 'c']), 'foo': 2, 'bar': 1}
+    ours = {'route': 'home', 'rendered_extra_content': set(['a', 'd']), 'foo': 1, 'baz': 1}
+
+    assert Transaction.merge_meta(loaded, theirs, ours) == {'route': 'home',
+                                                            'rendered_extra_content': set(['a', 'c', 'd']),
+                                                            'foo': 2,
+                                                            'baz': 1}
+    assert Transaction.merge_meta(loaded, loaded, ours) == ours
+    assert Transaction.merge_meta(loaded, theirs, loaded) == theirs
+
+    with pytest.raises(TransactionConflict):
+        Transaction.merge_meta(loaded, theirs, dict(ours, foo=3))
+
+    # Bitsets get the bits set and cleared by both sides.
+    assert Transaction.merge_meta({'rendered_assets': 0b0011},
+                                  {'rendered_assets': 0b0111},
+                                  {'rendered_assets': 0b1001}) == {'rendered_assets': 0b1101}
+    assert Transaction.merge_meta({}, {'rendered_assets': 0b01}, {'rendered_assets': 0b10}) == {'rendered_assets': 0b11}
+
+    # Dicts get the entries added by both sides, like the class table.
+    assert Transaction.merge_meta({}, {'__class_table__': {'a': 1}}, {'__class_table__': {'b': 2}}) == {
+        '__class_table__': {'a': 1, 'b': 2}}
+    with pytest.raises(TransactionConflict):
+        Transaction.merge_meta({}, {'__class_table__': {'a': 1}}, {'__class_table__': {'a': 2}})
+
+
+def change_value(transaction, cid, value):
+    transaction.get_component(cid)['compo_state']['value'] = value
+    transaction.mark_component_dirty(cid)
+
+
+def test_redis_backend():
+    """All redis clients share a blocking connection pool configured by the settings.
+    """
+    with pytest.raises(Exception):
+        RedisBackend.from_settings({})
+
+    backend = RedisBackend.from_settings({'epfl.transaction.url': 'redis://localhost:6379/2',
+                                          'epfl.transaction.pool_size': '5',
+                                          'epfl.transaction.pool_timeout': '3'})
+    assert (backend.pool.max_connections, backend.pool.timeout) == (5, 3)
+    assert backend.pool.connection_kwargs['db'] == 2
+    assert backend.client.connection_pool is backend.pool
+    with backend.context() as client:
+        assert client is backend.client
+
+
+@pytest.mark.parametrize('store', ['redis', 'redis_context'])
+def test_redis_store_lock(redis_req, store):
+    """The redis stores write the transaction as a single value, locking a previous copy sets its lock key in the same
+    round trip.
+    """
+    redis_req.registry.settings['epfl.transaction.store'] = store
+    transaction = Transaction(redis_req, None)
+    transaction.set_component('root_node', {'compo_state': {'value': 'old'}})
+    transaction.store()
+    old_tid = transaction.tid
+
+    redis = transaction.redis
+    assert redis.keys('TA_*') == ['TA_%s' % old_tid]
+    assert redis.ttl('TA_%s' % old_tid) > 0
+
+    # Storing under a new id locks the previous copy.
+    transaction = Transaction(redis_req, None, old_tid)
+    change_value(transaction, 'root_node', 'new')
+    transaction.store_as_new()
+    transaction.store()
+    assert sorted(redis.keys('TA_*')) == sorted(['TA_%s' % old_tid, 'TA_%s_locked' % old_tid,
+                                                 'TA_%s' % transaction.tid])
+    assert redis.ttl('TA_%s_locked' % old_tid) > 0
+
+    locked_transaction = Transaction(redis_req, None, old_tid)
+    assert locked_transaction['locked'] is True
+    assert locked_transaction.get_component('root_node')['compo_state']['value'] == 'old'
+    new_transaction = Transaction(redis_req, None, transaction.tid)
+    assert 'locked' not in new_transaction
+    assert new_transaction.get_component('root_node')['compo_state']['value'] == 'new'
+
+    # Changing a locked copy stores it under yet another id, the copy stays locked.
+    change_value(locked_transaction, 'root_node', 'branch')
+    locked_transaction.store()
+    assert locked_transaction.tid not in [old_tid, transaction.tid]
+    assert 'locked' not in Transaction(redis_req, None, locked_transaction.tid)
+    assert Transaction(redis_req, None, old_tid).get_component('root_node')['compo_state']['value'] == 'old'
+
+    # Storing with lock writes an unchanged transaction with its lock flag.
+    new_transaction.store(lock=True)
+    assert Transaction(redis_req, None, transaction.tid)['locked'] is True
+
+    del new_transaction.data
+    assert 'TA_%s' % transaction.tid not in redis.keys('TA_*')
+    assert Transaction(redis_req, None, transaction.tid)['compo_store'] == {}
+
+
+def test_redis_hash_store(redis_req):
+    """The redis_hash store writes one field per component and one for the remaining data, later stores only write
+    the changed components. Components are decoded once they are accessed.
+    """
+    transaction = Transaction(redis_req, None)
+    transaction.set_component('root_node', {'compo_state': {'value': 'root_node'}})
+    transaction.set_component('a', {'ccid': 'root_node', 'compo_state': {'value': 'a'}})
+    transaction.set_component('b', {'ccid': 'root_node', 'compo_state': {'value': 'b'}})
+    transaction['foo'] = 'bar'
+    transaction.store()
+
+    redis = transaction.redis
+    key = 'TA_%s' % transaction.tid
+    assert sorted(redis.hkeys(key)) == ['c:a', 'c:b', 'c:root_node', 'm', 'v']
+    assert redis.hget(key, 'v') == '1'
+    assert transaction.codec.loads(redis.hget(key, 'c:a')) == transaction.get_component('a')
+    assert transaction.codec.loads(redis.hget(key, 'm'))['foo'] == 'bar'
+
+    transaction = Transaction(redis_req, None, transaction.tid)
+    compo_store = transaction['compo_store']
+    assert isinstance(compo_store, ComponentStore)
+    assert sorted(compo_store.raw) == ['a', 'b', 'root_node']
+    assert transaction.get_component('a')['compo_state'] == {'value': 'a'}
+    assert sorted(compo_store.raw) == ['b', 'root_node']
+    assert transaction['foo'] == 'bar'
+
+    # Only the changed component and the version are written, untouched components stay encoded.
+    change_value(transaction, 'a', 'changed')
+    written = transaction.bytes_written
+    transaction.store()
+    assert transaction.bytes_written - written < len(redis.hget(key, 'm')) + len(redis.hget(key, 'c:a')) + 2
+    assert redis.hget(key, 'v') == '2'
+    assert sorted(compo_store.raw) == ['b', 'root_node']
+
+    # Deleted components are removed from the hash.
+    transaction.del_component('b')
+    transaction.store()
+    assert sorted(redis.hkeys(key)) == ['c:a', 'c:root_node', 'm', 'v']
+
+    transaction = Transaction(redis_req, None, transaction.tid)
+    assert sorted(transaction['compo_store'].keys()) == ['a', 'root_node']
+    assert transaction.get_component('a')['compo_state'] == {'value': 'changed'}
+    assert transaction.get_component('root_node')['compo_struct'] == ['a']
+    assert transaction.is_clean
+
+    # A new version flags the previous one as locked and only contains the changes and its base.
+    change_value(transaction, 'root_node', 'new version')
+    transaction.store_as_new()
+    transaction.store()
+    new_key = 'TA_%s' % transaction.tid
+    assert (redis.hget(key, 'l'), redis.hget(key, 'v')) == ('1', '4')
+    assert sorted(redis.hkeys(new_key)) == ['b', 'c:root_node', 'm', 'v']
+    assert redis.hget(new_key, 'b') == key[3:]
+    assert Transaction(redis_req, None, key[3:])['locked'] is True
+
+    transaction = Transaction(redis_req, None, transaction.tid)
+    assert transaction.base_tids == (key[3:], )
+    assert transaction.get_component('a')['compo_state'] == {'value': 'changed'}
+    assert transaction.get_component('root_node')['compo_state'] == {'value': 'new version'}
+
+    # Replacing the compo_store writes everything.
+    transaction['compo_store'] = dict(transaction['compo_store'].items())
+    transaction.store()
+    assert sorted(redis.hkeys(new_key)) == ['c:a', 'c:root_node', 'm', 'v']
+    assert Transaction(redis_req, None, 'missing')['compo_store'] == {}
+
+
+def test_redis_hash_versions(redis_req, caplog):
+    """Versions of the redis_hash store share the components of their base versions up to
+    epfl.transaction.max_version_depth, a version whose base versions are missing can not be loaded.
+    """
+    redis_req.registry.settings['epfl.transaction.max_version_depth'] = 2
+    transaction = Transaction(redis_req, None)
+    transaction.set_component('root_node', {'compo_state': {'value': 0}})
+    transaction.set_component('a', {'ccid': 'root_node', 'compo_state': {'value': 'a'}})
+    transaction.store()
+
+    tids = [transaction.tid]
+    for i in range(1, 4):
+        transaction = Transaction(redis_req, None, transaction.tid)
+        change_value(transaction, 'root_node', i)
+        transaction.store_as_new()
+        transaction.store()
+        tids.append(transaction.tid)
+
+    redis = transaction.redis
+    assert [redis.hget('TA_%s' % tid, 'b') for tid in tids] == [None, tids[0], '%s,%s' % (tids[1], tids[0]), None]
+    # The chain got too long, the newest version is written completely.
+    assert sorted(redis.hkeys('TA_%s' % tids[3])) == ['c:a', 'c:root_node', 'm', 'v']
+
+    # Storing a version refreshes the expiry of its base versions.
+    redis.persist('TA_%s' % tids[0])
+    transaction = Transaction(redis_req, None, tids[1])
+    change_value(transaction, 'a', 'changed')
+    transaction.store()
+    assert transaction.tid not in tids
+    assert redis.ttl('TA_%s' % tids[0]) > 0
+
+    transaction = Transaction(redis_req, None, transaction.tid)
+    assert transaction.base_tids == (tids[1], tids[0])
+    assert [transaction.get_component(cid)['compo_state']['value'] for cid in ['root_node', 'a']] == [1, 'changed']
+
+    redis.delete('TA_%s' % tids[0])
+    transaction = Transaction(redis_req, None, tids[2])
+    assert transaction['compo_store'] == {}
+    assert '__initialized_components__' not in transaction
+    assert 'base versions %s are missing' % tids[0] in caplog.text
+
+    transaction = Transaction(redis_req, None, tids[3])
+    assert transaction.get_component('root_node')['compo_state']['value'] == 3
+
+
+def store_concurrent_transactions(redis_req):
+    """Store a transaction with a root_node and two children and load it twice, like two concurrent requests do.
+    """
+    transaction = Transaction(redis_req, None)
+    transaction.set_component('root_node', {'compo_state': {'value': 'root_node'}})
+    transaction.set_component('a', {'ccid': 'root_node', 'compo_state': {'value': 'a'}})
+    transaction.set_component('b', {'ccid': 'root_node', 'compo_state': {'value': 'b'}})
+    transaction.store()
+
+    first, second = Transaction(redis_req, None, transaction.tid), Transaction(redis_req, None, transaction.tid)
+    first.data, second.data
+    return first, second
+
+
+def test_concurrent_store_merge(redis_req):
+    """Concurrent requests changing different components and top level keys of the redis_hash store are merged.
+    """
+    first, second = store_concurrent_transactions(redis_req)
+    change_value(first, 'a', 'first')
+    first['foo'] = 'first'
+    first.store()
+
+    change_value(second, 'b', 'second')
+    second['bar'] = 'second'
+    second.store()
+    assert (second['foo'], second['bar']) == ('first', 'second')
+
+    transaction = Transaction(redis_req, None, first.tid)
+    assert transaction.get_component('a')['compo_state']['value'] == 'first'
+    assert transaction.get_component('b')['compo_state']['value'] == 'second'
+    assert (transaction['foo'], transaction['bar']) == ('first', 'second')
+    assert transaction.stored_version == '3'
+
+    # Deleting a component changed by nobody else is merged as well.
+    first = Transaction(redis_req, None, first.tid)
+    first.data
+    change_value(transaction, 'a', 'again')
+    transaction.store()
+    first.del_component('b')
+    first.store()
+
+    transaction = Transaction(redis_req, None, first.tid)
+    assert transaction.get_component('a')['compo_state']['value'] == 'again'
+    assert not transaction.has_component('b')
+    assert transaction.get_component('root_node')['compo_struct'] == ['a']
+
+
+def test_concurrent_store_conflicts(redis_req):
+    """Concurrent requests changing the same component or top level key of the redis_hash store raise a
+    TransactionConflict, the stored data stays as stored by the first request.
+    """
+    first, second = store_concurrent_transactions(redis_req)
+    change_value(first, 'a', 'first')
+    first.store()
+    change_value(second, 'a', 'second')
+    with pytest.raises(TransactionConflict):
+        second.store()
+
+    # Adding components to the same container changes the compo_struct of the container on both sides.
+    first, second = Transaction(redis_req, None, first.tid), Transaction(redis_req, None, first.tid)
+    first.data, second.data
+    first.set_component('c', {'ccid': 'root_node'})
+    first.store()
+    second.set_component('d', {'ccid': 'root_node'})
+    with pytest.raises(TransactionConflict):
+        second.store()
+
+    first, second = Transaction(redis_req, None, first.tid), Transaction(redis_req, None, first.tid)
+    first.data, second.data
+    first['foo'] = 'first'
+    first.store()
+    second['foo'] = 'second'
+    with pytest.raises(TransactionConflict):
+        second.store()
+
+    # Replacing the compo_store writes everything and can not be merged.
+    first, second = Transaction(redis_req, None, first.tid), Transaction(redis_req, None, first.tid)
+    first.data, second.data
+    change_value(first, 'b', 'first')
+    first.store()
+    second['compo_store'] = dict(second['compo_store'].items())
+    with pytest.raises(TransactionConflict):
+        second.store()
+
+    transaction = Transaction(redis_req, None, first.tid)
+    assert [transaction.get_component(cid)['compo_state']['value'] for cid in 'ab'] == ['first', 'first']
+    assert transaction.get_component('root_node')['compo_struct'] == ['a', 'b', 'c']
+    assert transaction['foo'] == 'first'
+
+
+def test_concurrent_store_retry(redis_req, monkeypatch):
+    """A store interrupted by a concurrent store between reading and writing the hash is merged again, up to
+    epfl.transaction.store_attempts times.
+    """
+    first, second = store_concurrent_transactions(redis_req)
+    change_value(first, 'a', 'first')
+    first.store()
+
+    merge_concurrent_store = Transaction.merge_concurrent_store
+    interruptions = []
+
+    def interrupted_merge(transaction, *args):
+        result = merge_concurrent_store(transaction, *args)
+        if len(interruptions) < 1:
+            interruptions.append(True)
+            change_value(first, 'root_node', 'interrupted')
+            first.store()
+        return result
+
+    monkeypatch.setattr(Transaction, 'merge_concurrent_store', interrupted_merge)
+    change_value(second, 'b', 'second')
+    second.store()
+    assert interruptions == [True]
+
+    transaction = Transaction(redis_req, None, first.tid)
+    assert [transaction.get_component(cid)['compo_state']['value'] for cid in ['root_node', 'a', 'b']] == [
+        'interrupted', 'first', 'second']
+    assert transaction.stored_version == '4'
+
+    # Without attempts left the interrupted store gives up.
+    redis_req.registry.settings['epfl.transaction.store_attempts'] = 1
+    del interruptions[:]
+    first, second = Transaction(redis_req, None, first.tid), Transaction(redis_req, None, first.tid)
+    first.data, second.data
+    change_value(first, 'a', 'first again')
+    first.store()
+    change_value(second, 'b', 'second again')
+    with pytest.raises(TransactionConflict):
+        second.store()
+
+
+def test_size_report(pyramid_req):
+    """The bytes read and written are counted per request, the size report breaks the transaction down to component
+    classes and compo_state attributes.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {'class': (Transaction, {}, ('root_node', None)),
+                                            'config': {},
+                                            'compo_state': {'value': 'x' * 1000, 'visible': True}})
+    transaction.set_component('child', {'ccid': 'root_node',
+                                        'class': (ComponentStore, {}, ('child', None)),
+                                        'config': {'id': 1},
+                                        'compo_state': {'value': 'y'}})
+    transaction.hibernate_component_id('child')
+    transaction.store()
+    assert transaction.bytes_written > 1000
+    assert transaction.bytes_read == 0
+
+    transaction = Transaction(pyramid_req, None, transaction.tid)
+    transaction.data
+    assert transaction.bytes_read > 1000
+
+    report = transaction.get_size_report()
+    assert report.largest_classes()[0].name == 'Transaction'
+    assert report.largest_attributes(1)[0][1:] == ('Transaction', 'value')
+    assert report.classes['ComponentStore'].sleeping_count == 1
+    assert report.transactions[0][1:] == (transaction.tid, 2)
+
+    report = analyze_memory_store(transaction.memory)
+    assert transaction.tid in report.format()
+
+
+def test_sparse_compo_state(page):
+    """With sparse state only compo_state values differing from the component defaults are stored. Stored values of
+    transactions written without sparse state are still used.
+    """
+    page.request.registry.settings['epfl.transaction.sparse_state'] = True
+    page.root_node = ComponentContainerBase(node_list=[components.Text(cid='text', value='config value')])
+    page.handle_transaction()
+
+    text = page.text
+    text.value = 'changed'
+    text.visible = True
+    assert text.validators == []
+    page.transaction.store()
+    assert page.transaction.get_component('text')['compo_state'] == {'value': 'changed'}
+
+    # Defaults given in the config of the component are defaults as well.
+    text.value = 'config value'
+    text.visible = False
+    page.transaction.store()
+    assert page.transaction.get_component('text')['compo_state'] == {'visible': False}
+
+    transaction = Transaction(page.request, None, page.transaction.tid)
+    text = transaction.get_component_instance(epflpage.Page(None, page.request, transaction), 'text')
+    assert (text.value, text.visible, text.validators) == ('config value', False, [])
+
+    # A fully stored compo_state keeps its values until the component is compacted.
+    transaction.get_component('text')['compo_state'].update({'value': 'stored', 'visible': True})
+    assert (text.value, text.visible) == ('stored', True)
+    transaction.mark_component_dirty('text')
+    transaction.store()
+    assert transaction.get_component('text')['compo_state'] == {'value': 'stored'}
+
+
+def get_link_data(*args, **kwargs):
+    return [{'id': i, 'text': 'link %s' % i} for i in range(20)]
+
+
+def test_class_table(page):
+    """Children created from the same default_child_cls share their class and config through the class table of the
+    transaction.
+    """
+    page.root_node = ComponentContainerBase(
+        node_list=[ComponentContainerBase(cid='list', get_data=get_link_data,
+                                          default_child_cls=components.Link(event_name='select', url='/link'))]
+    )
+    page.handle_transaction()
+    page.transaction.store()
+
+    transaction = page.transaction
+    class_table = transaction['__class_table__']
+    assert len(class_table) == 1
+    class_key = class_table.keys()[0]
+    assert class_table[class_key] == (components.Link, {'event_name': 'select', 'url': '/link'})
+
+    child_cid = transaction.get_component('list')['compo_struct'][3]
+    compo_info = transaction.get_component(child_cid)
+    assert compo_info['class'] == class_key
+    assert 'url' not in compo_info['config']
+    assert transaction.get_class_state(compo_info)[:2] == (components.Link, dict(compo_info['config'],
+                                                                                 event_name='select',
+                                                                                 url='/link'))
+
+    # The class table is stored with the transaction.
+    transaction = Transaction(page.request, None, transaction.tid)
+    child = transaction.get_component_instance(epflpage.Page(None, page.request, transaction), child_cid)
+    assert (type(child), child.id, child.text, child.url) == (components.Link, 3, 'link 3', '/link')
+    assert transaction.get_size_report().classes['Link'].count == 20
+
+
+def test_compact_cids(page):
+    """With compact cids automatically generated component ids are short and unique per transaction, children of data
+    driven containers get ids derived from their data id.
+    """
+    page.request.registry.settings['epfl.transaction.compact_cids'] = True
+    page.root_node = ComponentContainerBase(
+        node_list=[components.Text(value='static'),
+                   ComponentContainerBase(cid='list', get_data=get_link_data, default_child_cls=components.Link)]
+    )
+    page.handle_transaction()
+
+    transaction = page.transaction
+    static_cid = transaction.get_component('root_node')['compo_struct'][0]
+    assert static_cid == '_1'
+    assert page.components[static_cid].value == 'static'
+    assert transaction.get_component('list')['compo_struct'][:3] == ['list-0', 'list-1', 'list-2']
+    assert transaction.get_component('list')['compo_struct'][-1] == 'list-j'
+    assert page.components['list-j'].text == 'link 19'
+
+    # Taken ids and data ids not usable in a component id are replaced by the counter.
+    transaction.set_component('_3', {'config': {}})
+    assert transaction.generate_cid() == '_2'
+    assert transaction.generate_cid() == '_4'
+    assert transaction.generate_child_cid('list', 1) == '_5'
+    assert transaction.generate_child_cid('list', 'foo bar') == '_6'
+    assert transaction.generate_child_cid('list', 'foo') == 'list-foo'
+
+
+def test_reorder_children(pyramid_req):
+    """Reordering children moves only those not part of a longest subsequence already in order, in a single change of
+    the compo_struct.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+    for cid in ['head', 'a', 'b', 'c', 'd', 'e']:
+        transaction.set_component(cid, {'ccid': 'root_node'})
+
+    assert transaction.reorder_children('root_node', ['a', 'b', 'c', 'd', 'e'], start=1) == []
+    assert transaction.reorder_children('root_node', ['e', 'a', 'b', 'c', 'd'], start=1) == ['e']
+    assert transaction.get_component('root_node')['compo_struct'] == ['head', 'e', 'a', 'b', 'c', 'd']
+    assert transaction.get_component_position('a') == 2
+
+    # Children missing in the order are kept behind the ordered ones.
+    assert sorted(transaction.reorder_children('root_node', ['d', 'c'], start=1)) == ['c', 'd']
+    assert transaction.get_component('root_node')['compo_struct'] == ['head', 'd', 'c', 'e', 'a', 'b']
+
+    with pytest.raises(ValueError):
+        transaction.reorder_children('root_node', ['a', 'a'], start=1)
+    with pytest.raises(ValueError):
+        transaction.reorder_children('root_node', ['head', 'a'], start=1)
+
+
+link_rows = []
+
+
+def get_link_rows(*args, **kwargs):
+    return [dict(row) for row in link_rows]
+
+
+def test_update_children_reconciliation(page):
+    """Children of data driven containers are matched by their id, only changed children are instantiated.
+    """
+    link_rows[:] = [{'id': i, 'text': 'link %s' % i} for i in range(10)]
+    page.root_node = ComponentContainerBase(
+        node_list=[ComponentContainerBase(cid='list', get_data=get_link_rows, default_child_cls=components.Link)]
+    )
+    page.handle_transaction()
+    page.transaction.store()
+    cids = page.transaction.get_component('list')['compo_struct'][:]
+
+    # Move the last row to the front, change one row and drop another one.
+    link_rows.insert(0, link_rows.pop())
+    link_rows[5]['text'] = 'changed'
+    del link_rows[7]
+
+    transaction = Transaction(page.request, None, page.transaction.tid)
+    container = transaction.get_component_instance(epflpage.Page(None, page.request, transaction), 'list')
+    container.update_children(force=True)
+
+    assert set(transaction.instances) == {'list', cids[4]}
+    assert transaction.instances[cids[4]].text == 'changed'
+    assert transaction.get_component('list')['compo_struct'] == [cids[9]] + cids[:6] + cids[7:9]
+    assert container.sleeping_children.keys() == [6]
+
+
+def test_add_components(page):
+    """Components added in bulk are inserted in one step and initialized once they are accessed.
+    """
+    page.root_node = ComponentContainerBase(node_list=[ComponentContainerBase(cid='list'),
+                                                       components.Text(cid='taken')])
+    page.handle_transaction()
+    transaction = page.transaction
+    container = page.list
+
+    text = components.Text(name='text')
+    cids = container.add_components([text(cid='a', value='a'), text(cid='b', value='b')])
+    assert cids == ['a', 'b']
+    cids += container.add_components([text(cid='c', default='c'), text(value='generated')], position=1)
+    assert transaction.get_component('list')['compo_struct'] == ['a', 'c', cids[3], 'b']
+    assert transaction.get_component_position('b') == 3
+    assert transaction.get_component_depth('c') == transaction.get_component_depth('list') + 1
+    assert not set(cids) & set(transaction.instances)
+    assert not set(cids) & transaction['__initialized_components__']
+
+    # Accessing a component runs its deferred init_transaction, which sets the default value.
+    assert page.c.value == 'c'
+    assert 'c' in transaction['__initialized_components__']
+    assert 'c' not in transaction['__deferred_components__']
+
+    # A taken cid fails the whole batch.
+    with pytest.raises(Exception):
+        container.add_components([text(cid='d'), text(cid='taken')])
+    assert not transaction.has_component('d')
+
+    container.components[0].delete_component()
+    transaction.del_component('b')
+    assert transaction['__deferred_components__'] == {cids[3]}
+
+
+def test_plan_redraws(pyramid_req):
+    """Only components requesting a redraw without an ancestor doing so are redrawn, in document order.
+    """
+    transaction = Transaction(pyramid_req, None)
+    transaction.set_component('root_node', {})
+    for container in ['a', 'b']:
+        transaction.set_component(container, {'ccid': 'root_node'})
+        for i in range(3):
+            transaction.set_component('%s_%s' % (container, i), {'ccid': container, 'config': {'id': i}})
+
+    transaction.redraw_requests.update(['b_2', 'a_1', 'b', 'b_0', 'a_0', 'deleted'])
+    assert transaction.plan_redraws() == ['a_0', 'a_1', 'b']
+
+    transaction.hibernate_component_id('a_0')
+    transaction.switch_component('a_1', 'a', position=0)
+    transaction.redraw_requests.discard('b')
+    assert transaction.plan_redraws() == ['a_1', 'b_0', 'b_2']
+
+    transaction.redraw_requests.add('root_node')
+    assert transaction.plan_redraws() == ['root_node']